@@ -46,6 +46,14 @@ def main():
     colour_by = ['--colour-by ANTENNA1 --cnum 64',
         '--colour-by SCAN_NUMBER --cnum 48 ']
 
+    if cfg.CAL_1GC_VISPLOTS == 'oxkat':
+        syscall = 'python3 '+cfg.TOOLS+'/plot_vis_density.py --outdir '+VISPLOTS+' '
+        syscall += '--datacol CORRECTED_DATA --corrs XX,YY '
+        syscall += '--jobs '+str(cfg.CAL_1GC_VISPLOTS_JOBS)+' '
+        syscall += '--fields '+','.join([str(field) for field in fields])+' '+myms
+        subprocess.run([syscall],shell=True)
+        return
+
 #    shadems_base = 'shadems --profile --dir '+VISPLOTS+' '
     shadems_base = 'shadems --dir '+VISPLOTS+' '
 
@@ -1,161 +1,71 @@
 #!/usr/bin/env python
 # ian.heywood@physics.ox.ac.uk
+#
+# Split the channel model images for a wsclean prefix into the components
+# within a DS9 region (written with -<suffix>) and, optionally, those
+# outside it (-<suffix>-subtracted).
+#
+# The region mask is rasterised once and reused for every channel image
+# with the same celestial WCS. Channel images are processed in parallel,
+# each in tiles of rows, with both outputs written through memory maps in
+# the same pass.
 
 
 import glob
 import numpy
-import shutil
-from astropy import wcs
-from astropy.io import fits
+import os
+import os.path as o
+import sys
+from multiprocessing import Pool
 from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 
 
-# ---------------------------------------------------------------------------------------
-
-
-def hms2deg(hms,delimiter=':'):
-
-    """ 
-    Right ascention string in hms to float in decimal degrees
-    """
-
-    h,m,s = hms.split(delimiter)
-    h = float(h)
-    m = float(m)
-    s = float(s)
-    deg = 15.0*(h+(m/60.0)+(s/3600.0))
-    return deg
+from oxkat import fits_io
+from oxkat import regions
 
 
-def dms2deg(dms,delimiter=':'):
+WCS_KEYS = ['NAXIS1','NAXIS2','CTYPE1','CTYPE2','CRVAL1','CRVAL2','CRPIX1','CRPIX2','CDELT1','CDELT2']
 
-    """
-    Declination string in dms to float in decimal degrees
-    """
-
-    d,m,s = dms.split(delimiter)
-    if d[0] == '-':
-        decsign = -1.0
-        d = float(d[1:])
-    elif d[0] == '+':
-        decsign = 1.0
-        d = float(d[1:])
-    else:
-        decsign = 1.0
-        d = float(d)
-    m = float(m)
-    s = float(s)
-    deg = decsign*(d+(m/60.0)+(s/3600.0))
+# Region masks keyed by WCS, set before the pool is created so that the
+# worker processes inherit them
+MASKS = {}
 
-    return deg
 
+# ---------------------------------------------------------------------------------------
 
-def radius2deg(radius):
-
-    """
-    String with arcsec or arcmin unit to decimal degrees
-    """
-
-    if radius[-1] == '"':
-        radius = float(radius[:-1])/3600.0
-    elif radius[-1] == "'":
-        radius = float(radius[:-1])/60.0
-    else:
-        radius = float(radius)
-
-    return radius
-
-
-def process_region_file(region_file):
-
-    """
-    Extract RA,dec,radius as floats in degrees
-    from a DS9 region file containing circles
-    """
-
-    circles = []
-
-    f = open(region_file,'r')
-    line = f.readline()
-    while line:
-        if line[0:6] == 'circle':
-            line = line.replace(' ','')
-            line = line.rstrip('\n').replace('(',' ').replace(')',' ')
-            ra,dec,radius = line.split()[1].split(',')
-            if ':' in  ra:
-                ra = hms2deg(ra)
-            else:
-                ra = float(ra)
-            if ':' in dec:
-                dec = dms2deg(dec)
-            else:
-                dec = float(dec)
-            radius = radius2deg(radius)
-            circles.append((ra,dec,radius))
-        line = f.readline()
-    f.close()
-
-    return circles
-
-
-def get_image(fits_file):
-
-    """
-    Get the image data from a FITS file
-    """
-
-    input_hdu = fits.open(fits_file)[0]
-    if len(input_hdu.data.shape) == 2:
-        image = numpy.array(input_hdu.data[:,:])
-    elif len(input_hdu.data.shape) == 3:
-        image = numpy.array(input_hdu.data[0,:,:])
-    else:
-        image = numpy.array(input_hdu.data[0,0,:,:])
 
-    return image
+def spacer():
+    print('--------------|---------------------------------------------')
 
 
-def flush_fits(image,fits_file):
+def get_wcs_key(header):
+    return tuple([header.get(key) for key in WCS_KEYS])
 
-    """
-    Write 2D numpy array image to fits_file
-    """
 
-    f = fits.open(fits_file,mode='update')
-    input_hdu = f[0]
-    if len(input_hdu.data.shape) == 2:
-        input_hdu.data[:,:] =image
-    elif len(input_hdu.data.shape) == 3:
-        input_hdu.data[0,:,:] = image
-    else:
-        input_hdu.data[0,0,:,:] = image
-    f.flush()
-
-
-def apply_circle(image,xpix,ypix,rpix):
+def split_model(fits_file,dir1_fits,subtract_fits,tile=1024):
 
     """
-    Apply a circle with values of 1, of radius rpix to xpix,ypix in image array
+    Write the parts of fits_file inside and (if subtract_fits is not
+    empty) outside the region mask for its WCS
     """
 
-    xg,yg = numpy.mgrid[int(xpix-rpix):int(xpix+rpix)+1,int(ypix-rpix):int(ypix+rpix)+1]
-    xg = xg.ravel()
-    yg = yg.ravel()
-
-    for i,j in zip(xg,yg):
-        sep = ((i-xpix)**2.0 + (j-ypix)**2.0)**0.5
-        if sep < rpix:
-            image[j,i] = 1.0
-
-    return image
-
-
-def fmt(xx):
-    return str(round(xx,5))
-
-
-def spacer():
-    print('--------------|---------------------------------------------')
+    header = fits_io.get_header(fits_file)
+    mask = MASKS[get_wcs_key(header)]
+    img = fits_io.get_image(fits_file)
+    dir1 = fits_io.create_fits(header,dir1_fits)
+    if subtract_fits != '':
+        subt = fits_io.create_fits(header,subtract_fits)
+    for r0 in range(0,img.shape[0],tile):
+        rows = img[r0:r0+tile]
+        inside = mask[r0:r0+tile]
+        dir1[r0:r0+tile] = numpy.where(inside,rows,0.0)
+        if subtract_fits != '':
+            subt[r0:r0+tile] = numpy.where(inside,0.0,rows)
+    dir1.flush()
+    if subtract_fits != '':
+        subt.flush()
+    return fits_file
 
 
 # ---------------------------------------------------------------------------------------
@@ -167,67 +77,56 @@ def main():
     parser.add_option('--region', dest = 'region_file', help = 'DS9 region file')
     parser.add_option('--prefix', dest = 'model_pattern', help = 'wsclean image prefix')
     parser.add_option('--subtract', dest = 'subtract', help = 'Produce model image with components within region subtracted (default = False)', action = 'store_true', default = False)
+    parser.add_option('-j', '--jobs', dest = 'jobs', help = 'Number of channel images to process in parallel (default = all available cores)', default = os.cpu_count())
     (options,args) = parser.parse_args()
     region_file = options.region_file
     model_pattern = options.model_pattern
     subtract = options.subtract
+    jobs = int(options.jobs)
 
-    circles = process_region_file(region_file)
+    regs = regions.read_region(region_file)
     suffix = region_file.split('/')[-1].split('.')[0]
 
     spacer()
     print('DS9 region    : '+region_file)
-    print('Contains      : '+str(len(circles))+' circles')
+    print('Contains      : '+str(len(regs))+' regions')
     print('Model suffix  : '+suffix)
     spacer()
 
     model_list = sorted(glob.glob(model_pattern+'-0*model*fits'))
+    if len(model_list) == 0:
+        print('No model images found for '+model_pattern)
+        sys.exit()
 
+    dir1_list = []
+    subtract_list = []
     for fits_file in model_list:
-
-        print('Reading       : '+fits_file)
-
-        dir1_fits = fits_file.replace(model_pattern,model_pattern+'-'+suffix)
-
+        header = fits_io.get_header(fits_file)
+        wcs_key = get_wcs_key(header)
+        if wcs_key not in MASKS:
+            if len(MASKS) > 0:
+                print('WCS differs   : '+fits_file+', making a new mask')
+            pix_regs = regions.region_pixels(regs,header)
+            for reg,pix_reg in zip(regs,pix_regs):
+                print('Masking       : '+regions.describe(reg))
+                print('              : '+regions.describe(pix_reg))
+            MASKS[wcs_key] = regions.rasterise(pix_regs,(header['NAXIS2'],header['NAXIS1']))
+        dir1_list.append(fits_file.replace(model_pattern,model_pattern+'-'+suffix))
         if subtract:
-            subtract_fits = fits_file.replace(model_pattern,model_pattern+'-'+suffix+'-subtracted')
-
-        img = get_image(fits_file)
-        mask = img*0.0
-
-        hdulist = fits.open(fits_file)
-        w = wcs.WCS(hdulist[0].header)
-        ref_pix1 = hdulist[0].header['CRPIX1']
-        ref_pix2 = hdulist[0].header['CRPIX2']
-        pixscale = hdulist[0].header['CDELT2']
-
-        for circle in circles:
-            ra = circle[0]
-            dec = circle[1]
-            coord = (ra,dec,0,0)
-            pixels = w.wcs_world2pix([coord],0)
-            radius = circle[2]
-            xpix = pixels[0][0]
-            ypix = pixels[0][1]
-            rpix = radius/pixscale
-            print('Masking       : sky '+fmt(ra)+' '+fmt(dec)+' '+fmt(radius))
-            print('              : pixel '+fmt(xpix)+' '+fmt(ypix)+' '+fmt(rpix))
-            mask = apply_circle(mask,xpix,ypix,rpix)
-
-        dir1 = img*mask
-
-        print('Writing       : '+dir1_fits)
-        shutil.copyfile(fits_file,dir1_fits)
-        flush_fits(dir1,dir1_fits)
+            subtract_list.append(fits_file.replace(model_pattern,model_pattern+'-'+suffix+'-subtracted'))
+        else:
+            subtract_list.append('')
 
-        if subtract:
-            subt = img*(1.0-mask)
-            print('Writing       : '+subtract_fits)
-            shutil.copyfile(fits_file,subtract_fits)
-            flush_fits(subt,subtract_fits)
+    spacer()
+    print('Splitting     : '+str(len(model_list))+' images, '+str(len(MASKS))+' mask(s), '+str(jobs)+' process(es)')
 
+    pool = Pool(processes=max(1,min(jobs,len(model_list))))
+    for fits_file in pool.starmap(split_model,zip(model_list,dir1_list,subtract_list)):
+        print('Split         : '+fits_file)
+    pool.close()
+    pool.join()
 
-        spacer()
+    spacer()
 
 
 if __name__ == '__main__':
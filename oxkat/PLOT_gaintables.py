@@ -7,6 +7,7 @@ import os
 import os.path as o
 import subprocess
 import sys
+from multiprocessing import Pool
 sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 
 
@@ -14,6 +15,66 @@ from oxkat import generate_jobs as gen
 from oxkat import config as cfg
 
 
+def get_jobs():
+
+    """
+    Number of plotting processes, sized to the allocation unless set
+    """
+
+    if cfg.CAL_1GC_GAINPLOTS_JOBS > 0:
+        return cfg.CAL_1GC_GAINPLOTS_JOBS
+    for env in ['SLURM_CPUS_PER_TASK','NCPUS']:
+        if os.environ.get(env,'').isdigit():
+            return int(os.environ[env])
+    return os.cpu_count()
+
+
+def table_mtime(caltab):
+
+    """
+    Latest modification time of the files that make up a table
+    """
+
+    mtimes = [o.getmtime(caltab)]
+    for root,dirs,files in os.walk(caltab):
+        mtimes += [o.getmtime(o.join(root,ff)) for ff in files]
+    return max(mtimes)
+
+
+def is_current(caltab,outputs):
+    if not all([o.isfile(output) for output in outputs]):
+        return False
+    return min([o.getmtime(output) for output in outputs]) >= table_mtime(caltab)
+
+
+def plot_ragavi(caltab,htmlname,plotname):
+    gaintype = caltab.split('.')[-1][0].upper()
+    syscall = 'ragavi-gains -g '+gaintype+' -t '+caltab+' --htmlname='+htmlname+' --plotname='+plotname
+    subprocess.run([syscall],shell=True)
+
+
+def plot_oxkat(caltab,plotname):
+    from oxkat import plot_caltable
+    plot_caltable.plot_caltable(caltab,plotname)
+
+
+def plot_one(caltab):
+    htmlname = cfg.GAINPLOTS+'/'+caltab.split('/')[-1]+'.html'
+    plotname = cfg.GAINPLOTS+'/'+caltab.split('/')[-1]+'.png'
+    if cfg.CAL_1GC_GAINPLOTS == 'oxkat':
+        outputs = [plotname]
+    else:
+        outputs = [htmlname]
+    if is_current(caltab,outputs):
+        print(outputs[0]+' is up to date, skipping')
+        return
+    if cfg.CAL_1GC_GAINPLOTS == 'oxkat':
+        plot_oxkat(caltab,plotname)
+    else:
+        plot_ragavi(caltab,htmlname,plotname)
+    print('Plotted '+caltab)
+
+
 def main():
 
 
@@ -32,18 +93,17 @@ def main():
     if exclude != '':
         exclude = glob.glob(GAINTABLES+'/'+exclude)
 
-    for caltab in caltabs:
-        if caltab not in exclude:
-            gaintype = caltab.split('.')[-1][0].upper()
-            htmlname = GAINPLOTS+'/'+caltab.split('/')[-1]+'.html'
-            plotname = GAINPLOTS+'/'+caltab.split('/')[-1]+'.png'
-            if not os.path.isfile(htmlname):
-                syscall = 'ragavi-gains -g '+gaintype+' -t '+caltab+' --htmlname='+htmlname+' --plotname='+plotname
-                subprocess.run([syscall],shell=True)
-            else:
-                print(htmlname+' exists, skipping')
+    caltabs = [caltab for caltab in caltabs if caltab not in exclude]
+    if len(caltabs) == 0:
+        return
+
+    pool = Pool(processes=min(get_jobs(),len(caltabs)))
+    pool.map(plot_one,caltabs,chunksize=1)
+    pool.close()
+    pool.join()
+
 
 if __name__ == "__main__":
 
 
-    main()
\ No newline at end of file
+    main()
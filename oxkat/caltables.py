@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Reading CASA gain tables directly with casacore, shared by the gain table
+# plots and the gain table QA. No plotting imports here, so that the QA can
+# run without matplotlib.
+
+
+import numpy
+from pyrap.tables import table
+
+
+def get_caltable_type(caltab):
+
+    """
+    Jones type (e.g. B, G, K) from the VisCal keyword, falling back
+    on the first letter of the table's extension
+    """
+
+    tt = table(caltab,ack=False)
+    keywords = tt.getkeywords()
+    tt.done()
+    viscal = keywords.get('VisCal','')
+    if viscal != '':
+        return viscal.split()[0]
+    return caltab.rstrip('/').split('.')[-1][0].upper()
+
+
+def read_caltable(caltab):
+    tt = table(caltab,ack=False)
+    colnames = tt.colnames()
+    if 'CPARAM' in colnames:
+        vals = tt.getcol('CPARAM')
+    else:
+        vals = tt.getcol('FPARAM')
+    flags = tt.getcol('FLAG')
+    times = tt.getcol('TIME')
+    ants = tt.getcol('ANTENNA1')
+    spws = tt.getcol('SPECTRAL_WINDOW_ID')
+    tt.done()
+    spwtab = table(caltab+'/SPECTRAL_WINDOW',ack=False)
+    chan_freqs = [spwtab.getcell('CHAN_FREQ',i) for i in range(0,spwtab.nrows())]
+    spwtab.done()
+    anttab = table(caltab+'/ANTENNA',ack=False)
+    names = anttab.getcol('NAME')
+    anttab.done()
+    return vals,flags,times,ants,spws,chan_freqs,names
+
+
+def grid_solutions(vals,flags,times,ants,nant):
+
+    """
+    (time, antenna, channel, correlation) grid of solutions with NaN for
+    flagged or missing solutions
+    """
+
+    utimes,tidx = numpy.unique(times,return_inverse=True)
+    grid = numpy.full((len(utimes),nant)+vals.shape[1:],numpy.nan,dtype=vals.dtype)
+    grid[tidx.ravel(),ants] = numpy.where(flags,numpy.nan,vals)
+    return grid
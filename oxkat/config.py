@@ -190,6 +190,10 @@ PRE_FIELDS = ''                      # Comma-separated list of fields to select
 PRE_SCANS = ''                       # Comma-separated list of scans to select from raw MS
 PRE_NCHANS = 1024                    # Integer number of channels for working MS
 PRE_TIMEBIN = '8s'                   # Integration time for working MS
+PRE_AVERAGE_TOOL = 'casa'            # Averaging tool for working MS, 'casa' (mstransform) or 'oxkat' (tools/average_MS.py)
+                                     # 'oxkat' requires PRE_FIELDS and PRE_SCANS to be empty
+PRE_TIMEAVG = False                  # Average working MS to PRE_TIMEBIN ('oxkat' tool only)
+PRE_AVERAGE_JOBS = 8                 # Number of worker processes for the 'oxkat' tool
 
 # Reference antennas
 CAL_1GC_REF_ANT = 'auto'             # Comma-separated list to manually specify refant(s)
@@ -209,6 +213,33 @@ CAL_1GC_PRIMARY_MODEL = 'auto'       # setjy = use setjy component model only
                                      # auto = try to find a suitable model of the field sources in data/calmodels, defer to setjy if not found
                                      # or specify the location/of/wsclean-prefix for an arbitrary model cube
 
+# Basic flagging
+CAL_1GC_BASIC_FLAGS = 'casa'         # casa = band edges, RFI ranges, autos and clipping via flagdata
+                                     # oxkat = the same flags in a single pass using tools/flag_static_MS.py
+CAL_1GC_BASIC_FLAGS_JOBS = 8         # Number of worker processes for the oxkat flagger
+
+# Calibrator autoflagging
+CAL_1GC_AUTOFLAG_CALS = 'casa'       # casa = rflag, tfcrop and extend via flagdata
+                                     # oxkat = SumThreshold using tools/flag_sumthreshold_MS.py
+CAL_1GC_AUTOFLAG_CONFIG = 'target_flagging_1.yaml' # Tricolour config in data/tricolour for the oxkat flagger
+CAL_1GC_AUTOFLAG_JOBS = 8            # Number of worker processes for the oxkat flagger
+
+# Target splitting
+CAL_1GC_SPLIT_TARGETS = 'casa'       # casa = split targets one at a time using mstransform
+                                     # oxkat = split targets in parallel using tools/split_MS.py,
+                                     #         keeping MODEL_DATA and WEIGHT_SPECTRUM as mstransform does
+CAL_1GC_SPLIT_JOBS = 4               # Number of concurrent splits for the oxkat splitter
+
+# Calibrator visibility plots
+CAL_1GC_VISPLOTS = 'shadems'         # shadems = one shadems call per field, plot and colouring
+                                     # oxkat = all plots from a single read of each field using tools/plot_vis_density.py
+CAL_1GC_VISPLOTS_JOBS = 8            # Number of worker processes for the oxkat plotter
+
+# Gain table plots
+CAL_1GC_GAINPLOTS = 'ragavi'         # ragavi = interactive HTML and PNG via ragavi-gains
+                                     # oxkat = static PNGs read directly from the tables using oxkat/plot_caltable.py
+CAL_1GC_GAINPLOTS_JOBS = 0           # Number of tables to plot at once, 0 = size to the allocation
+
 # GBK settings
 CAL_1GC_DELAYCUT = 2.5               # [now defunct] Jy at central freq. Do not solve for K on secondaries weaker than this
 CAL_1GC_FILLGAPS = 24                # Maximum channel gap over which to interpolate bandpass solutions
@@ -332,6 +363,8 @@ CAL_2GC_DELAYCAL_PARSET = DATA+'/cubical/2GC_delaycal.parset'
 CAL_3GC_PEEL_NCHAN = 32
 CAL_3GC_PEEL_BRIGGS = -0.6
 CAL_3GC_PEEL_DIR1COLNAME = 'DIR1_DATA'
+CAL_3GC_PEEL_DIR1COLDM = 'TiledShapeStMan' # Storage manager for DIR1 column, tiled to match the CubiCal chunking
+                                            # Set to '' to clone the storage manager of the DATA column
 CAL_3GC_PEEL_REGION = ''  # Specify DS9 peeling region 
                           # Leave blank to search for <fieldname>*peel*.reg in the current path
 CAL_3GC_PEEL_PARSET = DATA+'/cubical/3GC_peel.parset'
@@ -348,6 +381,8 @@ CAL_3GC_FACET_REGION = '' # Specify DS9 region to define tessel centres
 #
 
 SAVE_FLAGS = False
+SAVE_FLAGS_TOOL = 'casa'    # casa = flagmanager .flagversions tables
+                            # oxkat = bit-packed delta snapshots in <ms>.flagsnapshots using tools/flag_snapshot.py
 
 
 # ------------------------------------------------------------------------
@@ -382,6 +417,10 @@ WSC_USEWGRIDDER = True
 WSC_WGRIDDERACCURACY = 5e-5
 WSC_BDA = False
 WSC_BDAFACTOR = 10
+WSC_BDAMS = False # Write a baseline-dependent averaged copy of the MS (tools/average_MS.py) for imaging-only steps
+WSC_BDAMAXINT = 120 # Maximum averaging time in seconds for WSC_BDAMS (0 = the longest scan)
+WSC_BDAMS_JOBS = 4 # Worker processes for WSC_BDAMS
+WSC_BDAMS_CHUNKMB = 256 # Input visibilities per worker chunk in MB for WSC_BDAMS, reduced to fit WSC_ABSMEM if needed
 WSC_NOMODEL = False
 WSC_NWLAYERSFACTOR = 5
 WSC_PADDING = 1.2
@@ -440,6 +479,7 @@ MAKEMASK_BOXSIZE = 500
 MAKEMASK_SMALLBOX = 50
 MAKEMASK_ISLANDSIZE = 30000
 MAKEMASK_DILATION = 3
+MAKEMASK_BLOCKSIZE = 10              # Noise map decimation factor, 1 = full resolution
 
 
 # ------------------------------------------------------------------------
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# FITS image I/O shared by the tools.
+#
+# Images are read as memory maps, and the leading degenerate (Stokes,
+# frequency) axes are indexed away to give a 2D view of the first plane
+# rather than a copy. The maps are copy-on-write, so the returned arrays can
+# be modified in memory without touching the file.
+#
+# Output images are written directly from an array and a header, so there is
+# no need to copy the input image and then overwrite its data. The header's
+# data type is kept unless another is requested, so float32 images stay
+# float32 even if the array was computed in float64. Large outputs can be
+# streamed to disk in row tiles.
+
+
+import numpy
+import os
+from astropy.io import fits
+
+
+BITPIX_DTYPES = {8: numpy.uint8, 16: numpy.int16, 32: numpy.int32, 64: numpy.int64,
+    -32: numpy.float32, -64: numpy.float64}
+
+
+def get_header(fitsfile):
+
+    """
+    Primary header only, without reading the data
+    """
+
+    return fits.getheader(fitsfile)
+
+
+def get_data(fitsfile):
+
+    """
+    Full data array of the primary HDU as a copy-on-write memory map.
+    The file is closed on return, the map stays valid while the array is
+    referenced.
+    """
+
+    with fits.open(fitsfile,memmap=True) as hdulist:
+        data = hdulist[0].data
+    return data
+
+
+def get_image(fitsfile,plane=0):
+
+    """
+    2D view of one plane of a 2D to 5D image. For cubes, plane indexes
+    the axis after the image axes (frequency for WSClean images), and
+    any other leading axes are taken at index 0.
+    """
+
+    data = get_data(fitsfile)
+    if data.ndim == 2:
+        return data
+    index = [0]*(data.ndim-2)
+    index[-1] = plane
+    return data[tuple(index)]
+
+
+def plane_header(header):
+
+    """
+    Copy of header describing a single plane, i.e. with NAXIS3 and
+    above set to 1
+    """
+
+    header = header.copy()
+    for axis in range(3,header['NAXIS']+1):
+        header['NAXIS'+str(axis)] = 1
+    return header
+
+
+def write_fits(image,header,fitsfile,dtype=None):
+
+    """
+    Write image to a new fitsfile with header. A 2D image is given the
+    degenerate axes of the header, a cube must match the header's shape.
+    The data type is that of the header's BITPIX unless dtype is given.
+    """
+
+    header = header.copy()
+    for key in ['BSCALE','BZERO']:
+        if key in header:
+            del header[key]
+    if dtype is None:
+        dtype = BITPIX_DTYPES.get(header.get('BITPIX',-32),numpy.float32)
+    naxis = header.get('NAXIS',image.ndim)
+    if image.ndim == 2 and naxis > 2:
+        header = plane_header(header)
+        image = image.reshape((1,)*(naxis-2)+image.shape)
+    hdu = fits.PrimaryHDU(numpy.asarray(image).astype(dtype,copy=False),header=header)
+    hdu.writeto(fitsfile,overwrite=True)
+
+
+def output_header(header,dtype=None,cube=False):
+
+    """
+    Copy of header for an output image of dtype (default from BITPIX),
+    without scaling keywords, and single plane unless cube is True
+    """
+
+    if cube:
+        header = header.copy()
+    else:
+        header = plane_header(header)
+    for key in ['BSCALE','BZERO']:
+        if key in header:
+            del header[key]
+    if dtype is None:
+        dtype = BITPIX_DTYPES.get(header.get('BITPIX',-32),numpy.float32)
+    header['BITPIX'] = [bitpix for bitpix in BITPIX_DTYPES if BITPIX_DTYPES[bitpix] == dtype][0]
+    return header,dtype
+
+
+def stream_fits(tiles,header,fitsfile,dtype=None):
+
+    """
+    Write a single plane image to a new fitsfile from an iterable of 2D
+    row tiles, so the full image is never held in memory. The file is
+    written under a temporary name and renamed, so fitsfile can be one of
+    the (memory mapped) inputs.
+    """
+
+    header,dtype = output_header(header,dtype)
+    tmpfits = fitsfile+'.tmp'
+    hdu = fits.StreamingHDU(tmpfits,header)
+    for tile in tiles:
+        hdu.write(numpy.asarray(tile).astype(dtype,copy=False))
+    hdu.close()
+    os.replace(tmpfits,fitsfile)
+
+
+def create_fits(header,fitsfile,dtype=None,cube=False):
+
+    """
+    Create a fitsfile without writing its data, and return a writable
+    memory map of the image, 2D unless cube is True in which case it has
+    the full shape of header. Call flush() on the map when done.
+    """
+
+    header,dtype = output_header(header,dtype,cube)
+    nbytes = numpy.dtype(dtype).itemsize
+    for axis in range(1,header['NAXIS']+1):
+        nbytes *= header['NAXIS'+str(axis)]
+    nbytes = 2880*((nbytes+2879)//2880)
+    header.tofile(fitsfile,overwrite=True)
+    f = open(fitsfile,'rb+')
+    f.seek(len(header.tostring())+nbytes-1)
+    f.write(b'\0')
+    f.close()
+    image = map_fits(fitsfile)
+    if not cube:
+        image = image.reshape(image.shape[-2:])
+    return image
+
+
+def map_fits(fitsfile):
+
+    """
+    Writable memory map of the full data array of an existing, unscaled
+    fitsfile, e.g. one made by create_fits, for filling from several
+    processes
+    """
+
+    header = get_header(fitsfile)
+    shape = tuple([header['NAXIS'+str(axis)] for axis in range(header['NAXIS'],0,-1)])
+    dtype = numpy.dtype(BITPIX_DTYPES[header['BITPIX']]).newbyteorder('>')
+    return numpy.memmap(fitsfile,dtype=dtype,mode='r+',offset=len(header.tostring()),shape=shape)
+
+
+def flush_fits(image,fitsfile,plane=0):
+
+    """
+    Overwrite one plane of an existing fitsfile with a 2D image
+    """
+
+    f = fits.open(fitsfile,mode='update',memmap=True)
+    data = f[0].data
+    if data.ndim == 2:
+        data[:,:] = image
+    else:
+        index = [0]*(data.ndim-2)
+        index[-1] = plane
+        data[tuple(index)] = image
+    f.flush()
+    f.close()
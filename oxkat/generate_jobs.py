@@ -402,6 +402,22 @@ def generate_syscall_casa(casascript,casalogfile='',extra_args=''):
     return syscall
 
 
+def generate_syscall_flag_backup(myms,versionname,tool=cfg.SAVE_FLAGS_TOOL):
+
+    # Back up the FLAG column, via CASA's flagmanager or flag_snapshot.py
+    # (the latter should be run in a python3 / casacore container)
+
+    if tool == 'oxkat':
+        syscall = 'python3 '+cfg.TOOLS+'/flag_snapshot.py save '
+        syscall += '--versionname '+versionname+' --overwrite '
+        syscall += myms
+    else:
+        syscall = generate_syscall_casa(casascript=cfg.OXKAT+'/FLAG_casa_backup_flag_table.py',
+                    extra_args='versionname='+versionname+' mslist='+myms)
+
+    return syscall
+
+
 def generate_syscall_cubical(parset,myms,extra_args=''):
 
     # now = timenow()
@@ -659,6 +675,39 @@ def generate_syscall_predict(msname,
 
 
 
+def generate_syscall_bda(myms,
+                        datacol = 'CORRECTED_DATA',
+                        bdafactor = cfg.WSC_BDAFACTOR,
+                        bdamaxint = cfg.WSC_BDAMAXINT,
+                        jobs = cfg.WSC_BDAMS_JOBS,
+                        chunkmb = cfg.WSC_BDAMS_CHUNKMB,
+                        absmem = -1):
+
+    # Generate call to average_MS.py to write a baseline-dependent averaged
+    # copy of datacol, which ends up in the DATA column of the copy
+    # If absmem (GB) is given, the chunk size is reduced so that the workers
+    # (roughly ten chunks each, including their share of finished chunks
+    # waiting in the parent) fit into it
+
+    opms = myms.replace('.ms','_bda.ms')
+
+    if absmem > 0:
+        chunkmb = min(chunkmb,max(16,int(absmem*1024/(10*jobs))))
+
+    syscall = 'python3 '+cfg.TOOLS+'/average_MS.py '
+    syscall += '--nchans 0 '
+    syscall += '--bdafactor '+str(bdafactor)+' '
+    syscall += '--bdamaxint '+str(bdamaxint)+' '
+    syscall += '--datacol '+datacol+' '
+    syscall += '--opms '+opms+' '
+    syscall += '--jobs '+str(jobs)+' '
+    syscall += '--chunkmb '+str(chunkmb)+' '
+    syscall += '--overwrite '
+    syscall += myms
+
+    return syscall,opms
+
+
 def generate_syscall_makemask(restoredimage,
                             outfile = '',
                             thresh = cfg.MAKEMASK_THRESH,
@@ -666,6 +715,7 @@ def generate_syscall_makemask(restoredimage,
                             smallbox = cfg.MAKEMASK_SMALLBOX,
                             islandsize = cfg.MAKEMASK_ISLANDSIZE,
                             dilation = cfg.MAKEMASK_DILATION,
+                            blocksize = cfg.MAKEMASK_BLOCKSIZE,
                             zoompix = cfg.DDF_NPIX):
 
     # Generate call to MakeMask.py and dilate the result
@@ -679,6 +729,7 @@ def generate_syscall_makemask(restoredimage,
     syscall += '--boxsize='+str(boxsize)+' '
     syscall += '--smallbox='+str(smallbox)+' '
     syscall += '--islandsize='+str(islandsize)+' '
+    syscall += '--blocksize='+str(blocksize)+' '
     syscall += '--threshold='+str(thresh)+' '
     syscall += '--outfile='+str(outfile)+' '
     syscall += restoredimage
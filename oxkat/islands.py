@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Connected-component statistics for large boolean masks.
+#
+# The mask is labelled in strips of rows, in parallel threads, so only one
+# strip's worth of labels per thread is held in memory at once. Each strip
+# keeps the sizes and bounding boxes of its islands and the labels of its
+# first and last rows. Islands that touch across a strip boundary are then
+# merged with a union-find (connected components of the graph of touching
+# labels), and their sizes and bounding boxes combined.
+#
+# Connectivity is that of scipy.ndimage.label's default structure, i.e.
+# pixels sharing an edge.
+
+
+import numpy
+import os
+import scipy.ndimage
+from concurrent.futures import ThreadPoolExecutor
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+
+def label_strip(mask,row0,row1):
+
+    """
+    Sizes, bounding boxes and edge-row labels of the islands in one strip
+    """
+
+    labels,nlabels = scipy.ndimage.label(mask[row0:row1])
+    sizes = numpy.bincount(labels.ravel(),minlength=nlabels+1)[1:]
+    bboxes = numpy.zeros((nlabels,4),dtype=numpy.int64)
+    for i,sl in enumerate(scipy.ndimage.find_objects(labels)):
+        bboxes[i] = (sl[0].start+row0,sl[0].stop+row0,sl[1].start,sl[1].stop)
+    return sizes,bboxes,labels[0].copy(),labels[-1].copy()
+
+
+def island_stats(mask,strip=1024,jobs=None):
+
+    """
+    Sizes and bounding boxes of the islands in a 2D boolean mask. Bounding
+    boxes are (row_start, row_stop, col_start, col_stop), stops exclusive.
+    Islands are in no particular order.
+    """
+
+    if jobs is None:
+        jobs = os.cpu_count()
+    nrows = mask.shape[0]
+    edges = list(range(0,nrows,strip))+[nrows]
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        results = list(pool.map(label_strip,[mask]*(len(edges)-1),edges[:-1],edges[1:]))
+
+    # Offset the strip labels to make them unique over the image
+    offsets = numpy.cumsum([0]+[len(result[0]) for result in results])
+    nlabels = offsets[-1]
+    sizes = numpy.concatenate([result[0] for result in results])
+    bboxes = numpy.concatenate([result[1] for result in results])
+
+    # Pairs of labels touching across each strip boundary
+    pairs = []
+    for i in range(0,len(results)-1):
+        below = results[i][3]
+        above = results[i+1][2]
+        touching = (below > 0) & (above > 0)
+        pairs.append(numpy.stack((below[touching]-1+offsets[i],above[touching]-1+offsets[i+1]),axis=1))
+    pairs = numpy.unique(numpy.concatenate(pairs),axis=0) if len(pairs) > 0 else numpy.zeros((0,2),dtype=numpy.int64)
+
+    if len(pairs) == 0:
+        return sizes,bboxes
+
+    graph = coo_matrix((numpy.ones(len(pairs)),(pairs[:,0],pairs[:,1])),shape=(nlabels,nlabels))
+    nislands,roots = connected_components(graph,directed=False)
+    island_sizes = numpy.bincount(roots,weights=sizes,minlength=nislands).astype(numpy.int64)
+    island_bboxes = numpy.zeros((nislands,4),dtype=numpy.int64)
+    island_bboxes[:,0::2] = numpy.iinfo(numpy.int64).max
+    numpy.minimum.at(island_bboxes[:,0],roots,bboxes[:,0])
+    numpy.maximum.at(island_bboxes[:,1],roots,bboxes[:,1])
+    numpy.minimum.at(island_bboxes[:,2],roots,bboxes[:,2])
+    numpy.maximum.at(island_bboxes[:,3],roots,bboxes[:,3])
+    return island_sizes,island_bboxes
@@ -0,0 +1,351 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Bit-packed masks and a mask expression engine.
+#
+# Masks are held packed eight pixels to the byte along the rows, and can be
+# saved as FITS images or as compact .npz files (packed bits plus header).
+#
+# Expressions combine named images and masks, e.g.
+#
+#   dilate((restored > 5*noise) | (model != 0), 4) & ~region('peel.reg')
+#
+# Allowed terms are names, numbers, the arithmetic operators + - * /, the
+# comparisons > >= < <= == !=, the mask operators | & ^ ~, and the functions
+#
+#   dilate(mask, n[, element]) : dilation by an element of radius n pixels
+#   erode(mask, n[, element])  : erosion by an element of radius n pixels
+#   region('file')             : mask of the shapes in a DS9 region file
+#
+# where element is 'diamond' (the default, same as n iterations of binary
+# dilation or erosion with the 4-connected structure), 'disk' or 'square'.
+#
+# Note that as in Python | and & bind more tightly than comparisons, so
+# comparisons need brackets. Images used as masks are True where non-zero.
+#
+# The expression is evaluated in a single pass over tiles of rows. Each
+# tile reads the rows it needs from the (memory mapped) inputs, with enough
+# extra rows either side for any dilation or erosion, and only the packed
+# result is kept.
+
+
+import ast
+import numpy
+import os
+import scipy.ndimage
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from astropy.io import fits
+
+
+from oxkat import fits_io
+from oxkat import regions
+
+
+BINOPS = {
+    ast.Add: numpy.add,
+    ast.Sub: numpy.subtract,
+    ast.Mult: numpy.multiply,
+    ast.Div: numpy.divide,
+    ast.BitOr: numpy.logical_or,
+    ast.BitAnd: numpy.logical_and,
+    ast.BitXor: numpy.logical_xor
+    }
+
+MASKOPS = [ast.BitOr, ast.BitAnd, ast.BitXor]
+
+COMPAREOPS = {
+    ast.Gt: numpy.greater,
+    ast.GtE: numpy.greater_equal,
+    ast.Lt: numpy.less,
+    ast.LtE: numpy.less_equal,
+    ast.Eq: numpy.equal,
+    ast.NotEq: numpy.not_equal
+    }
+
+FUNCTIONS = ['dilate','erode','region']
+
+ELEMENTS = ['diamond','disk','square']
+
+POPCOUNT = numpy.unpackbits(numpy.arange(256,dtype=numpy.uint8)[:,None],axis=1).sum(axis=1)
+
+
+# ---------------------------------------------------------------------------------------
+
+
+def pack(mask):
+    return numpy.packbits(numpy.asarray(mask,dtype=bool),axis=-1)
+
+
+def unpack(packed,ncols):
+    return numpy.unpackbits(packed,axis=-1,count=ncols).view(bool)
+
+
+def count(packed,tile=1024):
+
+    """
+    Number of True pixels in a packed mask
+    """
+
+    return int(sum([POPCOUNT[packed[i:i+tile]].sum() for i in range(0,packed.shape[0],tile)]))
+
+
+def read_mask(maskfile,tile=1024):
+
+    """
+    Packed mask, number of columns and header from a .npz or FITS mask
+    """
+
+    if maskfile.endswith('.npz'):
+        npz = numpy.load(maskfile)
+        return npz['packed'],int(npz['ncols']),fits.Header.fromstring(str(npz['header']))
+    image = fits_io.get_image(maskfile)
+    packed = numpy.vstack([pack(image[i:i+tile] != 0) for i in range(0,image.shape[0],tile)])
+    return packed,image.shape[1],fits_io.get_header(maskfile)
+
+
+def write_mask(packed,ncols,header,outfile,tile=1024,dtype=None):
+
+    """
+    Write a packed mask to .npz or, streamed in tiles of rows, to FITS
+    """
+
+    if outfile.endswith('.npz'):
+        numpy.savez_compressed(outfile,packed=packed,ncols=ncols,header=fits_io.plane_header(header).tostring())
+    else:
+        tiles = (unpack(packed[i:i+tile],ncols) for i in range(0,packed.shape[0],tile))
+        fits_io.stream_fits(tiles,header,outfile,dtype=dtype)
+
+
+# ---------------------------------------------------------------------------------------
+
+
+def parse_expression(expr):
+    try:
+        tree = ast.parse(expr.strip(),mode='eval').body
+    except SyntaxError:
+        print('Cannot parse expression: '+expr)
+        sys.exit()
+    check_node(tree)
+    return tree
+
+
+def check_node(node):
+
+    """
+    Only permit the terms listed at the top of this file
+    """
+
+    if isinstance(node,ast.BinOp) and type(node.op) in BINOPS:
+        check_node(node.left)
+        check_node(node.right)
+    elif isinstance(node,ast.UnaryOp) and type(node.op) in [ast.USub,ast.Invert,ast.Not]:
+        check_node(node.operand)
+    elif isinstance(node,ast.Compare) and len(node.ops) == 1 and type(node.ops[0]) in COMPAREOPS:
+        check_node(node.left)
+        check_node(node.comparators[0])
+    elif isinstance(node,ast.Call) and isinstance(node.func,ast.Name) and node.func.id in FUNCTIONS:
+        if node.func.id == 'region':
+            if len(node.args) != 1 or not isinstance(node.args[0],ast.Constant) or not isinstance(node.args[0].value,str):
+                print('region() takes one quoted region file name')
+                sys.exit()
+        else:
+            if len(node.args) not in [2,3] or not isinstance(node.args[1],ast.Constant) or not isinstance(node.args[1].value,int):
+                print(node.func.id+'() takes a mask, an integer radius and optionally an element')
+                sys.exit()
+            if len(node.args) == 3 and (not isinstance(node.args[2],ast.Constant) or node.args[2].value not in ELEMENTS):
+                print('Element should be one of: '+', '.join(ELEMENTS))
+                sys.exit()
+            check_node(node.args[0])
+    elif isinstance(node,ast.Name):
+        pass
+    elif isinstance(node,ast.Constant) and isinstance(node.value,(int,float)):
+        pass
+    else:
+        print('Unsupported term in expression: '+ast.dump(node))
+        sys.exit()
+
+
+def get_names(node):
+
+    """
+    Input names referenced by a parsed expression
+    """
+
+    return [item.id for item in ast.walk(node) if isinstance(item,ast.Name) and item.id not in FUNCTIONS]
+
+
+def get_regions(node):
+    return [item.args[0].value for item in ast.walk(node) if isinstance(item,ast.Call) and item.func.id == 'region']
+
+
+def as_mask(data):
+    data = numpy.asarray(data)
+    if data.dtype == bool:
+        return data
+    return data != 0
+
+
+# ---------------------------------------------------------------------------------------
+
+
+def dilate(mask,radius,element='diamond'):
+
+    """
+    Dilate a 2D mask by a diamond, disk or square of radius pixels, from a
+    distance transform (or running maximum for the square), so the time
+    taken does not depend on the radius. The diamond gives the same result
+    as radius iterations of binary_dilation with the default structure.
+    """
+
+    mask = numpy.asarray(mask,dtype=bool)
+    if radius <= 0 or not mask.any():
+        return mask.copy()
+    if element == 'square':
+        size = 2*radius+1
+        return scipy.ndimage.maximum_filter1d(scipy.ndimage.maximum_filter1d(mask,size,axis=0),size,axis=1)
+    elif element == 'disk':
+        return scipy.ndimage.distance_transform_edt(~mask) <= radius
+    else:
+        return scipy.ndimage.distance_transform_cdt(~mask,metric='taxicab') <= radius
+
+
+def erode(mask,radius,element='diamond'):
+
+    """
+    Erode a 2D mask, treating pixels beyond the edges as False as per
+    binary_erosion
+    """
+
+    mask = numpy.pad(numpy.asarray(mask,dtype=bool),1)
+    return ~dilate(~mask,radius,element)[1:-1,1:-1]
+
+
+def dilate_strips(mask,radius,element='diamond',strip=1024,jobs=None):
+
+    """
+    Dilate a large mask in strips of rows with halos, in parallel threads
+    """
+
+    if jobs is None:
+        jobs = os.cpu_count()
+    nrows = mask.shape[0]
+    dilated = numpy.zeros(mask.shape,dtype=bool)
+    def dilate_strip(r0):
+        r1 = min(r0+strip,nrows)
+        h0 = max(r0-radius,0)
+        h1 = min(r1+radius,nrows)
+        dilated[r0:r1] = dilate(mask[h0:h1],radius,element)[r0-h0:r1-h0]
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(dilate_strip,range(0,nrows,strip)))
+    return dilated
+
+
+# ---------------------------------------------------------------------------------------
+
+
+def open_input(infile):
+
+    """
+    Input as ('image', 2D memmap) or ('mask', packed, ncols), with header
+    """
+
+    if infile.endswith('.npz'):
+        packed,ncols,header = read_mask(infile)
+        return ('mask',packed,ncols),header
+    return ('image',fits_io.get_image(infile)),fits_io.get_header(infile)
+
+
+def get_shape(source):
+    if source[0] == 'image':
+        return source[1].shape
+    return (source[1].shape[0],source[2])
+
+
+def get_rows(source,r0,r1):
+    if source[0] == 'image':
+        return source[1][r0:r1]
+    return unpack(source[1][r0:r1],source[2])
+
+
+def evaluate(node,inputs,r0,r1,nrows):
+
+    """
+    Rows r0 to r1 of a parsed expression
+    """
+
+    if isinstance(node,ast.BinOp):
+        left = evaluate(node.left,inputs,r0,r1,nrows)
+        right = evaluate(node.right,inputs,r0,r1,nrows)
+        if type(node.op) in MASKOPS:
+            left,right = as_mask(left),as_mask(right)
+        return BINOPS[type(node.op)](left,right)
+    elif isinstance(node,ast.UnaryOp):
+        operand = evaluate(node.operand,inputs,r0,r1,nrows)
+        if isinstance(node.op,ast.USub):
+            return numpy.negative(operand)
+        return numpy.logical_not(as_mask(operand))
+    elif isinstance(node,ast.Compare):
+        left = evaluate(node.left,inputs,r0,r1,nrows)
+        right = evaluate(node.comparators[0],inputs,r0,r1,nrows)
+        return COMPAREOPS[type(node.ops[0])](left,right)
+    elif isinstance(node,ast.Call) and node.func.id == 'region':
+        return regions.rasterise(inputs['region:'+node.args[0].value],(nrows,inputs['ncols']),r0,r1)
+    elif isinstance(node,ast.Call):
+        # Evaluate the argument with a halo of radius rows either side
+        radius = node.args[1].value
+        element = node.args[2].value if len(node.args) == 3 else 'diamond'
+        h0 = max(r0-radius,0)
+        h1 = min(r1+radius,nrows)
+        mask = numpy.broadcast_to(as_mask(evaluate(node.args[0],inputs,h0,h1,nrows)),(h1-h0,inputs['ncols']))
+        if node.func.id == 'dilate':
+            mask = dilate(mask,radius,element)
+        else:
+            mask = erode(mask,radius,element)
+        return mask[r0-h0:r1-h0]
+    elif isinstance(node,ast.Name):
+        return get_rows(inputs[node.id],r0,r1)
+    else:
+        return node.value
+
+
+def evaluate_expression(expr,infiles,tile=1024):
+
+    """
+    Evaluate an expression over a dict of input names and FITS or .npz
+    files. Returns the packed mask, the number of columns and the header
+    of the first input.
+    """
+
+    tree = parse_expression(expr)
+    missing = [name for name in get_names(tree) if name not in infiles]
+    if len(missing) > 0:
+        print('No input file given for: '+', '.join(missing))
+        sys.exit()
+
+    inputs = {}
+    header = None
+    shape = None
+    for name in infiles:
+        inputs[name],hdr = open_input(infiles[name])
+        if header is None:
+            header = hdr
+            shape = get_shape(inputs[name])
+        elif get_shape(inputs[name]) != shape:
+            print(infiles[name]+' does not match the shape of the first input '+str(shape))
+            sys.exit()
+    if header is None:
+        print('Please specify at least one input image')
+        sys.exit()
+
+    nrows,ncols = shape
+    inputs['ncols'] = ncols
+    for region_file in get_regions(tree):
+        inputs['region:'+region_file] = regions.region_pixels(regions.read_region(region_file),header)
+
+    packed = numpy.zeros((nrows,(ncols+7)//8),dtype=numpy.uint8)
+    for r0 in range(0,nrows,tile):
+        r1 = min(r0+tile,nrows)
+        result = evaluate(tree,inputs,r0,r1,nrows)
+        packed[r0:r1] = pack(numpy.broadcast_to(as_mask(numpy.asarray(result)),(r1-r0,ncols)))
+    return packed,ncols,header
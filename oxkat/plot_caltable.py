@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Static PNG plots of CASA gain tables, read directly with casacore.
+#
+# Solutions with more than one channel (e.g. bandpasses) are plotted against
+# frequency, others against time. Complex gains are shown as amplitude and
+# phase, real-valued solutions (e.g. delays) as FPARAM, with one panel per
+# correlation and one colour per antenna. Flagged solutions are not drawn.
+
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy
+import pylab
+
+
+from oxkat import caltables
+
+
+def plot_caltable(caltab,pngname):
+
+    """
+    Plot one gain table to pngname
+    """
+
+    vals,flags,times,ants,spws,chan_freqs,names = caltables.read_caltable(caltab)
+    gaintype = caltables.get_caltable_type(caltab)
+    nrows,nchan,ncorr = vals.shape
+    is_complex = numpy.iscomplexobj(vals)
+    vs_freq = nchan > 1
+
+    if is_complex:
+        panels = [('Amplitude',numpy.abs(vals)),('Phase [deg]',numpy.angle(vals,deg=True))]
+    else:
+        panels = [('FPARAM',vals)]
+
+    if vs_freq:
+        xvals = numpy.array([chan_freqs[spw] for spw in spws])/1e6
+        xlabel = 'Frequency [MHz]'
+    else:
+        t0 = times.min() if nrows > 0 else 0.0
+        xvals = ((times-t0)/3600.0)[:,None]
+        xlabel = 'Time [h]'
+
+    uniq_ants = numpy.unique(ants)
+    cmap = matplotlib.colormaps['gist_rainbow']
+    colours = [cmap(xx) for xx in numpy.linspace(0.0,1.0,max(len(uniq_ants),1))]
+
+    fig = pylab.figure(figsize=(7*ncorr,4*len(panels)))
+    for pp,(ylabel,yvals) in enumerate(panels):
+        for corr in range(0,ncorr):
+            ax = fig.add_subplot(len(panels),ncorr,pp*ncorr+corr+1)
+            for aa,ant in enumerate(uniq_ants):
+                rows = numpy.flatnonzero(ants == ant)
+                xx = xvals[rows].astype(numpy.float64)
+                yy = numpy.where(flags[rows,:,corr],numpy.nan,yvals[rows,:,corr])
+                if vs_freq:
+                    # One line per solution interval, broken at the end of each
+                    xx = numpy.hstack((xx,numpy.full((len(rows),1),numpy.nan))).ravel()
+                    yy = numpy.hstack((yy,numpy.full((len(rows),1),numpy.nan))).ravel()
+                    ax.plot(xx,yy,'-',color=colours[aa],lw=0.6,alpha=0.7,label=names[ant])
+                else:
+                    ax.plot(xx.ravel(),yy.ravel(),'.',color=colours[aa],ms=3,alpha=0.8,label=names[ant])
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel(ylabel)
+            ax.set_title(caltab.rstrip('/').split('/')[-1]+' ('+gaintype+') corr '+str(corr))
+    fig.tight_layout()
+    fig.savefig(pngname,bbox_inches='tight')
+    pylab.close(fig)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Radial profiles of images about an arbitrary centre, and images made
+# from radial profiles.
+#
+# Pixels are binned by their distance from the centre (rounded to the
+# nearest multiple of binsize pixels) and averaged with numpy.bincount,
+# ignoring NaNs and, optionally, masked pixels or those outside a sector of
+# position angles. Angles are in degrees counter-clockwise from the image x
+# axis, as for the region shapes in oxkat/regions.py.
+#
+# Images are processed in tiles of rows, so large images (or memory maps)
+# are never expanded to full size float64 coordinate arrays.
+
+
+import numpy
+
+
+def get_centre(shape,centre=None):
+
+    """
+    (x, y) centre in 0-based pixels, defaulting to the middle pixel
+    """
+
+    if centre is None:
+        return shape[1]//2,shape[0]//2
+    return centre
+
+
+def get_radii(shape,centre,r0,r1):
+
+    """
+    Distance from centre in pixels of every pixel in rows r0 to r1
+    """
+
+    xc,yc = centre
+    xoff = (numpy.arange(shape[1],dtype=numpy.float32)-xc)**2
+    yoff = (numpy.arange(r0,r1,dtype=numpy.float32)-yc)**2
+    return numpy.sqrt(xoff[None,:]+yoff[:,None])
+
+
+def in_sector(shape,centre,r0,r1,angles):
+
+    """
+    Which pixels in rows r0 to r1 have position angles from angles[0] to
+    angles[1], wrapping through zero if angles[0] > angles[1]
+    """
+
+    xc,yc = centre
+    xx = numpy.arange(shape[1],dtype=numpy.float32)[None,:]-xc
+    yy = numpy.arange(r0,r1,dtype=numpy.float32)[:,None]-yc
+    theta = numpy.degrees(numpy.arctan2(yy,xx)) % 360.0
+    amin,amax = angles[0] % 360.0,angles[1] % 360.0
+    if amin <= amax:
+        return (theta >= amin) & (theta <= amax)
+    return (theta >= amin) | (theta <= amax)
+
+
+def get_nbins(shape,centre,binsize):
+    xc,yc = centre
+    rmax = max([numpy.hypot(xx-xc,yy-yc) for xx in [0,shape[1]-1] for yy in [0,shape[0]-1]])
+    return int(numpy.rint(rmax/binsize))+1
+
+
+def radial_profile(image,centre=None,binsize=1.0,mask=None,angles=None,tile=1024):
+
+    """
+    Radii and mean of the finite pixels of a 2D image in each radial bin
+    (NaN for empty bins). mask, if given, is a boolean image that is True
+    for the pixels to use, and angles an optional (min, max) sector.
+    """
+
+    shape = image.shape
+    centre = get_centre(shape,centre)
+    nbins = get_nbins(shape,centre,binsize)
+    total = numpy.zeros(nbins)
+    count = numpy.zeros(nbins)
+    for r0 in range(0,shape[0],tile):
+        r1 = min(r0+tile,shape[0])
+        vals = numpy.asarray(image[r0:r1],dtype=numpy.float64)
+        valid = numpy.isfinite(vals)
+        if mask is not None:
+            valid &= numpy.asarray(mask[r0:r1],dtype=bool)
+        if angles is not None:
+            valid &= in_sector(shape,centre,r0,r1,angles)
+        bins = numpy.rint(get_radii(shape,centre,r0,r1)[valid]/binsize).astype(numpy.intp)
+        total += numpy.bincount(bins,weights=vals[valid],minlength=nbins)
+        count += numpy.bincount(bins,minlength=nbins)
+    with numpy.errstate(invalid='ignore',divide='ignore'):
+        profile = numpy.where(count > 0,total/count,numpy.nan)
+    return numpy.arange(nbins)*binsize,profile
+
+
+def profile_image(radii,profile,shape,centre=None,interpolate=False,out=None,tile=1024):
+
+    """
+    Image of the given (ny, nx) shape made from a radial profile sampled at
+    the regularly spaced radii, taking the nearest sample to each pixel or
+    interpolating linearly between samples. Written into out if given,
+    else a new float32 array.
+    """
+
+    centre = get_centre(shape,centre)
+    if out is None:
+        out = numpy.empty(shape,dtype=numpy.float32)
+    step = radii[1]-radii[0] if len(radii) > 1 else 1.0
+    for r0 in range(0,shape[0],tile):
+        r1 = min(r0+tile,shape[0])
+        radius = get_radii(shape,centre,r0,r1)
+        if interpolate:
+            out[r0:r1] = numpy.interp(radius,radii,profile)
+        else:
+            idx = numpy.rint((radius-radii[0])/step).astype(numpy.intp)
+            out[r0:r1] = profile[numpy.clip(idx,0,len(profile)-1)]
+    return out
+
+
+def azimuthal_average(image,centre=None,binsize=1.0,mask=None,angles=None,out=None,tile=1024):
+
+    """
+    Radii, radial profile and the azimuthally averaged image
+    """
+
+    radii,profile = radial_profile(image,centre,binsize,mask,angles,tile)
+    return radii,profile,profile_image(radii,profile,image.shape,centre,out=out,tile=tile)
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# DS9 region files, parsed once and rasterised onto an image grid.
+#
+# Supported shapes are circle, ellipse, box and polygon, in fk5 / icrs /
+# j2000 (sexagesimal or decimal degree centres, sizes in ", ' or degrees)
+# or image (1-based pixel) coordinates. Shapes prefixed with - are
+# exclusions and clear the pixels they cover. Ellipse and box angles are
+# taken counter-clockwise from the image x axis, which matches DS9 for
+# images with north up.
+#
+# All sky positions in a file are converted to pixels with one WCS call,
+# and each shape is rasterised by broadcasting over its bounding box only.
+
+
+import numpy
+from astropy import wcs
+
+
+SKY_SYSTEMS = ['fk5','icrs','j2000']
+
+SHAPES = ['circle','ellipse','box','polygon']
+
+
+def hms2deg(hms,delimiter=':'):
+
+    """
+    Right ascension string in hms to float in decimal degrees
+    """
+
+    h,m,s = [float(xx) for xx in hms.split(delimiter)]
+    return 15.0*(h+(m/60.0)+(s/3600.0))
+
+
+def dms2deg(dms,delimiter=':'):
+
+    """
+    Declination string in dms to float in decimal degrees
+    """
+
+    dms = dms.strip()
+    sign = -1.0 if dms[0] == '-' else 1.0
+    d,m,s = [abs(float(xx)) for xx in dms.lstrip('+-').split(delimiter)]
+    return sign*(d+(m/60.0)+(s/3600.0))
+
+
+def parse_size(size):
+
+    """
+    Size string with ", ' or d unit to float in degrees (or pixels if
+    there is no unit and the shape is in image coordinates)
+    """
+
+    size = size.strip()
+    if size[-1] == '"':
+        return float(size[:-1])/3600.0
+    elif size[-1] == "'":
+        return float(size[:-1])/60.0
+    elif size[-1] == 'd':
+        return float(size[:-1])
+    return float(size)
+
+
+def parse_shape(shape,system,params):
+
+    """
+    (shape, system, points, sizes, angle) for one region, where points is
+    an (N,2) array of centres or vertices
+    """
+
+    coords = params if shape == 'polygon' else params[0:2]
+    if system in SKY_SYSTEMS:
+        xx = [hms2deg(pp) if ':' in pp else float(pp.rstrip('d')) for pp in coords[0::2]]
+        yy = [dms2deg(pp) if ':' in pp else float(pp.rstrip('d')) for pp in coords[1::2]]
+    else:
+        xx = [float(pp)-1.0 for pp in coords[0::2]]
+        yy = [float(pp)-1.0 for pp in coords[1::2]]
+    if shape == 'polygon':
+        return (shape,system,numpy.array([xx,yy]).T,[],0.0)
+    points = numpy.array([[xx[0],yy[0]]])
+    if shape == 'circle':
+        return (shape,system,points,[parse_size(params[2])],0.0)
+    angle = float(params[4]) if len(params) > 4 else 0.0
+    return (shape,system,points,[parse_size(params[2]),parse_size(params[3])],angle)
+
+
+def read_region(region_file):
+
+    """
+    List of (shape, system, points, sizes, angle, exclude) tuples for the
+    supported shapes in a DS9 region file
+    """
+
+    regions = []
+    system = 'fk5'
+    f = open(region_file,'r')
+    for line in f:
+        for item in line.split('#')[0].split(';'):
+            item = item.strip()
+            if item.lower() in SKY_SYSTEMS+['image']:
+                system = item.lower()
+                continue
+            exclude = item.startswith('-')
+            item = item.lstrip('+-')
+            shape = item.split('(')[0].strip()
+            if shape not in SHAPES or ')' not in item:
+                continue
+            params = [pp.strip() for pp in item.split('(')[1].split(')')[0].split(',')]
+            regions.append(parse_shape(shape,system,params)+(exclude,))
+    f.close()
+    return regions
+
+
+def describe(region):
+    shape,system,points,sizes,angle,exclude = region
+    txt = ('-' if exclude else '')+shape+' '+system+' '
+    txt += ' '.join([str(round(xx,5)) for xx in points.ravel()])
+    if len(sizes) > 0:
+        txt += ' '+' '.join([str(round(xx,5)) for xx in sizes])
+    if shape in ['ellipse','box']:
+        txt += ' '+str(angle)
+    return txt
+
+
+def get_centres(regions):
+
+    """
+    (RA, Dec) in degrees of the centre of each sky region (mean vertex for
+    polygons), excluding exclusions
+    """
+
+    return [tuple(region[2].mean(axis=0)) for region in regions if region[1] in SKY_SYSTEMS and not region[5]]
+
+
+def region_pixels(regions,header):
+
+    """
+    Regions with points and sizes converted to 0-based pixels for the
+    image described by header
+    """
+
+    w = wcs.WCS(header).celestial
+    pixscale = abs(header['CDELT2'])
+    sky = [region for region in regions if region[1] in SKY_SYSTEMS]
+    if len(sky) > 0:
+        allpoints = numpy.vstack([region[2] for region in sky])
+        xpix,ypix = w.wcs_world2pix(allpoints[:,0],allpoints[:,1],0)
+        allpix = numpy.array([xpix,ypix]).T
+    pix_regions = []
+    i = 0
+    for region in regions:
+        shape,system,points,sizes,angle,exclude = region
+        if system in SKY_SYSTEMS:
+            points = allpix[i:i+len(points)]
+            sizes = [size/pixscale for size in sizes]
+            i += len(points)
+        pix_regions.append((shape,'image',points,sizes,angle,exclude))
+    return pix_regions
+
+
+def get_bbox(region):
+    shape,system,points,sizes,angle,exclude = region
+    if shape == 'polygon':
+        return points[:,0].min(),points[:,0].max(),points[:,1].min(),points[:,1].max()
+    elif shape == 'circle':
+        extent = sizes[0]
+    elif shape == 'ellipse':
+        extent = max(sizes)
+    else:
+        extent = 0.5*numpy.hypot(sizes[0],sizes[1])
+    xc,yc = points[0]
+    return xc-extent,xc+extent,yc-extent,yc+extent
+
+
+def inside(region,xx,yy):
+
+    """
+    Which of the pixel positions xx, yy lie within a region
+    """
+
+    shape,system,points,sizes,angle,exclude = region
+    if shape == 'polygon':
+        result = numpy.zeros(numpy.broadcast(xx,yy).shape,dtype=bool)
+        x0,y0 = points[-1]
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            for x1,y1 in points:
+                result ^= ((y1 > yy) != (y0 > yy)) & (xx < (x0-x1)*(yy-y1)/(y0-y1)+x1)
+                x0,y0 = x1,y1
+        return result
+    dx = xx-points[0][0]
+    dy = yy-points[0][1]
+    if shape == 'circle':
+        return dx**2+dy**2 < sizes[0]**2
+    theta = numpy.radians(angle)
+    uu = dx*numpy.cos(theta)+dy*numpy.sin(theta)
+    vv = -dx*numpy.sin(theta)+dy*numpy.cos(theta)
+    if shape == 'ellipse':
+        return (uu/sizes[0])**2+(vv/sizes[1])**2 < 1.0
+    return (numpy.abs(uu) <= 0.5*sizes[0]) & (numpy.abs(vv) <= 0.5*sizes[1])
+
+
+def rasterise(pix_regions,shape,r0=0,r1=None):
+
+    """
+    Boolean mask of rows r0 to r1 of an image of the given (ny, nx) shape,
+    True within the (pixel) regions
+    """
+
+    ny,nx = shape
+    if r1 is None:
+        r1 = ny
+    mask = numpy.zeros((r1-r0,nx),dtype=bool)
+    for region in pix_regions:
+        xmin,xmax,ymin,ymax = get_bbox(region)
+        x0 = max(int(numpy.floor(xmin)),0)
+        x1 = min(int(numpy.ceil(xmax))+1,nx)
+        y0 = max(int(numpy.floor(ymin)),r0)
+        y1 = min(int(numpy.ceil(ymax))+1,r1)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        xx = numpy.arange(x0,x1)[None,:]
+        yy = numpy.arange(y0,y1)[:,None]
+        within = inside(region,xx,yy)
+        if region[5]:
+            mask[y0-r0:y1-r0,x0:x1] &= ~within
+        else:
+            mask[y0-r0:y1-r0,x0:x1] |= within
+    return mask
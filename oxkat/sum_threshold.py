@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# numpy implementation of the SumThreshold flagger, following the
+# sum_threshold strategies in the Tricolour configs in data/tricolour/.
+#
+# A block is the (time, freq, corr) data for a single baseline. For each
+# correlation a smooth background is fitted to the unflagged amplitudes and
+# SumThreshold is run on the residuals along time and frequency. The flags
+# from each correlation are combined, extended by a time_extend x freq_extend
+# box, and whole channels / timeslots are flagged if their flagged fraction
+# exceeds flag_all_time_frac / flag_all_freq_frac (as per CASA's extend
+# mode with growtime / growfreq).
+
+
+import numpy
+import yaml
+from scipy.ndimage import binary_dilation, gaussian_filter
+
+
+DEFAULTS = {
+    'outlier_nsigma': 10,
+    'windows_time': [1, 2, 4, 8],
+    'windows_freq': [1, 2, 4, 8],
+    'background_reject': 2.0,
+    'background_iterations': 5,
+    'spike_width_time': 12.5,
+    'spike_width_freq': 10.0,
+    'time_extend': 3,
+    'freq_extend': 3,
+    'flag_all_time_frac': 0.6,
+    'flag_all_freq_frac': 0.8,
+    'rho': 1.3,
+    'num_major_iterations': 5
+    }
+
+
+def read_strategies(yamlfile):
+
+    """
+    Keyword arguments for each sum_threshold strategy in a Tricolour config,
+    other tasks are skipped
+    """
+
+    with open(yamlfile) as f:
+        config = yaml.safe_load(f)
+    strategies = []
+    for strategy in config['strategies']:
+        if strategy.get('task') == 'sum_threshold':
+            kwargs = dict(DEFAULTS)
+            kwargs.update(strategy.get('kwargs',{}))
+            strategies.append((strategy['name'],kwargs))
+    return strategies
+
+
+def mad_sigma(vals):
+    if len(vals) == 0:
+        return 0.0
+    return 1.4826*numpy.median(numpy.abs(vals - numpy.median(vals)))
+
+
+def background(amp,mask,spike_width_time,spike_width_freq,background_reject,background_iterations):
+
+    """
+    Smooth background from the amplitudes not in mask, using a normalised
+    Gaussian filter. Outliers from each estimate are excluded from the next.
+    """
+
+    good = ~mask
+    for i in range(0,max(1,background_iterations)):
+        weight = good.astype(numpy.float64)
+        num = gaussian_filter(numpy.where(good,amp,0.0),(spike_width_time,spike_width_freq),mode='nearest')
+        den = gaussian_filter(weight,(spike_width_time,spike_width_freq),mode='nearest')
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            bg = numpy.where(den > 1e-6,num/den,0.0)
+        resid = amp - bg
+        sigma = mad_sigma(resid[good])
+        if sigma == 0.0:
+            break
+        good = ~mask & (numpy.abs(resid) < background_reject*sigma)
+    return bg
+
+
+def sum_threshold_axis(resid,mask,window,threshold):
+
+    """
+    Flag every run of window samples along axis 0 whose summed residual
+    exceeds window*threshold. Previously flagged samples count as threshold.
+    """
+
+    n = resid.shape[0]
+    if window > n:
+        return numpy.zeros(resid.shape,dtype=bool)
+    vals = numpy.where(mask,threshold,resid)
+    csum = numpy.concatenate((numpy.zeros((1,)+vals.shape[1:]),numpy.cumsum(vals,axis=0)),axis=0)
+    hits = (csum[window:] - csum[:-window]) > window*threshold
+    # Spread each hit over the window that produced it
+    count = numpy.concatenate((numpy.zeros((1,)+hits.shape[1:],dtype=numpy.int64),numpy.cumsum(hits,axis=0)),axis=0)
+    idx = numpy.arange(n)
+    lo = numpy.maximum(idx - window + 1,0)
+    hi = numpy.minimum(idx,n - window) + 1
+    return (count[hi] - count[lo]) > 0
+
+
+def sum_threshold(resid,mask,sigma,outlier_nsigma,windows_time,windows_freq,rho):
+
+    """
+    SumThreshold over a (time, freq) residual, returns the new mask
+    """
+
+    mask = mask.copy()
+    chi1 = outlier_nsigma*sigma
+    for window in windows_time:
+        threshold = chi1 / rho**numpy.log2(window)
+        mask |= sum_threshold_axis(resid,mask,window,threshold)
+    for window in windows_freq:
+        threshold = chi1 / rho**numpy.log2(window)
+        mask |= sum_threshold_axis(resid.T,mask.T,window,threshold).T
+    return mask
+
+
+def flag_block(vis,flag,strategies):
+
+    """
+    Run the strategies on one (time, freq, corr) baseline block,
+    returns the updated flags
+    """
+
+    amps = numpy.abs(vis)
+    mask = numpy.any(flag,axis=2) | ~numpy.all(numpy.isfinite(amps),axis=2)
+
+    for name,kw in strategies:
+        new_mask = mask.copy()
+        for corr in range(0,vis.shape[2]):
+            amp = numpy.nan_to_num(amps[:,:,corr])
+            corr_mask = mask.copy()
+            for i in range(0,kw['num_major_iterations']):
+                bg = background(amp,corr_mask,kw['spike_width_time'],kw['spike_width_freq'],
+                        kw['background_reject'],kw['background_iterations'])
+                resid = amp - bg
+                sigma = mad_sigma(resid[~corr_mask])
+                if sigma == 0.0:
+                    break
+                updated = sum_threshold(resid,corr_mask,sigma,kw['outlier_nsigma'],
+                        kw['windows_time'],kw['windows_freq'],kw['rho'])
+                if numpy.array_equal(updated,corr_mask):
+                    break
+                corr_mask = updated
+            new_mask |= corr_mask
+
+        # Extend the new flags in time and frequency
+        added = new_mask & ~mask
+        structure = numpy.ones((max(1,int(kw['time_extend'])),max(1,int(kw['freq_extend']))),dtype=bool)
+        if structure.size > 1:
+            added = binary_dilation(added,structure=structure)
+        mask = mask | added
+
+        # Flag mostly-flagged channels and timeslots
+        mask[:,mask.mean(axis=0) > kw['flag_all_time_frac']] = True
+        mask[mask.mean(axis=1) > kw['flag_all_freq_frac'],:] = True
+
+    return flag | mask[:,:,None]
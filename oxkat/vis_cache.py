@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Columnar cache of Measurement Set columns for tools that need to read
+# the same visibilities, flags and metadata more than once.
+#
+# Each cached column is a single .npy file in <msname>.viscache/ with the
+# row axis first, so row i of the cache is row i of the MS. The files are
+# opened as memory maps, so slicing by row range (i.e. time chunk) or by
+# channel returns a view without copying or going through the table system.
+
+
+import json
+import numpy
+import os
+import sys
+from numpy.lib.format import open_memmap
+from pyrap.tables import table
+
+
+META = 'meta.json'
+
+
+def default_cachedir(msname):
+    return msname.rstrip('/')+'.viscache'
+
+
+def col_file(cachedir,col):
+    return cachedir+'/'+col+'.npy'
+
+
+def read_meta(cachedir):
+    with open(cachedir+'/'+META) as f:
+        meta = json.load(f)
+    return meta
+
+
+def write_meta(cachedir,meta):
+    with open(cachedir+'/'+META,'w') as f:
+        json.dump(meta,f,indent=1)
+
+
+def fixed_shape(tt,col):
+
+    """
+    True if every cell of col has the same shape, checking the first
+    row of each DATA_DESC_ID if the column description does not fix it
+    """
+
+    desc = tt.getcoldesc(col)
+    if desc.get('ndim',0) == 0 or 'shape' in desc:
+        return True
+    ddids,rows = numpy.unique(tt.getcol('DATA_DESC_ID'),return_index=True)
+    shapes = [tt.getcell(col,int(row)).shape for row in rows]
+    return len(set(shapes)) == 1
+
+
+def export_columns(msname,colnames,cachedir='',rowchunk=500000,overwrite=False):
+
+    """
+    Stream the requested MS columns into the cache in row chunks
+    """
+
+    if cachedir == '':
+        cachedir = default_cachedir(msname)
+    if not os.path.isdir(cachedir):
+        os.mkdir(cachedir)
+
+    if os.path.isfile(cachedir+'/'+META):
+        meta = read_meta(cachedir)
+    else:
+        meta = {'ms': os.path.abspath(msname), 'nrows': 0, 'columns': {}}
+
+    tt = table(msname,ack=False)
+    nrows = tt.nrows()
+    if meta['nrows'] not in [0,nrows]:
+        print('Existing cache has '+str(meta['nrows'])+' rows, MS has '+str(nrows)+', please remove '+cachedir)
+        tt.done()
+        sys.exit()
+    meta['nrows'] = nrows
+
+    todo = []
+    for col in colnames:
+        if col not in tt.colnames():
+            print(col+' not present in MS, skipping')
+        elif col in meta['columns'] and not overwrite:
+            print(col+' already cached, skipping')
+        else:
+            todo.append(col)
+
+    arrays = {}
+    for col in todo:
+        if not tt.iscelldefined(col,0):
+            print(col+' has undefined cells, skipping')
+            continue
+        cell = numpy.asarray(tt.getcell(col,0))
+        shape = (nrows,)+cell.shape
+        if not fixed_shape(tt,col):
+            print(col+' does not have a fixed shape, skipping')
+            continue
+        print('Caching '+col+' '+str(shape)+' '+str(cell.dtype))
+        arrays[col] = open_memmap(col_file(cachedir,col),mode='w+',dtype=cell.dtype,shape=shape)
+
+    for start_row in range(0,nrows,rowchunk):
+        nr = min(rowchunk,nrows-start_row)
+        print('Processing rows: '+str(start_row)+' to '+str(start_row+nr))
+        for col in arrays:
+            arrays[col][start_row:start_row+nr] = tt.getcol(col,start_row,nr)
+
+    for col in arrays:
+        arrays[col].flush()
+        meta['columns'][col] = {'dtype': arrays[col].dtype.str, 'shape': list(arrays[col].shape)}
+    tt.done()
+
+    write_meta(cachedir,meta)
+    return cachedir
+
+
+def open_cache(cachedir,mode='r'):
+
+    """
+    Return the cache metadata and a dict of memory-mapped columns.
+    Use mode='r+' to modify cached columns in place.
+    """
+
+    meta = read_meta(cachedir)
+    cols = {}
+    for col in meta['columns']:
+        cols[col] = numpy.load(col_file(cachedir,col),mmap_mode=mode)
+    return meta,cols
+
+
+def row_chunks(nrows,rowchunk):
+
+    """
+    (start_row, nrows) tuples covering nrows in steps of rowchunk
+    """
+
+    return [(start_row,min(rowchunk,nrows-start_row)) for start_row in range(0,nrows,rowchunk)]
+
+
+def time_chunks(times,ntimes):
+
+    """
+    (start_row, nrows) tuples that each cover ntimes whole timeslots,
+    given the (time-ordered) TIME column
+    """
+
+    edges = numpy.flatnonzero(numpy.diff(times) != 0) + 1
+    edges = numpy.concatenate(([0],edges[ntimes-1::ntimes],[len(times)]))
+    edges = numpy.unique(edges)
+    return [(int(edges[i]),int(edges[i+1]-edges[i])) for i in range(0,len(edges)-1)]
+
+
+def baseline_rows(ant1,ant2,a1,a2):
+
+    """
+    Row indices for a single baseline, for use with numpy.take or fancy indexing
+    """
+
+    return numpy.flatnonzero((ant1 == a1) & (ant2 == a2))
+
+
+def writeback_column(msname,col,cachedir='',rowchunk=500000):
+
+    """
+    Write a cached column (e.g. an updated FLAG) back into the MS
+    """
+
+    if cachedir == '':
+        cachedir = default_cachedir(msname)
+    meta,cols = open_cache(cachedir)
+    if col not in cols:
+        print(col+' is not in '+cachedir)
+        sys.exit()
+
+    tt = table(msname,readonly=False,ack=False)
+    if tt.nrows() != meta['nrows']:
+        print('Row count mismatch between '+msname+' and '+cachedir)
+        tt.done()
+        sys.exit()
+    for start_row,nr in row_chunks(meta['nrows'],rowchunk):
+        print('Writing '+col+' rows: '+str(start_row)+' to '+str(start_row+nr))
+        tt.putcol(col,numpy.ascontiguousarray(cols[col][start_row:start_row+nr]),start_row,nr)
+    tt.done()
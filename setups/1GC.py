@@ -50,6 +50,7 @@ def main():
     OWLCAT_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.OWLCAT_PATTERN,USE_SINGULARITY)
     RAGAVI_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.RAGAVI_PATTERN,USE_SINGULARITY)
     SHADEMS_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.SHADEMS_PATTERN,USE_SINGULARITY)
+    FLAGSAVE_CONTAINER = OWLCAT_CONTAINER if cfg.SAVE_FLAGS_TOOL == 'oxkat' else CASA_CONTAINER
 
 
     # ------------------------------------------------------------------------------
@@ -73,8 +74,23 @@ def main():
     step['comment'] = 'Split and average master MS'
     step['dependency'] = None
     step['id'] = 'SPPRE'+code
-    syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
-    syscall += gen.generate_syscall_casa(casascript=cfg.OXKAT+'/PRE_casa_average_to_1k_add_wtspec.py')
+    if cfg.PRE_AVERAGE_TOOL == 'oxkat' and cfg.PRE_FIELDS == '' and cfg.PRE_SCANS == '':
+        syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+        syscall += 'python3 '+cfg.TOOLS+'/average_MS.py '
+        syscall += '--nchans '+str(cfg.PRE_NCHANS)+' '
+        if cfg.PRE_TIMEAVG:
+            syscall += '--timebin '+cfg.PRE_TIMEBIN+' '
+        syscall += '--clearcal '
+        syscall += '--jobs '+str(cfg.PRE_AVERAGE_JOBS)+' '
+        syscall += myms
+        if cfg.SAVE_FLAGS:
+            syscall += '\n'
+            syscall += CONTAINER_RUNNER+FLAGSAVE_CONTAINER+' ' if USE_SINGULARITY else ''
+            syscall += gen.generate_syscall_flag_backup(myms = project_info['working_ms'],
+                        versionname = 'observatory')
+    else:
+        syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
+        syscall += gen.generate_syscall_casa(casascript=cfg.OXKAT+'/PRE_casa_average_to_1k_add_wtspec.py')
     step['syscall'] = syscall
     steps.append(step)
 
@@ -84,8 +100,25 @@ def main():
     step['comment'] = 'Apply basic flagging steps to all fields'
     step['dependency'] = 0
     step['id'] = 'FGBAS'+code
-    syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
-    syscall += gen.generate_syscall_casa(casascript=cfg.OXKAT+'/1GC_02_casa_basic_flags.py')
+    if cfg.CAL_1GC_BASIC_FLAGS == 'oxkat':
+        syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+        syscall += 'python3 '+cfg.TOOLS+'/flag_static_MS.py '
+        if cfg.CAL_1GC_BAD_FREQS != []:
+            syscall += '--badfreqs "'+','.join(cfg.CAL_1GC_BAD_FREQS)+'" '
+        if cfg.CAL_1GC_BL_FREQS != []:
+            syscall += '--blfreqs "'+','.join(cfg.CAL_1GC_BL_FREQS)+'" '
+            syscall += '--uvrange "'+cfg.CAL_1GC_BL_FLAG_UVRANGE+'" '
+        syscall += '--autocorr --clipzeros --clipmax 100.0 '
+        syscall += '--jobs '+str(cfg.CAL_1GC_BASIC_FLAGS_JOBS)+' '
+        syscall += project_info['working_ms']
+        if cfg.SAVE_FLAGS:
+            syscall += '\n'
+            syscall += CONTAINER_RUNNER+FLAGSAVE_CONTAINER+' ' if USE_SINGULARITY else ''
+            syscall += gen.generate_syscall_flag_backup(myms = project_info['working_ms'],
+                        versionname = 'basic')
+    else:
+        syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
+        syscall += gen.generate_syscall_casa(casascript=cfg.OXKAT+'/1GC_02_casa_basic_flags.py')
     step['syscall'] = syscall
     steps.append(step)
 
@@ -95,8 +128,22 @@ def main():
     step['comment'] = 'Run auto-flaggers on calibrators'
     step['dependency'] = 1
     step['id'] = 'FGCAL'+code
-    syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
-    syscall += gen.generate_syscall_casa(casascript=cfg.OXKAT+'/1GC_05_casa_autoflag_cals_DATA.py')
+    if cfg.CAL_1GC_AUTOFLAG_CALS == 'oxkat' and cfg.PRE_FIELDS == '':
+        cal_names = [project_info['primary_name']]+project_info['secondary_names']
+        syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+        syscall += 'python3 '+cfg.TOOLS+'/flag_sumthreshold_MS.py '
+        syscall += '--fields "'+','.join(cal_names)+'" '
+        syscall += '--config '+cfg.DATA+'/tricolour/'+cfg.CAL_1GC_AUTOFLAG_CONFIG+' '
+        syscall += '--jobs '+str(cfg.CAL_1GC_AUTOFLAG_JOBS)+' '
+        syscall += project_info['working_ms']
+        if cfg.SAVE_FLAGS:
+            syscall += '\n'
+            syscall += CONTAINER_RUNNER+FLAGSAVE_CONTAINER+' ' if USE_SINGULARITY else ''
+            syscall += gen.generate_syscall_flag_backup(myms = project_info['working_ms'],
+                        versionname = 'autoflag_cals_data')
+    else:
+        syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
+        syscall += gen.generate_syscall_casa(casascript=cfg.OXKAT+'/1GC_05_casa_autoflag_cals_DATA.py')
     step['syscall'] = syscall
     steps.append(step)
 
@@ -114,11 +161,14 @@ def main():
 
     step = {}
     step['step'] = 4
-    step['comment'] = 'Plot the gain solutions'
+    step['comment'] = 'Plot the gain solutions and write QA metrics'
     step['dependency'] = 3
     step['id'] = 'PLTAB'+code
     syscall = CONTAINER_RUNNER+RAGAVI_CONTAINER+' ' if USE_SINGULARITY else ''
     syscall += 'python3 '+cfg.OXKAT+'/PLOT_gaintables.py cal_1GC_*'
+    syscall += '\n'
+    syscall += CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+    syscall += 'python3 '+cfg.TOOLS+'/cal_table_qa.py --outdir '+cfg.GAINPLOTS+' \''+cfg.GAINTABLES+'/cal_1GC_*\''
     step['syscall'] = syscall
     steps.append(step)
 
@@ -128,8 +178,30 @@ def main():
     step['comment'] = 'Split the corrected target data'
     step['dependency'] = 3
     step['id'] = 'SPTRG'+code
-    syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
-    syscall += gen.generate_syscall_casa(casascript=cfg.OXKAT+'/1GC_09_casa_split_targets.py')
+    if cfg.CAL_1GC_SPLIT_TARGETS == 'oxkat':
+        target_names = project_info['target_names']
+        if cfg.PRE_FIELDS != '':
+            from oxkat import user_field_handler as ufh
+            target_names = ufh.user_targets
+        syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+        syscall += 'python3 '+cfg.TOOLS+'/split_MS.py '
+        syscall += '--by field '
+        syscall += '--fields "'+','.join(target_names)+'" '
+        syscall += '--datacol CORRECTED_DATA '
+        syscall += '--keepcols MODEL_DATA '
+        syscall += '--wtspec '
+        syscall += '--jobs '+str(cfg.CAL_1GC_SPLIT_JOBS)+' '
+        syscall += project_info['working_ms']
+        if cfg.SAVE_FLAGS:
+            for target in target_names:
+                opms = project_info['working_ms'].replace('.ms','_'+target.replace(' ','_')+'.ms')
+                syscall += '\n'
+                syscall += CONTAINER_RUNNER+FLAGSAVE_CONTAINER+' ' if USE_SINGULARITY else ''
+                syscall += gen.generate_syscall_flag_backup(myms = opms,
+                            versionname = 'post-1GC')
+    else:
+        syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
+        syscall += gen.generate_syscall_casa(casascript=cfg.OXKAT+'/1GC_09_casa_split_targets.py')
     step['syscall'] = syscall
     steps.append(step)
 
@@ -139,7 +211,10 @@ def main():
     step['comment'] = 'Plot the corrected calibrator visibilities'
     step['dependency'] = 5
     step['id'] = 'PLVIS'+code
-    syscall = CONTAINER_RUNNER+SHADEMS_CONTAINER+' ' if USE_SINGULARITY else ''
+    if cfg.CAL_1GC_VISPLOTS == 'oxkat':
+        syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+    else:
+        syscall = CONTAINER_RUNNER+SHADEMS_CONTAINER+' ' if USE_SINGULARITY else ''
     syscall += 'python3 '+cfg.OXKAT+'/1GC_10_plot_visibilities.py'
     step['syscall'] = syscall
     steps.append(step)
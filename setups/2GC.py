@@ -185,10 +185,21 @@ def main():
             step['slurm_config'] = cfg.SLURM_WSCLEAN
             step['pbs_config'] = cfg.PBS_WSCLEAN
             absmem = gen.absmem_helper(step,INFRASTRUCTURE,cfg.WSC_ABSMEM)
-            syscall = CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
-            syscall += gen.generate_syscall_wsclean(mslist=[myms],
+            if cfg.WSC_BDAMS:
+                syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+                bda_syscall,img_ms = gen.generate_syscall_bda(myms = myms,
+                            datacol = 'CORRECTED_DATA',
+                            absmem = absmem)
+                syscall += bda_syscall+'\n'
+                img_col = 'DATA'
+            else:
+                syscall = ''
+                img_ms = myms
+                img_col = 'CORRECTED_DATA'
+            syscall += CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
+            syscall += gen.generate_syscall_wsclean(mslist=[img_ms],
                         imgname = corr_img_prefix,
-                        datacol = 'CORRECTED_DATA',
+                        datacol = img_col,
                         mask = mask,
                         automask = automask,
                         absmem = absmem)
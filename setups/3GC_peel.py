@@ -50,6 +50,7 @@ def main():
 
 
     CUBICAL_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.CUBICAL_PATTERN,USE_SINGULARITY)
+    OWLCAT_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.OWLCAT_PATTERN,USE_SINGULARITY)
     WSCLEAN_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.WSCLEAN_PATTERN,USE_SINGULARITY)
 
 
@@ -157,10 +158,21 @@ def main():
             step['slurm_config'] = cfg.SLURM_EXTRALONG
             step['pbs_config'] = cfg.PBS_EXTRALONG
             absmem = gen.absmem_helper(step,INFRASTRUCTURE,cfg.WSC_ABSMEM)
-            syscall = CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
-            syscall += gen.generate_syscall_wsclean(mslist = [myms],
+            if cfg.WSC_BDAMS:
+                syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+                bda_syscall,img_ms = gen.generate_syscall_bda(myms = myms,
+                            datacol = 'CORRECTED_DATA',
+                            absmem = absmem)
+                syscall += bda_syscall+'\n'
+                img_col = 'DATA'
+            else:
+                syscall = ''
+                img_ms = myms
+                img_col = 'CORRECTED_DATA'
+            syscall += CONTAINER_RUNNER+WSCLEAN_CONTAINER+' ' if USE_SINGULARITY else ''
+            syscall += gen.generate_syscall_wsclean(mslist = [img_ms],
                         imgname = prepeel_img_prefix,
-                        datacol = 'CORRECTED_DATA',
+                        datacol = img_col,
                         briggs = cfg.CAL_3GC_PEEL_BRIGGS,
                         chanout = cfg.CAL_3GC_PEEL_NCHAN,
                         automask = False,
@@ -213,35 +225,28 @@ def main():
 
             step = {}
             step['step'] = 4
-            step['comment'] = 'Add '+cfg.CAL_3GC_PEEL_DIR1COLNAME+' column to '+myms
+            step['comment'] = 'Copy MODEL_DATA to '+cfg.CAL_3GC_PEEL_DIR1COLNAME+' and CORRECTED_DATA to DATA in a single pass over '+myms
             step['dependency'] = 3
-            step['id'] = 'ADDIR'+code
+            step['id'] = 'CPCOL'+code
             syscall = CONTAINER_RUNNER+CUBICAL_CONTAINER+' ' if USE_SINGULARITY else ''
-            syscall += 'python3 '+TOOLS+'/add_MS_column.py '
-            syscall += '--colname '+cfg.CAL_3GC_PEEL_DIR1COLNAME+' '
-            syscall += myms
+            syscall += 'bash -c "'
+            if cfg.CAL_3GC_PEEL_DIR1COLDM != '':
+                syscall += 'python3 '+TOOLS+'/add_MS_column.py '
+                syscall += '--colname '+cfg.CAL_3GC_PEEL_DIR1COLNAME+' '
+                syscall += '--dm '+cfg.CAL_3GC_PEEL_DIR1COLDM+' '
+                syscall += '--parset '+cfg.CAL_3GC_PEEL_PARSET+' '
+                syscall += myms+' && '
+            syscall += 'python3 '+TOOLS+'/eval_MS_columns.py '
+            syscall += "--expr '"+cfg.CAL_3GC_PEEL_DIR1COLNAME+" = MODEL_DATA; DATA = CORRECTED_DATA' "
+            syscall += myms+'"'
             step['syscall'] = syscall
             steps.append(step)
 
 
             step = {}
             step['step'] = 5
-            step['comment'] = 'Copy MODEL_DATA to '+cfg.CAL_3GC_PEEL_DIR1COLNAME
-            step['dependency'] = 4
-            step['id'] = 'CPMOD'+code
-            syscall = CONTAINER_RUNNER+CUBICAL_CONTAINER+' ' if USE_SINGULARITY else ''
-            syscall += 'python3 '+TOOLS+'/copy_MS_column.py '
-            syscall += '--fromcol MODEL_DATA '
-            syscall += '--tocol '+cfg.CAL_3GC_PEEL_DIR1COLNAME+' '
-            syscall += myms
-            step['syscall'] = syscall
-            steps.append(step)
-
-
-            step = {}
-            step['step'] = 6
             step['comment'] = 'Predict full sky model visibilities into MODEL_DATA column of '+myms
-            step['dependency'] = 5
+            step['dependency'] = 4
             step['id'] = 'WS2PR'+code
             step['slurm_config'] = cfg.SLURM_WSCLEAN
             step['pbs_config'] = cfg.PBS_WSCLEAN
@@ -253,23 +258,9 @@ def main():
 
 
             step = {}
-            step['step'] = 7
-            step['comment'] = 'Copy CORRECTED_DATA to DATA'
-            step['dependency'] = 6
-            step['id'] = 'CPCOR'+code
-            syscall = CONTAINER_RUNNER+CUBICAL_CONTAINER+' ' if USE_SINGULARITY else ''
-            syscall += 'python3 '+TOOLS+'/copy_MS_column.py '
-            syscall += '--fromcol CORRECTED_DATA '
-            syscall += '--tocol DATA '
-            syscall += myms
-            step['syscall'] = syscall
-            steps.append(step)
-
-
-            step = {}
-            step['step'] = 8
+            step['step'] = 6
             step['comment'] = 'Run CubiCal to solve for G (full model) and dE (problem source), peel out problem source'
-            step['dependency'] = 7
+            step['dependency'] = 5
             step['id'] = 'CL3GC'+code
             step['slurm_config'] = cfg.SLURM_WSCLEAN
             step['pbs_config'] = cfg.PBS_WSCLEAN
@@ -37,6 +37,7 @@ def main():
 
 
     gen.setup_dir(IMAGES)
+    gen.setup_dir(cfg.VISPLOTS)
     gen.setup_dir(cfg.LOGS)
     gen.setup_dir(cfg.SCRIPTS)
 
@@ -50,8 +51,10 @@ def main():
 
     ASTROPY_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.ASTROPY_PATTERN,USE_SINGULARITY)
     CASA_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.CASA_PATTERN,USE_SINGULARITY)
+    OWLCAT_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.OWLCAT_PATTERN,USE_SINGULARITY)
     TRICOLOUR_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.TRICOLOUR_PATTERN,USE_SINGULARITY)
     WSCLEAN_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.WSCLEAN_PATTERN,USE_SINGULARITY)
+    FLAGSAVE_CONTAINER = OWLCAT_CONTAINER if cfg.SAVE_FLAGS_TOOL == 'oxkat' else CASA_CONTAINER
 
 
     # Get target information from project json
@@ -131,6 +134,17 @@ def main():
 
             step = {}
             step['step'] = 1
+            step['comment'] = 'Plot flag occupancy waterfalls for '+myms
+            step['dependency'] = 0
+            step['id'] = 'FLWTF'+code
+            syscall = CONTAINER_RUNNER+OWLCAT_CONTAINER+' ' if USE_SINGULARITY else ''
+            syscall += 'python3 '+TOOLS+'/flag_waterfall.py --outdir '+cfg.VISPLOTS+' --fits '+myms
+            step['syscall'] = syscall
+            steps.append(step)
+
+
+            step = {}
+            step['step'] = 2
             step['comment'] = 'Blind wsclean on DATA column of '+myms
             step['dependency'] = 0
             step['id'] = 'WSDBL'+code
@@ -152,9 +166,9 @@ def main():
 
 
             step = {}
-            step['step'] = 2
+            step['step'] = 3
             step['comment'] = 'Make initial cleaning mask for '+targetname
-            step['dependency'] = 1
+            step['dependency'] = 2
             step['id'] = 'MASK0'+code
             syscall = CONTAINER_RUNNER+ASTROPY_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += gen.generate_syscall_makemask(restoredimage = img_prefix+'-MFS-image.fits',
@@ -165,9 +179,9 @@ def main():
 
 
             step = {}
-            step['step'] = 3
+            step['step'] = 4
             step['comment'] = 'Apply primary beam correction to '+targetname+' image'
-            step['dependency'] = 1
+            step['dependency'] = 2
             step['id'] = 'PBCOR'+code
             syscall = CONTAINER_RUNNER+ASTROPY_CONTAINER+' ' if USE_SINGULARITY else ''
             syscall += 'python3 '+TOOLS+'/pbcor_katbeam.py --band '+band[0]+' '+img_prefix+'-MFS-image.fits'
@@ -177,13 +191,13 @@ def main():
 
             if cfg.SAVE_FLAGS:
                 step = {}
-                step['step'] = 4
+                step['step'] = 5
                 step['comment'] = 'Backup flag table for '+myms
-                step['dependency'] = 1
+                step['dependency'] = 2
                 step['id'] = 'SAVFG'+code
-                syscall = CONTAINER_RUNNER+CASA_CONTAINER+' ' if USE_SINGULARITY else ''
-                syscall += 'casa -c '+OXKAT+'/FLAG_casa_backup_flag_table.py --nologger --log2term --nogui '
-                syscall += 'versionname=tricolour1 mslist='+myms
+                syscall = CONTAINER_RUNNER+FLAGSAVE_CONTAINER+' ' if USE_SINGULARITY else ''
+                syscall += gen.generate_syscall_flag_backup(myms = myms,
+                            versionname = 'tricolour1')
                 step['syscall'] = syscall
                 steps.append(step)
 
@@ -1,12 +1,84 @@
 #!/usr/bin/env python
 # ian.heywood@physics.ox.ac.uk
 
+import numpy
 import sys
 from optparse import OptionParser
 from pyrap.tables import table
 
 
-def add_data_col(msname,colname):
+TILED_DMS = ['TiledColumnStMan','TiledShapeStMan']
+
+
+def read_parset_chunks(parset):
+
+    """
+    Get time-chunk and freq-chunk from the [data] section of a CubiCal parset
+    """
+
+    time_chunk = 0
+    freq_chunk = 0
+    section = ''
+    f = open(parset,'r')
+    line = f.readline()
+    while line:
+        line = line.split('#')[0].strip()
+        if line.startswith('['):
+            section = line.strip('[]')
+        elif section == 'data' and '=' in line:
+            key,val = [item.strip() for item in line.split('=',1)]
+            if key == 'time-chunk' and val.isdigit():
+                time_chunk = int(val)
+            elif key == 'freq-chunk' and val.isdigit():
+                freq_chunk = int(val)
+        line = f.readline()
+    f.close()
+    return time_chunk,freq_chunk
+
+
+def get_nbl(tt):
+
+    """
+    Number of rows in the first timeslot, i.e. the number of baselines
+    """
+
+    anttab = table(tt.name()+'/ANTENNA',ack=False)
+    nant = anttab.nrows()
+    anttab.done()
+    nr = min(tt.nrows(),nant*(nant+1))
+    times = tt.getcol('TIME',0,nr)
+    nbl = int(numpy.sum(times == times[0]))
+    return nbl
+
+
+def get_tileshape(tt,tilemb,parset):
+
+    """
+    Derive a [ncorr,nchan,nrow] tile shape. Tiles span all correlations
+    and either the whole spectrum or the CubiCal freq-chunk, with an integer
+    number of timeslots (up to the CubiCal time-chunk) per tile, subject to
+    a maximum tile size in MB.
+    """
+
+    nchan,ncorr = tt.getcell('DATA',0).shape
+    nbl = get_nbl(tt)
+    time_chunk = 0
+    chan_tile = nchan
+    if parset != '':
+        time_chunk,freq_chunk = read_parset_chunks(parset)
+        if freq_chunk > 0:
+            chan_tile = min(freq_chunk,nchan)
+    bytes_per_row = ncorr*chan_tile*8 # complex64
+    rows_tile = max(1,int(tilemb*1024*1024/bytes_per_row))
+    if rows_tile >= nbl:
+        nslots = rows_tile // nbl
+        if time_chunk > 0:
+            nslots = min(nslots,time_chunk)
+        rows_tile = nslots*nbl
+    return [ncorr,chan_tile,rows_tile]
+
+
+def add_data_col(msname,colname,dm='',tileshape='',tilemb=4.0,parset=''):
     tt = table(msname,readonly=False)
     colnames = tt.colnames()
     if colname in colnames:
@@ -16,7 +88,23 @@ def add_data_col(msname,colname):
         desc = tt.getcoldesc('DATA')
         desc['name'] = colname
         desc['comment'] = desc['comment'].replace(' ','_')
-        tt.addcols(desc)
+        if dm == '':
+            tt.addcols(desc)
+        else:
+            if tileshape == '':
+                tshape = get_tileshape(tt,tilemb,parset)
+            else:
+                tshape = [int(xx) for xx in tileshape.split(',')]
+            if dm == 'TiledColumnStMan' and 'shape' not in desc:
+                desc['shape'] = numpy.array(tt.getcell('DATA',0).shape)
+                desc['ndim'] = len(desc['shape'])
+                desc['option'] = 4 # FixedShape
+            dmname = colname+'_'+dm
+            desc['dataManagerType'] = dm
+            desc['dataManagerGroup'] = dmname
+            dminfo = {'TYPE': dm, 'NAME': dmname, 'SPEC': {'DEFAULTTILESHAPE': numpy.array(tshape,dtype=numpy.int32)}}
+            print('Storage manager is '+dm+' with tile shape '+str(tshape)+' [corr,chan,row]')
+            tt.addcols(desc,dminfo)
     tt.done()
 
 
@@ -24,8 +112,16 @@ def main():
 
     parser = OptionParser(usage = '%prog [options] msname')
     parser.add_option('--colname', dest = 'colname', default = 'DIR1_DATA', help = 'Name (or comma-separated list) of new data column(s) (default = DIR1_DATA)')
+    parser.add_option('--dm', dest = 'dm', default = '', help = 'Storage manager for new column(s), TiledColumnStMan or TiledShapeStMan (default = same as DATA)')
+    parser.add_option('--tileshape', dest = 'tileshape', default = '', help = 'Comma-separated tile shape ncorr,nchan,nrow for --dm (default = derived automatically)')
+    parser.add_option('--tilemb', dest = 'tilemb', default = 4.0, help = 'Maximum tile size in MB when deriving the tile shape (default = 4)')
+    parser.add_option('--parset', dest = 'parset', default = '', help = 'CubiCal parset from which to take time-chunk and freq-chunk when deriving the tile shape (default = none)')
     (options,args) = parser.parse_args()
     colname = options.colname
+    dm = options.dm
+    tileshape = options.tileshape
+    tilemb = float(options.tilemb)
+    parset = options.parset
 
     if len(args) != 1:
         print('Please specify a Measurement Set')
@@ -33,8 +129,12 @@ def main():
     else:
         msname = args[0].rstrip('/')
 
+    if dm != '' and dm not in TILED_DMS:
+        print('Storage manager must be one of: '+', '.join(TILED_DMS))
+        sys.exit()
+
     for col in colname.split(','):
-        add_data_col(msname,col)
+        add_data_col(msname,col,dm,tileshape,tilemb,parset)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,488 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Flag- and weight-aware channel (and optionally time) averaging of a
+# Measurement Set, writing WEIGHT_SPECTRUM to the output. A faster
+# alternative to the mstransform call in PRE_casa_average_to_1k_add_wtspec.py.
+#
+# The input is read in chunks of whole output time bins, which are averaged
+# by a pool of worker processes and written out in order by the parent.
+# Chunks are sized from the number of channels and correlations, sums are
+# accumulated in single precision directly onto the output channels, and at
+# most one chunk per worker is in flight at a time, to bound memory use.
+#
+# For each output visibility:
+#    DATA            = sum(w * V) / sum(w) over unflagged inputs
+#    WEIGHT_SPECTRUM = sum(w) over unflagged inputs
+#    FLAG            = True if all inputs are flagged, in which case DATA
+#                      and WEIGHT_SPECTRUM are formed from the flagged inputs
+# where w is WEIGHT_SPECTRUM, or WEIGHT if the input has no spectral weights.
+# Time averaging does not cross scan, field or spectral window boundaries.
+#
+# With --bdafactor the time bin depends on baseline length (baseline-dependent
+# averaging), which makes a smaller copy of a target MS for imaging.
+
+
+import numpy
+import os
+import shutil
+import sys
+import time
+from multiprocessing import Pool
+from optparse import OptionParser
+from pyrap.tables import table, required_ms_desc
+
+
+# Per-row columns carried over from the first input row of each output row
+META_COLS = ['ANTENNA1','ANTENNA2','ARRAY_ID','DATA_DESC_ID','FEED1','FEED2',
+    'FIELD_ID','OBSERVATION_ID','PROCESSOR_ID','SCAN_NUMBER','STATE_ID']
+
+CHAN_COLS = ['DATA','FLAG','WEIGHT_SPECTRUM','CORRECTED_DATA','MODEL_DATA']
+
+CHUNK_MB = 256 # Default size of the input visibilities per chunk
+
+INPUT = {}
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def parse_timebin(timebin):
+    timebin = str(timebin).strip().lower()
+    if timebin in ['','0','0s']:
+        return 0.0
+    if timebin.endswith('min'):
+        return 60.0*float(timebin[:-3])
+    return float(timebin.rstrip('s'))
+
+
+def get_spw_info(myms):
+    spwtab = table(myms+'/SPECTRAL_WINDOW',ack=False)
+    chan_freqs = [spwtab.getcell('CHAN_FREQ',i) for i in range(0,spwtab.nrows())]
+    spwtab.done()
+    return chan_freqs
+
+
+def average_chan_axis(arr,chanbin,func=numpy.sum):
+
+    """
+    Collapse the channel axis (axis 1) of arr in bins of chanbin,
+    padding the final bin if required
+    """
+
+    nchan = arr.shape[1]
+    nout = -(-nchan // chanbin)
+    pad = nout*chanbin - nchan
+    if pad > 0:
+        arr = numpy.concatenate((arr,numpy.zeros((arr.shape[0],pad)+arr.shape[2:],dtype=arr.dtype)),axis=1)
+    return func(arr.reshape((arr.shape[0],nout,chanbin)+arr.shape[2:]),axis=2)
+
+
+def get_bda_timebins(myms,bdafactor,bdamaxint,rowchunk=0):
+
+    """
+    Per-row time bins for baseline-dependent averaging. As per wsclean's
+    -baseline-averaging, a baseline of length b wavelengths (the maximum
+    uv-distance at the highest frequency) is averaged for up to
+    bdafactor * 86400 / (2 pi b) seconds. The number of integrations per bin
+    is rounded down to a power of two so that the bins of all baselines line
+    up, and capped at bdamaxint seconds if this is non-zero, at the longest
+    scan, and at the number of integrations that fit in rowchunk rows so
+    that the input can still be split into chunks of that size.
+    Autocorrelations and zero-length baselines are not averaged in time.
+    """
+
+    tt = table(myms,ack=False)
+    uvw = tt.getcol('UVW')
+    ant1 = tt.getcol('ANTENNA1')
+    ant2 = tt.getcol('ANTENNA2')
+    times = tt.getcol('TIME')
+    scans = tt.getcol('SCAN_NUMBER')
+    dt = numpy.median(tt.getcol('INTERVAL'))
+    tt.done()
+
+    uscans,inv = numpy.unique(scans,return_inverse=True)
+    t0 = numpy.full(len(uscans),numpy.inf)
+    t1 = numpy.full(len(uscans),-numpy.inf)
+    numpy.minimum.at(t0,inv,times)
+    numpy.maximum.at(t1,inv,times)
+    maxnint = numpy.floor((t1-t0).max() / dt + 1e-6) + 1
+    if rowchunk > 0:
+        rows_per_int = len(times) / len(numpy.unique(times))
+        maxnint = min(maxnint,max(1,numpy.floor(rowchunk / rows_per_int)))
+
+    freq_max = numpy.max([numpy.max(freqs) for freqs in get_spw_info(myms)])
+    nant = max(ant1.max(),ant2.max()) + 1
+    bl = ant1*nant + ant2
+    uvdist = numpy.zeros(nant*nant)
+    numpy.maximum.at(uvdist,bl,numpy.sqrt(uvw[:,0]**2 + uvw[:,1]**2))
+    uvdist = uvdist * freq_max / 299792458.0
+
+    with numpy.errstate(divide='ignore'):
+        tmax = numpy.where(uvdist > 0.0,bdafactor * 86400.0 / (2.0 * numpy.pi * uvdist),dt)
+    if bdamaxint > 0.0:
+        tmax = numpy.minimum(tmax,bdamaxint)
+    nint = numpy.clip(numpy.floor(tmax / dt),1,maxnint)
+    nint = 2**numpy.floor(numpy.log2(nint))
+    return (nint * dt)[bl]
+
+
+def get_groups(myms,timebin):
+
+    """
+    Assign every input row to an output row. Output rows are ordered by
+    their first input row, so the time ordering of the input is retained.
+    The time bin can be a single value or one value per row.
+    """
+
+    tt = table(myms,ack=False)
+    times = tt.getcol('TIME')
+    scans = tt.getcol('SCAN_NUMBER')
+    fields = tt.getcol('FIELD_ID')
+    ddids = tt.getcol('DATA_DESC_ID')
+    ant1 = tt.getcol('ANTENNA1')
+    ant2 = tt.getcol('ANTENNA2')
+    tt.done()
+
+    timebin = numpy.broadcast_to(numpy.asarray(timebin,dtype=numpy.float64),times.shape)
+    if numpy.all(timebin > 0.0):
+        # Bin times from the start of each scan
+        uscans,inv = numpy.unique(scans,return_inverse=True)
+        t0 = numpy.full(len(uscans),numpy.inf)
+        numpy.minimum.at(t0,inv,times)
+        tbin = numpy.floor((times - t0[inv]) / timebin + 1e-6).astype(numpy.int64)
+    else:
+        tbin = numpy.unique(times,return_inverse=True)[1]
+
+    keys = numpy.stack((scans,fields,ddids,tbin,ant1,ant2),axis=1)
+    uniq,first,inv = numpy.unique(keys,axis=0,return_index=True,return_inverse=True)
+    order = numpy.argsort(first,kind='stable')
+    rank = numpy.empty_like(order)
+    rank[order] = numpy.arange(len(order))
+    gid = rank[inv.ravel()]
+    return gid,len(order)
+
+
+def get_chunks(gid,rowchunk):
+
+    """
+    Split the input rows into contiguous chunks that map to contiguous,
+    non-overlapping blocks of output rows. Chunks can only be longer than
+    rowchunk if a single time bin spans more rows than that.
+    """
+
+    nrows = len(gid)
+    pmax = numpy.maximum.accumulate(gid)
+    smin = numpy.minimum.accumulate(gid[::-1])[::-1]
+    valid = numpy.flatnonzero(pmax[:-1] < smin[1:]) + 1
+    edges = [0]
+    while edges[-1] < nrows:
+        idx = numpy.searchsorted(valid,edges[-1]+rowchunk,side='right') - 1
+        if idx < 0 or valid[idx] <= edges[-1]:
+            idx = numpy.searchsorted(valid,edges[-1],side='right')
+        if idx >= len(valid):
+            edges.append(nrows)
+        else:
+            edges.append(int(valid[idx]))
+    chunks = []
+    for start,end in zip(edges[:-1],edges[1:]):
+        chunks.append((start,end-start,int(gid[start:end].min()),gid[start:end]-gid[start:end].min()))
+    return chunks
+
+
+def open_input(myms,datacol,chanbin):
+    INPUT['tt'] = table(myms,ack=False)
+    INPUT['datacol'] = datacol
+    INPUT['chanbin'] = chanbin
+    tt = INPUT['tt']
+    INPUT['wtspec'] = 'WEIGHT_SPECTRUM' in tt.colnames() and tt.iscelldefined('WEIGHT_SPECTRUM',0)
+    INPUT['dtype'] = tt.getcell(datacol,0).dtype
+
+
+def average_chunk(start_row,nr,out0,local_gid):
+
+    """
+    Average one chunk of input rows, runs in a worker process
+    """
+
+    tt = INPUT['tt']
+    chanbin = INPUT['chanbin']
+    nout = int(local_gid.max()) + 1
+
+    data = tt.getcol(INPUT['datacol'],start_row,nr)
+    flag = tt.getcol('FLAG',start_row,nr)
+    if INPUT['wtspec']:
+        weight = tt.getcol('WEIGHT_SPECTRUM',start_row,nr).astype(numpy.float32,copy=False)
+    else:
+        weight = numpy.broadcast_to(tt.getcol('WEIGHT',start_row,nr).astype(numpy.float32)[:,None,:],flag.shape)
+
+    # Channel averaging, summed quantities only at this stage, accumulated
+    # onto the output channels one input channel per bin at a time
+    nchan_out = -(-flag.shape[1] // chanbin)
+    shape = (nr,nchan_out,flag.shape[2])
+    vis_good = numpy.zeros(shape,dtype=numpy.complex64)
+    wt_good = numpy.zeros(shape,dtype=numpy.float32)
+    vis_all = numpy.zeros(shape,dtype=numpy.complex64)
+    wt_all = numpy.zeros(shape,dtype=numpy.float32)
+    vis_sum = numpy.zeros(shape,dtype=numpy.complex64)
+    n_chan = numpy.zeros(nchan_out,dtype=numpy.float32)
+    for k in range(0,chanbin):
+        vv = data[:,k::chanbin]
+        ww = weight[:,k::chanbin]
+        nc = vv.shape[1]
+        good_wt = numpy.where(flag[:,k::chanbin],numpy.float32(0.0),ww)
+        vis_good[:,:nc] += vv*good_wt
+        wt_good[:,:nc] += good_wt
+        del good_wt
+        vis_all[:,:nc] += vv*ww
+        wt_all[:,:nc] += ww
+        vis_sum[:,:nc] += vv
+        n_chan[:nc] += 1.0
+    del data,flag,weight
+
+    # Time averaging, reduce rows sharing an output row
+    order = numpy.argsort(local_gid,kind='stable')
+    sorted_gid = local_gid[order]
+    bounds = numpy.concatenate(([0],numpy.flatnonzero(numpy.diff(sorted_gid)) + 1))
+    def reduce_rows(arr):
+        return numpy.add.reduceat(arr[order],bounds,axis=0)
+    vis_good = reduce_rows(vis_good)
+    wt_good = reduce_rows(wt_good)
+    vis_all = reduce_rows(vis_all)
+    wt_all = reduce_rows(wt_all)
+    vis_sum = reduce_rows(vis_sum)
+    count = numpy.diff(numpy.concatenate((bounds,[nr])))
+    n_all = count[:,None,None]*n_chan[None,:,None]
+
+    out_flag = wt_good <= 0.0
+    out_wt = numpy.where(out_flag,wt_all,wt_good)
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        out_vis = numpy.where(out_flag,vis_all/wt_all,vis_good/wt_good)
+        out_vis = numpy.where(out_flag & (wt_all <= 0.0),vis_sum/n_all,out_vis)
+    del vis_good,wt_good,vis_all,wt_all,vis_sum
+
+    out = {}
+    out['DATA'] = out_vis.astype(INPUT['dtype'])
+    out['FLAG'] = out_flag
+    out['WEIGHT_SPECTRUM'] = out_wt.astype(numpy.float32)
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        row_wt = numpy.where(out_flag,0.0,out_wt).sum(axis=1) / numpy.maximum((~out_flag).sum(axis=1),1)
+    out['WEIGHT'] = row_wt.astype(numpy.float32)
+    with numpy.errstate(divide='ignore'):
+        out['SIGMA'] = numpy.where(row_wt > 0.0,1.0/numpy.sqrt(row_wt),0.0).astype(numpy.float32)
+    out['FLAG_ROW'] = numpy.all(out_flag,axis=(1,2))
+
+    # Row metadata
+    first_rows = order[bounds]
+    for col in META_COLS:
+        out[col] = tt.getcol(col,start_row,nr)[first_rows]
+    for col in ['TIME','TIME_CENTROID','UVW']:
+        vals = tt.getcol(col,start_row,nr)
+        out[col] = reduce_rows(vals) / (count[:,None] if vals.ndim == 2 else count)
+    for col in ['INTERVAL','EXPOSURE']:
+        out[col] = reduce_rows(tt.getcol(col,start_row,nr))
+
+    if len(first_rows) != nout:
+        raise RuntimeError('Output row mismatch in chunk starting at row '+str(start_row))
+
+    return out0,out
+
+
+def average_chunk_star(args):
+    return average_chunk(*args)
+
+
+def make_output_ms(myms,opms,nchan_out,ncorr,clearcal,tilerows):
+
+    """
+    Create an empty output MS with the averaged channel axis, tiled
+    channel-dependent columns, and copies of the input subtables
+    """
+
+    tt = table(myms,ack=False)
+    indesc = tt.getdesc()
+    keywords = tt.getkeywords()
+    tt.done()
+
+    keep = list(required_ms_desc('MAIN').keys())
+    keep = [col for col in keep if not col.startswith('_')]
+    chan_cols = ['DATA','FLAG','WEIGHT_SPECTRUM']
+    if clearcal:
+        chan_cols += ['CORRECTED_DATA','MODEL_DATA']
+
+    desc = {}
+    for col in keep:
+        desc[col] = indesc[col]
+        desc[col]['dataManagerType'] = 'StandardStMan'
+        desc[col]['dataManagerGroup'] = 'StandardStMan'
+    for col in chan_cols:
+        if col in indesc:
+            desc[col] = indesc[col]
+        elif col == 'WEIGHT_SPECTRUM':
+            desc[col] = dict(indesc['FLAG'])
+            desc[col]['valueType'] = 'float'
+            desc[col]['comment'] = 'Weight for each data point'
+        else:
+            desc[col] = dict(indesc['DATA'])
+        desc[col]['shape'] = numpy.array([nchan_out,ncorr])
+        desc[col]['ndim'] = 2
+        desc[col]['option'] = 4
+        desc[col]['dataManagerType'] = 'TiledColumnStMan'
+        desc[col]['dataManagerGroup'] = 'Tiled'+col
+    if 'FLAG_CATEGORY' in desc:
+        desc['FLAG_CATEGORY'].pop('shape',None)
+        desc['FLAG_CATEGORY']['option'] = 0
+    desc['_define_hypercolumn_'] = {}
+    desc['_keywords_'] = {'MS_VERSION': keywords.get('MS_VERSION',2.0)}
+    desc['_private_keywords_'] = {}
+
+    dminfo = {}
+    for ii,col in enumerate(chan_cols):
+        dminfo['*'+str(ii+1)] = {'TYPE': 'TiledColumnStMan',
+            'NAME': 'Tiled'+col,
+            'SPEC': {'DEFAULTTILESHAPE': numpy.array([ncorr,nchan_out,tilerows],dtype=numpy.int32)},
+            'COLUMNS': [col]}
+
+    tout = table(opms,desc,nrow=0,dminfo=dminfo,ack=False)
+    for key in keywords:
+        val = keywords[key]
+        if isinstance(val,str) and val.startswith('Table: '):
+            subtab = table(val.replace('Table: ',''),ack=False)
+            subtab.copy(opms+'/'+key,deep=True)
+            subtab.done()
+            tout.putkeyword(key,'Table: '+os.path.abspath(opms+'/'+key))
+    tout.done()
+
+
+def update_spw(opms,chanbin):
+    spwtab = table(opms+'/SPECTRAL_WINDOW',readonly=False,ack=False)
+    for i in range(0,spwtab.nrows()):
+        freqs = spwtab.getcell('CHAN_FREQ',i)
+        nout = -(-len(freqs) // chanbin)
+        counts = average_chan_axis(numpy.ones((1,len(freqs))),chanbin)[0]
+        new_freqs = average_chan_axis(freqs[None,:],chanbin)[0] / counts
+        spwtab.putcell('CHAN_FREQ',i,new_freqs)
+        for col in ['CHAN_WIDTH','EFFECTIVE_BW','RESOLUTION']:
+            if col in spwtab.colnames():
+                spwtab.putcell(col,i,average_chan_axis(spwtab.getcell(col,i)[None,:],chanbin)[0])
+        spwtab.putcell('NUM_CHAN',i,nout)
+        spwtab.putcell('REF_FREQUENCY',i,new_freqs[0])
+    spwtab.done()
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] msname')
+    parser.add_option('--nchans', dest = 'nchans', default = 1024, help = 'Number of output channels, 0 for no channel averaging (default = 1024)')
+    parser.add_option('--timebin', dest = 'timebin', default = '', help = 'Time bin for averaging, e.g. 8s (default = no time averaging)')
+    parser.add_option('--bdafactor', dest = 'bdafactor', default = 0, help = 'Baseline-dependent time averaging with this decorrelation tolerance in wavelengths, as per WSC_BDAFACTOR, overrides --timebin (default = off)')
+    parser.add_option('--bdamaxint', dest = 'bdamaxint', default = 0, help = 'Maximum averaging time in seconds for --bdafactor (default = the longest scan)')
+    parser.add_option('--datacol', dest = 'datacol', default = 'DATA', help = 'Column to average into the output DATA column (default = DATA)')
+    parser.add_option('--clearcal', dest = 'clearcal', default = False, help = 'Also initialise CORRECTED_DATA (= DATA) and MODEL_DATA (= 1), as per CASA clearcal with addmodel', action = 'store_true')
+    parser.add_option('--opms', dest = 'opms', default = '', help = 'Output MS name (default = msname_<nchans>ch.ms, or msname_bda.ms for --bdafactor)')
+    parser.add_option('--overwrite', dest = 'overwrite', default = False, help = 'Replace the output MS if it exists', action = 'store_true')
+    parser.add_option('--rowchunk', dest = 'rowchunk', default = 0, help = 'Approximate number of input rows per chunk (default = set by --chunkmb)')
+    parser.add_option('--chunkmb', dest = 'chunkmb', default = CHUNK_MB, help = 'Approximate size in MB of the input visibilities per chunk if --rowchunk is not given (default = '+str(CHUNK_MB)+')')
+    parser.add_option('-j', '--jobs', dest = 'jobs', default = 8, help = 'Number of worker processes (default = 8)')
+    (options,args) = parser.parse_args()
+    nchans = int(options.nchans)
+    timebin = parse_timebin(options.timebin)
+    bdafactor = float(options.bdafactor)
+    bdamaxint = float(options.bdamaxint)
+    datacol = options.datacol
+    clearcal = options.clearcal
+    opms = options.opms
+    overwrite = options.overwrite
+    rowchunk = int(options.rowchunk)
+    chunkmb = float(options.chunkmb)
+    jobs = int(options.jobs)
+
+    if len(args) != 1:
+        msg('Please specify a Measurement Set')
+        sys.exit()
+    else:
+        myms = args[0].rstrip('/')
+
+    if opms == '' and bdafactor > 0.0:
+        opms = myms.replace('.ms','_bda.ms')
+    elif opms == '':
+        opms = myms.replace('.ms','_'+str(nchans)+'ch.ms')
+    if opms == myms:
+        msg('Problem with auto-generated output name (does your input MS have a .ms suffix?)')
+        sys.exit()
+    if os.path.exists(opms):
+        if overwrite:
+            msg('Removing existing '+opms)
+            shutil.rmtree(opms)
+        else:
+            msg(opms+' exists, will not overwrite')
+            sys.exit()
+
+    chan_freqs = get_spw_info(myms)
+    nchan_in = numpy.unique([len(freqs) for freqs in chan_freqs])
+    if len(nchan_in) != 1:
+        msg('Spectral windows with different numbers of channels are not supported')
+        sys.exit()
+    nchan_in = int(nchan_in[0])
+    if nchans > 0:
+        chanbin = max(1,int(nchan_in/nchans))
+    else:
+        chanbin = 1
+    nchan_out = -(-nchan_in // chanbin)
+
+    tt = table(myms,ack=False)
+    ncorr = tt.getcell('FLAG',0).shape[1]
+    tt.done()
+    if rowchunk <= 0:
+        rowchunk = max(100,int(chunkmb*1024*1024/(nchan_in*ncorr*8)))
+
+    msg('Input MS            : '+myms)
+    msg('Output MS           : '+opms)
+    msg('Channels            : '+str(nchan_in)+' -> '+str(nchan_out)+' (bin = '+str(chanbin)+')')
+    msg('Rows per chunk      : '+str(rowchunk))
+    if bdafactor > 0.0:
+        timebin = get_bda_timebins(myms,bdafactor,bdamaxint,rowchunk)
+        tbins,counts = numpy.unique(timebin,return_counts=True)
+        for tbin,count in zip(tbins,counts):
+            msg('BDA time bin        : '+str(round(tbin,2))+' s for '+str(count)+' rows')
+    else:
+        msg('Time bin            : '+(str(timebin)+' s' if timebin > 0.0 else 'none'))
+
+    msg('Grouping rows')
+    gid,nrows_out = get_groups(myms,timebin)
+    chunks = get_chunks(gid,rowchunk)
+    msg('Rows                : '+str(len(gid))+' -> '+str(nrows_out)+' in '+str(len(chunks))+' chunks')
+    maxchunk = max([chunk[1] for chunk in chunks])
+    if maxchunk > 2*rowchunk:
+        msg('Warning: largest chunk is '+str(maxchunk)+' rows, consider a shorter time bin')
+
+    tilerows = max(1,int(4*1024*1024/(nchan_out*ncorr*8)))
+    make_output_ms(myms,opms,nchan_out,ncorr,clearcal,tilerows)
+    update_spw(opms,chanbin)
+
+    tout = table(opms,readonly=False,ack=False)
+    tout.addrows(nrows_out)
+
+    pool = Pool(processes=jobs,initializer=open_input,initargs=(myms,datacol,chanbin))
+    # Batches of one chunk per worker, so finished chunks do not pile up
+    for i in range(0,len(chunks),jobs):
+        for out0,out in pool.imap(average_chunk_star,chunks[i:i+jobs]):
+            nr = len(out['TIME'])
+            for col in out:
+                tout.putcol(col,out[col],out0,nr)
+            if clearcal:
+                tout.putcol('CORRECTED_DATA',out['DATA'],out0,nr)
+                tout.putcol('MODEL_DATA',numpy.ones(out['DATA'].shape,dtype=out['DATA'].dtype),out0,nr)
+            msg('Wrote output rows   : '+str(out0)+' to '+str(out0+nr))
+    pool.close()
+    pool.join()
+    tout.done()
+
+    msg('Done')
+
+
+if __name__ == '__main__':
+
+    main()
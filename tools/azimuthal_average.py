@@ -1,70 +1,70 @@
 #!/usr/bin/env python
 # ian.heywood@physics.ox.ac.uk
-
-
-# Requires: pip install scikit-ued
+#
+# Replace an image with its azimuthal average about a centre (default the
+# middle pixel), written to <input>_azavg.fits. See oxkat/radial.py.
 
 
 import numpy
-import shutil
+import os.path as o
 import sys
-from astropy.io import fits
-from skued import azimuthal_average as aa
-
-
-def getImage(fitsfile):
-        input_hdu = fits.open(fitsfile)[0]
-        if len(input_hdu.data.shape) == 2:
-                image = numpy.array(input_hdu.data[:,:])
-        elif len(input_hdu.data.shape) == 3:
-                image = numpy.array(input_hdu.data[0,:,:])
-        elif len(input_hdu.data.shape) == 4:
-                image = numpy.array(input_hdu.data[0,0,:,:])
-        elif len(input_hdu.data.shape) == 5:
-                image = numpy.array(input_hdu.data[0,0,0,:,:])
-        return image
-
-
-def flushFits(newimage,fitsfile):
-        f = fits.open(fitsfile,mode='update')
-        input_hdu = f[0]
-        if len(input_hdu.data.shape) == 2:
-                input_hdu.data[:,:] = newimage
-        elif len(input_hdu.data.shape) == 3:
-                input_hdu.data[0,:,:] = newimage
-        elif len(input_hdu.data.shape) == 4:
-                input_hdu.data[0,0,:,:] = newimage
-        elif len(input_hdu.data.shape) == 5:
-                input_hdu.data[0,0,0,:,:] = newimage
-        f.flush()
-
-
-def main():
+import time
+from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 
-        input_fits = sys.argv[1]
 
-        output_fits = input_fits.replace('.fits','_azavg.fits')
-
-        shutil.copyfile(input_fits,output_fits)
+from oxkat import fits_io
+from oxkat import radial
 
-        input_img = getImage(input_fits)
-        output_img = input_img * 0.0
-        ny,nx = input_img.shape
-        x0 = int(nx/2)
-        y0 = int(ny/2)
 
-        radius,average = aa(input_img,center=(x0,y0))
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
 
-        for y in range(0,ny):
-        	for x in range(0,nx):
-        		val = (((float(y)-y0)**2.0)+((float(x)-x0)**2.0))**0.5
-        		output_img[y][x] = average[int(val)]
 
-        flushFits(output_img,output_fits)
+def main():
 
+    parser = OptionParser(usage = '%prog [options] input_fits')
+    parser.add_option('--centre', dest = 'centre', help = 'Centre as x,y in 0-based pixels (default = middle pixel)', default = '')
+    parser.add_option('--binsize', dest = 'binsize', help = 'Width of radial bins in pixels (default = 1)', default = 1.0)
+    parser.add_option('--angles', dest = 'angles', help = 'Only average over position angles min,max in degrees counter-clockwise from the x axis (default = all)', default = '')
+    parser.add_option('--profile', dest = 'profile', help = 'Also write the radius and profile to this text file (default = do not)', default = '')
+    parser.add_option('--outfile', dest = 'output_fits', help = 'Output image (default = based on input image)', default = '')
+    (options,args) = parser.parse_args()
+
+    if len(args) != 1:
+        msg('Please provide a FITS image')
+        sys.exit()
+    input_fits = args[0]
+
+    output_fits = options.output_fits
+    if output_fits == '':
+        output_fits = input_fits.replace('.fits','_azavg.fits')
+    if output_fits == input_fits:
+        msg('Problem with auto-generated output name (does your input file have a .fits suffix?)')
+        sys.exit()
+
+    centre = None
+    if options.centre != '':
+        centre = tuple([float(xx) for xx in options.centre.split(',')])
+    angles = None
+    if options.angles != '':
+        angles = tuple([float(xx) for xx in options.angles.split(',')])
+    binsize = float(options.binsize)
+
+    input_img = fits_io.get_image(input_fits)
+    centre = radial.get_centre(input_img.shape,centre)
+    msg('Averaging '+input_fits+' about pixel '+str(centre))
+    output_img = fits_io.create_fits(fits_io.get_header(input_fits),output_fits)
+    radii,profile,output_img = radial.azimuthal_average(input_img,centre=centre,binsize=binsize,angles=angles,out=output_img)
+    output_img.flush()
+    msg('Wrote '+output_fits)
+
+    if options.profile != '':
+        numpy.savetxt(options.profile,numpy.array([radii,profile]).T,header='radius_pix mean')
+        msg('Wrote '+options.profile)
 
 
 if __name__ == "__main__":
 
-
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Export MS columns into a memory-mappable columnar cache (see
+# oxkat/vis_cache.py), or write a modified cached column (e.g. FLAG)
+# back into the MS.
+
+
+import os.path as o
+import sys
+from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+
+
+from oxkat import vis_cache
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] msname')
+    parser.add_option('--colnames', dest = 'colnames', default = 'CORRECTED_DATA,FLAG,UVW,TIME,ANTENNA1,ANTENNA2', help = 'Comma-separated list of columns to cache (default = CORRECTED_DATA,FLAG,UVW,TIME,ANTENNA1,ANTENNA2)')
+    parser.add_option('--cachedir', dest = 'cachedir', default = '', help = 'Cache folder (default = msname.viscache)')
+    parser.add_option('--writeback', dest = 'writeback', default = '', help = 'Write this cached column back into the MS instead of exporting (e.g. FLAG)')
+    parser.add_option('--overwrite', dest = 'overwrite', default = False, help = 'Re-export columns that are already cached', action = 'store_true')
+    parser.add_option('--rowchunk', dest = 'rowchunk', default = 500000, help = 'Number of rows to process at once (default = 500000)')
+    (options,args) = parser.parse_args()
+    colnames = options.colnames.split(',')
+    cachedir = options.cachedir
+    writeback = options.writeback
+    overwrite = options.overwrite
+    rowchunk = int(options.rowchunk)
+
+    if len(args) != 1:
+        print('Please specify a Measurement Set')
+        sys.exit()
+    else:
+        msname = args[0].rstrip('/')
+
+    if writeback != '':
+        vis_cache.writeback_column(msname,writeback,cachedir,rowchunk)
+    else:
+        cachedir = vis_cache.export_columns(msname,colnames,cachedir,rowchunk,overwrite)
+        print('Cache is '+cachedir)
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Quality metrics for CASA gain tables, e.g.
+#
+#   python3 cal_table_qa.py --outdir GAINPLOTS GAINTABLES/cal_1GC_*
+#
+# Tables are processed in parallel. The solutions of each table are put on
+# a (time, antenna, channel, correlation) grid per spectral window, with
+# flagged solutions as NaN, and the following are computed per antenna,
+# spectral window and correlation:
+#
+#   flag_frac    : fraction of solutions flagged (all tables)
+#   roughness    : RMS of the second difference of the amplitude across
+#                  channels over the median amplitude (bandpasses, > 1 chan)
+#   phase_rms    : RMS phase in degrees about the mean phasor (complex gains)
+#   amp_jump     : largest fractional change in amplitude between adjacent
+#                  solution intervals (complex gains)
+#   delay_dev    : deviation in MADs of the median delay from the median over
+#                  all antennas (delays, i.e. FPARAM tables)
+#
+# Each row is checked against the limits given by the options and marked
+# pass or fail. A CSV with one row per table / antenna / SPW / correlation
+# and a JSON summary per table are written to the output folder. With
+# --strict the exit status is 1 if any table fails, so that later steps can
+# be made conditional on it.
+
+
+import csv
+import glob
+import json
+import numpy
+import os
+import os.path as o
+import sys
+import time
+import warnings
+from multiprocessing import Pool
+from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+
+
+from oxkat import caltables
+
+
+METRICS = ['flag_frac','roughness','phase_rms','amp_jump','delay_dev']
+
+LIMITS = {}
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def set_limits(limits):
+    LIMITS.update(limits)
+
+
+def get_metrics(grid,is_complex):
+
+    """
+    Metrics per (antenna, correlation) for one spectral window
+    """
+
+    ntime,nant,nchan,ncorr = grid.shape
+    valid = ~numpy.isnan(grid)
+    metrics = {}
+    # All-NaN slices (fully flagged antennas) give NaN metrics
+    with warnings.catch_warnings(), numpy.errstate(all='ignore'):
+        warnings.simplefilter('ignore',category=RuntimeWarning)
+        metrics['flag_frac'] = 1.0 - valid.sum(axis=(0,2))/float(ntime*nchan)
+
+        if is_complex:
+            amp = numpy.abs(grid)
+            med_amp = numpy.nanmedian(amp,axis=(0,2))
+
+            if nchan > 2:
+                d2 = numpy.diff(amp,n=2,axis=2)
+                metrics['roughness'] = numpy.sqrt(numpy.nanmean(d2**2,axis=(0,2)))/med_amp
+            if ntime > 1:
+                phasor = numpy.where(valid,grid/amp,numpy.nan)
+                mean_phasor = numpy.nanmean(phasor,axis=0)
+                dphase = numpy.angle(phasor*numpy.conj(mean_phasor[None]),deg=True)
+                metrics['phase_rms'] = numpy.sqrt(numpy.nanmean(dphase**2,axis=(0,2)))
+                jumps = numpy.abs(numpy.diff(amp,axis=0))/med_amp[None,:,None,:]
+                metrics['amp_jump'] = numpy.nanmax(jumps,axis=(0,2))
+        else:
+            ant_delay = numpy.nanmedian(grid,axis=(0,2))
+            med = numpy.nanmedian(ant_delay,axis=0)
+            mad = 1.4826*numpy.nanmedian(numpy.abs(ant_delay-med[None,:]),axis=0)
+            metrics['delay_dev'] = numpy.abs(ant_delay-med[None,:])/numpy.where(mad > 0,mad,numpy.nan)
+
+    return metrics
+
+
+def check(row):
+    failed = []
+    for metric in METRICS:
+        val = row.get(metric,'')
+        if val != '' and not numpy.isnan(val) and val > LIMITS[metric]:
+            failed.append(metric)
+    return failed
+
+
+def process_table(caltab):
+
+    """
+    Metric rows for every antenna, spectral window and correlation of a table
+    """
+
+    vals,flags,times,ants,spws,chan_freqs,names = caltables.read_caltable(caltab)
+    gaintype = caltables.get_caltable_type(caltab)
+    is_complex = numpy.iscomplexobj(vals)
+    tabname = caltab.rstrip('/').split('/')[-1]
+    rows = []
+    for spw in numpy.unique(spws):
+        sel = spws == spw
+        grid = caltables.grid_solutions(vals[sel],flags[sel],times[sel],ants[sel],len(names))
+        metrics = get_metrics(grid,is_complex)
+        present = numpy.isin(numpy.arange(len(names)),ants[sel])
+        for ant in numpy.flatnonzero(present):
+            for corr in range(0,vals.shape[2]):
+                row = {'table': tabname,'type': gaintype,'antenna': names[ant],'spw': int(spw),'corr': corr}
+                for metric in METRICS:
+                    row[metric] = round(float(metrics[metric][ant,corr]),6) if metric in metrics else ''
+                row['failed'] = ','.join(check(row))
+                rows.append(row)
+    return caltab,gaintype,rows
+
+
+def summarise(tabname,gaintype,rows):
+    summary = {'type': gaintype,'status': 'pass','failed': {}}
+    for metric in METRICS:
+        vals = [row[metric] for row in rows if row[metric] != '' and not numpy.isnan(row[metric])]
+        if len(vals) > 0:
+            summary[metric+'_median'] = round(float(numpy.median(vals)),6)
+            summary[metric+'_max'] = round(float(numpy.max(vals)),6)
+    for row in rows:
+        for metric in row['failed'].split(','):
+            if metric != '':
+                summary['failed'].setdefault(metric,[])
+                label = row['antenna']+':'+str(row['spw'])+':'+str(row['corr'])
+                summary['failed'][metric].append(label)
+    if len(summary['failed']) > 0:
+        summary['status'] = 'fail'
+    return summary
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] caltable(s)')
+    parser.add_option('--outdir', dest = 'outdir', default = '.', help = 'Output folder for cal_table_qa.json and cal_table_qa.csv (default = current folder)')
+    parser.add_option('--max-flag', dest = 'max_flag', default = 0.5, help = 'Maximum flagged fraction (default = 0.5)')
+    parser.add_option('--max-roughness', dest = 'max_roughness', default = 0.05, help = 'Maximum bandpass amplitude roughness (default = 0.05)')
+    parser.add_option('--max-phase-rms', dest = 'max_phase_rms', default = 30.0, help = 'Maximum phase RMS in degrees (default = 30)')
+    parser.add_option('--max-amp-jump', dest = 'max_amp_jump', default = 0.3, help = 'Maximum fractional amplitude jump between solutions (default = 0.3)')
+    parser.add_option('--max-delay-dev', dest = 'max_delay_dev', default = 5.0, help = 'Maximum delay deviation from the array median in MADs (default = 5)')
+    parser.add_option('--strict', dest = 'strict', default = False, help = 'Exit with status 1 if any table fails', action = 'store_true')
+    parser.add_option('-j', '--jobs', dest = 'jobs', default = 8, help = 'Number of worker processes (default = 8)')
+    (options,args) = parser.parse_args()
+    outdir = options.outdir
+    jobs = int(options.jobs)
+
+    caltabs = []
+    for arg in args:
+        caltabs += sorted(glob.glob(arg))
+    caltabs = [caltab for caltab in caltabs if o.isdir(caltab) and not caltab.rstrip('/').endswith('flagversions')]
+    if len(caltabs) == 0:
+        msg('Please specify one or more calibration tables')
+        sys.exit()
+
+    if not o.isdir(outdir):
+        os.makedirs(outdir)
+
+    limits = {'flag_frac': float(options.max_flag),
+        'roughness': float(options.max_roughness),
+        'phase_rms': float(options.max_phase_rms),
+        'amp_jump': float(options.max_amp_jump),
+        'delay_dev': float(options.max_delay_dev)}
+    set_limits(limits)
+
+    pool = Pool(processes=min(jobs,len(caltabs)),initializer=set_limits,initargs=(limits,))
+    results = pool.map(process_table,caltabs,chunksize=1)
+    pool.close()
+    pool.join()
+
+    all_rows = []
+    summary = {'limits': limits,'tables': {}}
+    for caltab,gaintype,rows in results:
+        tabname = caltab.rstrip('/').split('/')[-1]
+        summary['tables'][tabname] = summarise(tabname,gaintype,rows)
+        all_rows += rows
+        status = summary['tables'][tabname]['status']
+        failed = ', '.join(sorted(summary['tables'][tabname]['failed'].keys()))
+        msg('%-40s %-3s %s %s' % (tabname,gaintype,status,failed))
+
+    csvname = outdir+'/cal_table_qa.csv'
+    with open(csvname,'w',newline='') as f:
+        writer = csv.DictWriter(f,fieldnames=['table','type','antenna','spw','corr']+METRICS+['failed'])
+        writer.writeheader()
+        writer.writerows(all_rows)
+    jsonname = outdir+'/cal_table_qa.json'
+    with open(jsonname,'w') as f:
+        json.dump(summary,f,indent=1)
+    msg('Wrote '+csvname+' and '+jsonname)
+
+    if options.strict and any([tab['status'] == 'fail' for tab in summary['tables'].values()]):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    main()
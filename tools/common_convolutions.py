@@ -6,6 +6,7 @@ import glob
 import logging
 import numpy
 import os
+import os.path as o
 import scipy.signal
 import shutil
 import sys
@@ -15,33 +16,10 @@ from astropy.convolution import convolve,Gaussian2DKernel
 from astropy.io import fits
 from datetime import datetime
 from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 
 
-def get_image(fitsfile):
-        input_hdu = fits.open(fitsfile)[0]
-        if len(input_hdu.data.shape) == 2:
-                image = numpy.array(input_hdu.data[:,:])
-        elif len(input_hdu.data.shape) == 3:
-                image = numpy.array(input_hdu.data[0,:,:])
-        elif len(input_hdu.data.shape) == 4:
-                image = numpy.array(input_hdu.data[0,0,:,:])
-        else:
-                image = numpy.array(input_hdu.data[0,0,0,:,:])
-        return image
-
-
-def flush_fits(newimage,fitsfile):
-        f = fits.open(fitsfile,mode='update')
-        input_hdu = f[0]
-        if len(input_hdu.data.shape) == 2:
-                input_hdu.data[:,:] = newimage
-        elif len(input_hdu.data.shape) == 3:
-                input_hdu.data[0,:,:] = newimage_
-        elif len(input_hdu.data.shape) == 4:
-                input_hdu.data[0,0,:,:] = newimage
-        else:
-                input_hdu.data[0,0,0,:,:] = newimage
-        f.flush()
+from oxkat import fits_io
 
 
 def drop_deg(fitsfile):
@@ -59,8 +37,7 @@ def deg2rad(xx):
 
 
 def get_header(fitsfile):
-    input_hdu = fits.open(fitsfile)[0]
-    hdr = input_hdu.header
+    hdr = fits_io.get_header(fitsfile)
     bmaj = hdr.get('BMAJ')
     bmin = hdr.get('BMIN')
     bpa = hdr.get('BPA')
@@ -68,14 +45,13 @@ def get_header(fitsfile):
     return bmaj,bmin,bpa,pixscale
 
 
-def beam_header(fitsfile,bmaj,bmin,bpa):
-    outhdu = fits.open(fitsfile,mode='update')
-    outhdr = outhdu[0].header
+def beam_header(hdr,bmaj,bmin,bpa):
+    outhdr = hdr.copy()
     outhdr.set('BMAJ',bmaj,after='BUNIT')
     outhdr.set('BMIN',bmin,after='BMAJ')
     outhdr.set('BPA',bpa,after='BMIN')
-    outhdr.remove('HISTORY')
-    outhdu.flush()  
+    outhdr.remove('HISTORY',ignore_missing=True,remove_all=True)
+    return outhdr
 
 
 
@@ -198,9 +174,6 @@ if __name__ == '__main__':
         if os.path.isfile(kernel_fits):
             # Special case to get around pypher's refusal to overwrite in all cases
             os.remove(kernel_fits)
-        shutil.copyfile(restored_fits,residual_conv_fits)
-        shutil.copyfile(restored_fits,restored_conv_fits)
-        shutil.copyfile(restored_fits,model_conv_fits)
         if template_fits != '':
             shutil.copyfile(template_fits,target_beam_fits)
             shutil.copyfile(template_fits,restoring_beam_fits)
@@ -246,7 +219,7 @@ if __name__ == '__main__':
     restoring = Gaussian2DKernel(x_stddev=xstd,y_stddev=ystd,theta=theta,x_size=cropsize,y_size=cropsize,mode='center')
     restoring_beam_image = restoring.array
     restoring_beam_image = restoring_beam_image / numpy.max(restoring_beam_image)
-    flush_fits(restoring_beam_image,restoring_beam_fits)
+    fits_io.flush_fits(restoring_beam_image,restoring_beam_fits)
 
 
     # Render target beam image
@@ -257,7 +230,7 @@ if __name__ == '__main__':
     target_gaussian = Gaussian2DKernel(x_stddev=target_xstd,y_stddev=target_ystd,theta=target_theta,x_size=cropsize,y_size=cropsize,mode='center')
     target_beam_image = target_gaussian.array
     target_beam_image = target_beam_image / numpy.max(target_beam_image)
-    flush_fits(target_beam_image,target_beam_fits)
+    fits_io.flush_fits(target_beam_image,target_beam_fits)
 
 
     # Call pypher to generate homogenisation kernel
@@ -265,31 +238,28 @@ if __name__ == '__main__':
     os.system('pypher '+restoring_beam_fits+' '+target_beam_fits+' '+kernel_fits)
 
 
+    # Outputs take the restored image header with the target beam
+    conv_header = beam_header(fits_io.get_header(restored_fits),target_bmaj,target_bmin,target_bpa)
+
+
     # Open model image and convolve with target beam
     logging.info('Convolving model image with target beam...')
-    model_image = get_image(model_fits)
+    model_image = fits_io.get_image(model_fits)
     model_conv_image = scipy.signal.fftconvolve(model_image, target_beam_image, mode='same')
-    flush_fits(model_conv_image,model_conv_fits)
+    fits_io.write_fits(model_conv_image,conv_header,model_conv_fits)
 
 
     # Open residual image and convolve with homogenisation kernel
     logging.info('Convolving residual image with homogenisation kernel...')
-    residual_image = get_image(residual_fits)
-    homogenisation_beam = get_image(kernel_fits)
+    residual_image = fits_io.get_image(residual_fits)
+    homogenisation_beam = fits_io.get_image(kernel_fits)
     residual_conv_image = scipy.signal.fftconvolve(residual_image, homogenisation_beam, mode='same')
-    flush_fits(residual_conv_image,residual_conv_fits)
+    fits_io.write_fits(residual_conv_image,conv_header,residual_conv_fits)
 
 
     # Sum convolved model and residual
     logging.info('Summing convolved model and residual...')
-    flush_fits(residual_conv_image+model_conv_image,restored_conv_fits)
-
-
-    # Fix headers
-    logging.info('Fixing headers...')
-    beam_header(residual_conv_fits,target_bmaj,target_bmin,target_bpa)
-    beam_header(model_conv_fits,target_bmaj,target_bmin,target_bpa)
-    beam_header(restored_conv_fits,target_bmaj,target_bmin,target_bpa)
+    fits_io.write_fits(residual_conv_image+model_conv_image,conv_header,restored_conv_fits)
 
 
     # Clear up
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Evaluate one or more column assignments in a single pass over an MS, e.g.
+#
+#   python3 eval_MS_columns.py --expr 'DATA = CORRECTED_DATA; DIR1_DATA = MODEL_DATA' my.ms
+#
+# Right-hand sides can contain column names, numerical constants, the
+# operators + - * / and brackets. Assignments are applied in order, so a
+# later expression sees the values assigned by an earlier one. Columns that
+# are assigned to but do not exist are created using the DATA column
+# description (as per add_MS_column.py).
+
+
+import ast
+import numpy
+import sys
+from optparse import OptionParser
+from pyrap.tables import table
+
+
+BINOPS = {
+    ast.Add: numpy.add,
+    ast.Sub: numpy.subtract,
+    ast.Mult: numpy.multiply,
+    ast.Div: numpy.divide
+    }
+
+UNARYOPS = {
+    ast.UAdd: numpy.positive,
+    ast.USub: numpy.negative
+    }
+
+# Numbers are parsed as ast.Num before Python 3.8
+NUMBERS = tuple([getattr(ast,name) for name in ['Constant','Num'] if hasattr(ast,name)])
+
+VALUE_TYPES = {
+    'boolean': bool,
+    'float': numpy.float32,
+    'double': numpy.float64,
+    'complex': numpy.complex64,
+    'dcomplex': numpy.complex128
+    }
+
+
+def parse_assignments(expr):
+
+    """
+    Turn 'A = B; C = D - E' into a list of (colname, parsed RHS, RHS string)
+    tuples
+    """
+
+    assignments = []
+    for item in expr.split(';'):
+        item = item.strip()
+        if item == '':
+            continue
+        if item.count('=') != 1:
+            print('Cannot parse assignment: '+item)
+            sys.exit()
+        lhs,rhs = item.split('=')
+        lhs = lhs.strip()
+        if not lhs.isidentifier():
+            print('Invalid destination column name: '+lhs)
+            sys.exit()
+        try:
+            tree = ast.parse(rhs.strip(),mode='eval').body
+        except SyntaxError:
+            print('Cannot parse expression: '+rhs.strip())
+            sys.exit()
+        check_node(tree)
+        assignments.append((lhs,tree,rhs.strip()))
+    return assignments
+
+
+def check_node(node):
+
+    """
+    Only permit column names, numbers, arithmetic and brackets
+    """
+
+    if isinstance(node,ast.BinOp) and type(node.op) in BINOPS:
+        check_node(node.left)
+        check_node(node.right)
+    elif isinstance(node,ast.UnaryOp) and type(node.op) in UNARYOPS:
+        check_node(node.operand)
+    elif isinstance(node,ast.Name):
+        pass
+    elif isinstance(node,NUMBERS) and isinstance(get_number(node),(int,float,complex)):
+        pass
+    else:
+        print('Unsupported term in expression: '+ast.dump(node))
+        sys.exit()
+
+
+def get_number(node):
+    return node.n if hasattr(node,'n') else node.value
+
+
+def get_names(node):
+
+    """
+    Column names referenced by a parsed RHS
+    """
+
+    return [item.id for item in ast.walk(node) if isinstance(item,ast.Name)]
+
+
+def evaluate(node,coldata):
+
+    """
+    Evaluate a parsed RHS given a dict of column arrays
+    """
+
+    if isinstance(node,ast.BinOp):
+        return BINOPS[type(node.op)](evaluate(node.left,coldata),evaluate(node.right,coldata))
+    elif isinstance(node,ast.UnaryOp):
+        return UNARYOPS[type(node.op)](evaluate(node.operand,coldata))
+    elif isinstance(node,ast.Name):
+        return coldata[node.id]
+    else:
+        return get_number(node)
+
+
+def get_read_cols(assignments):
+
+    """
+    Columns that need to be read from the MS, i.e. those referenced before
+    being assigned to by an earlier expression
+    """
+
+    read_cols = []
+    assigned = []
+    for lhs,rhs,text in assignments:
+        for name in get_names(rhs):
+            if name not in assigned and name not in read_cols:
+                read_cols.append(name)
+        if lhs not in assigned:
+            assigned.append(lhs)
+    return read_cols,assigned
+
+
+def add_data_col(tt,colname):
+    print('Adding '+colname)
+    desc = tt.getcoldesc('DATA')
+    desc['name'] = colname
+    desc['comment'] = desc['comment'].replace(' ','_')
+    tt.addcols(desc)
+
+
+def evalcols(msname,assignments,field,ddid,unflagged,rowchunk):
+
+    read_cols,write_cols = get_read_cols(assignments)
+
+    t0 = table(msname,readonly=False)
+    colnames = t0.colnames()
+
+    missing = [col for col in read_cols if col not in colnames]
+    if len(missing) > 0:
+        print('Column(s) not present in MS: '+', '.join(missing))
+        t0.done()
+        sys.exit()
+
+    for col in write_cols:
+        if col not in colnames:
+            add_data_col(t0,col)
+
+    # Destination columns that are only partially overwritten need reading too
+    if unflagged:
+        if 'FLAG' not in read_cols:
+            read_cols.append('FLAG')
+        for col in write_cols:
+            if col not in read_cols:
+                read_cols.append(col)
+
+    selection = []
+    if field != '':
+        print('Selecting FIELD_ID '+str(field))
+        selection.append('FIELD_ID IN ['+str(field)+']')
+    if ddid != '':
+        print('Selecting DATA_DESC_ID '+str(ddid))
+        selection.append('DATA_DESC_ID IN ['+str(ddid)+']')
+    if len(selection) > 0:
+        tt = t0.query(query=' && '.join(selection))
+    else:
+        tt = t0
+
+    for lhs,rhs,text in assignments:
+        print('Assigning '+lhs+' = '+text)
+    dtypes = {}
+    for col in write_cols:
+        dtypes[col] = VALUE_TYPES.get(t0.getcoldesc(col)['valueType'],numpy.complex64)
+
+    spws = numpy.unique(tt.getcol('DATA_DESC_ID'))
+    print('Spectral windows: '+str(spws))
+
+    for spw in spws:
+        spw_tab = tt.query(query='DATA_DESC_ID=='+str(spw))
+
+        nrows = spw_tab.nrows()
+        for start_row in range(0,nrows,rowchunk):
+            nr = min(rowchunk,nrows-start_row)
+            print('Processing rows: '+str(start_row)+' to '+str(start_row+nr)+' for SPW '+str(spw))
+            coldata = {}
+            for col in read_cols:
+                coldata[col] = spw_tab.getcol(col,start_row,nr)
+            # Results from constants or row-independent terms are broadcast
+            # to the full shape of the destination column
+            shape = (nr,)+spw_tab.getcell('FLAG',start_row).shape
+            for lhs,rhs,text in assignments:
+                result = evaluate(rhs,coldata)
+                if unflagged:
+                    result = numpy.where(coldata['FLAG'],coldata[lhs],result)
+                coldata[lhs] = numpy.ascontiguousarray(numpy.broadcast_to(result,shape),dtype=dtypes[lhs])
+            for col in write_cols:
+                spw_tab.putcol(col,coldata[col],start_row,nr)
+        spw_tab.done()
+
+    if len(selection) > 0:
+        tt.done()
+    t0.done()
+
+
+def main():
+
+
+    parser = OptionParser(usage = '%prog [options] msname')
+    parser.add_option('--expr', dest = 'expr', help = 'Semicolon-separated list of assignments, e.g. "DATA = CORRECTED_DATA; RESID = CORRECTED_DATA - MODEL_DATA"')
+    parser.add_option('--field', dest = 'field', default = '', help = 'Comma-separated FIELD_ID selection (default = all fields)')
+    parser.add_option('--ddid', dest = 'ddid', default = '', help = 'Comma-separated DATA_DESC_ID selection (default = all)')
+    parser.add_option('--unflagged', dest = 'unflagged', default = False, help = 'Only assign to unflagged visibilities, leaving flagged values untouched (default = assign to all)', action = 'store_true')
+    parser.add_option('--rowchunk', dest = 'rowchunk', default = 500000, help = 'Number of rows to process at once (default = 500000)')
+    (options,args) = parser.parse_args()
+    expr = options.expr
+    field = options.field
+    ddid = options.ddid
+    unflagged = options.unflagged
+    rowchunk = int(options.rowchunk)
+
+
+    if len(args) != 1:
+        print('Please specify a Measurement Set')
+        sys.exit()
+    else:
+        msname = args[0].rstrip('/')
+
+    if not expr:
+        print('Please specify one or more assignments with --expr')
+        sys.exit()
+
+    assignments = parse_assignments(expr)
+    if len(assignments) == 0:
+        print('No assignments found in --expr')
+        sys.exit()
+
+
+    evalcols(msname,assignments,field,ddid,unflagged,rowchunk)
+
+
+
+if __name__ == '__main__':
+
+    main()
@@ -4,32 +4,13 @@
 
 import imageio
 import numpy
+import os.path as o
+import sys
 from argparse import ArgumentParser
-from astropy.io import fits
-import shutil
-    
-
-def get_image(fitsfile):
-    input_hdu = fits.open(fitsfile)[0]
-    if len(input_hdu.data.shape) == 2:
-            image = numpy.array(input_hdu.data[:,:])
-    elif len(input_hdu.data.shape) == 3:
-            image = numpy.array(input_hdu.data[0,:,:])
-    else:
-            image = numpy.array(input_hdu.data[0,0,:,:])
-    return image
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 
 
-def flush_fits(image,fits_file):
-    f = fits.open(fits_file,mode='update')
-    input_hdu = f[0]
-    if len(input_hdu.data.shape) == 2:
-        input_hdu.data[:,:] =image
-    elif len(input_hdu.data.shape) == 3:
-        input_hdu.data[0,:,:] = image
-    else:
-        input_hdu.data[0,0,:,:] = image
-    f.flush()
+from oxkat import fits_io
 
 
 def fft_image(image):
@@ -93,15 +74,14 @@ def main():
     nofits = options.nofits
     nohanning = options.nohanning
 
-    img = get_image(infits)
+    img = fits_io.get_image(infits)
     if not nohanning:
         img = apply_hanning(img)
     fftimg = fft_image(img)
 
     if not nofits:
         fftfits = infits.replace('.fits','_FFT_amplitudes.fits')
-        shutil.copyfile(infits,fftfits)
-        flush_fits(fftimg,fftfits)
+        fits_io.write_fits(fftimg,fits_io.get_header(infits),fftfits)
 
     # if not noeq:
     #     fftimg = hist_eq(fftimg,nbins)
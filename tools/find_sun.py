@@ -5,12 +5,13 @@
 import logging
 import numpy
 import sys
+from optparse import OptionParser
 from pyrap.tables import table
 from astropy.time import Time
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 from astropy.coordinates import solar_system_ephemeris, EarthLocation, AltAz
-from astropy.coordinates import get_body_barycentric, get_body, get_moon
+from astropy.coordinates import get_body
 
 
 def rad2deg(xx):
@@ -34,17 +35,57 @@ def match_field(ids,names,dirs,i):
 def calcsep(ra0,dec0,ra1,dec1):
     c0 = SkyCoord(ra0*u.deg,dec0*u.deg,frame='fk5')
     c1 = SkyCoord(ra1*u.deg,dec1*u.deg,frame='fk5')
-    sep = round(c0.separation(c1).deg,4)
-    return sep 
+    sep = numpy.round(c0.separation(c1).deg,4)
+    return sep
 
 
 def format_coords(ra0,dec0):
     c = SkyCoord(ra0*u.deg,dec0*u.deg,frame='fk5')
-    hms = str(c.ra.to_string(u.hour))
-    dms = str(c.dec)
+    hms = c.ra.to_string(u.hour)
+    dms = c.dec.to_string()
     return hms,dms
 
 
+def get_scan_info(myms):
+
+    """
+    Scan numbers, field IDs, mid-times and start/end times from a single
+    read of the main table
+    """
+
+    maintab = table(myms,ack=False)
+    scan_col = maintab.getcol('SCAN_NUMBER')
+    field_col = maintab.getcol('FIELD_ID')
+    time_col = maintab.getcol('TIME')
+    maintab.done()
+
+    scans,inv = numpy.unique(scan_col,return_inverse=True)
+    counts = numpy.bincount(inv)
+    t_mid = numpy.bincount(inv,weights=time_col) / counts
+    t0 = numpy.full(len(scans),numpy.inf)
+    t1 = numpy.full(len(scans),-numpy.inf)
+    fields = numpy.full(len(scans),numpy.iinfo(field_col.dtype).max,dtype=field_col.dtype)
+    numpy.minimum.at(t0,inv,time_col)
+    numpy.maximum.at(t1,inv,time_col)
+    numpy.minimum.at(fields,inv,field_col)
+    return scans,fields,t_mid,t0,t1
+
+
+def get_bodies(times,loc):
+
+    """
+    Sun and Moon positions and altitudes for an astropy Time array
+    """
+
+    with solar_system_ephemeris.set('builtin'):
+        sun = get_body('Sun', times, loc)
+        moon = get_body('Moon', times, loc)
+    altaz = AltAz(obstime=times,location=loc)
+    sun_alt = sun.transform_to(altaz).alt.value
+    moon_alt = moon.transform_to(altaz).alt.value
+    return sun.ra.value,sun.dec.value,sun_alt,moon.ra.value,moon.dec.value,moon_alt
+
+
 def main():
 
     # MeerKAT
@@ -52,13 +93,21 @@ def main():
     obs_lon = 21.443001467965008
     loc = EarthLocation.from_geodetic(obs_lat,obs_lon) #,obs_height,ellipsoid)
 
+    parser = OptionParser(usage = '%prog [options] msname')
+    parser.add_option('--ngrid', dest = 'ngrid', default = 0, help = 'Number of times per scan at which to evaluate the minimum Sun / Moon separations for the CSV output (default = 0, mid-scan only)')
+    (options,args) = parser.parse_args()
+    ngrid = int(options.ngrid)
 
-    myms = sys.argv[1].rstrip('/')
-    maintab = table(myms,ack=False)
-    scans = list(numpy.unique(maintab.getcol('SCAN_NUMBER')))
+    if len(args) != 1:
+        print('Please specify a Measurement Set')
+        sys.exit()
+
+    myms = args[0].rstrip('/')
+    scans,scan_fields,t_mid,t_start,t_end = get_scan_info(myms)
     ids,names,dirs = get_fields(myms)
 
     logfile = 'sun_'+myms+'.log'
+    csvfile = 'sun_'+myms+'.csv'
     logging.basicConfig(filename=logfile, level=logging.DEBUG, format='%(asctime)s |  %(message)s', datefmt='%d/%m/%Y %H:%M:%S ')
 
 
@@ -68,39 +117,46 @@ def main():
     logging.info('-'*len(header))
     logging.info(header)
     logging.info('-'*len(header))
-    for scan in scans:
-        subtab = maintab.query(query='SCAN_NUMBER=='+str(scan))
-        field = numpy.unique(subtab.getcol('FIELD_ID'))[0]
-        name,field_ra,field_dec = match_field(ids,names,dirs,field)
-        field_hms,field_dms = format_coords(field_ra,field_dec)
-        t_scan = numpy.mean(subtab.getcol('TIME'))
-        t = Time(t_scan/86400.0,format='mjd')
-        with solar_system_ephemeris.set('builtin'):
-            sun = get_body('Sun', t, loc)
-            moon = get_body('Moon', t, loc)
-        sun_ra = sun.ra.value
-        sun_dec = sun.dec.value
-        sun_altaz = sun.transform_to(AltAz(obstime=t,location=loc))
-        sun_alt = sun_altaz.alt.value
-        moon_ra = moon.ra.value
-        moon_dec = moon.dec.value
-        moon_altaz = moon.transform_to(AltAz(obstime=t,location=loc))
-        moon_alt = moon_altaz.alt.value
-        sun_hms,sun_dms = format_coords(sun_ra,sun_dec)
-        moon_hms,moon_dms = format_coords(moon_ra,moon_dec)
-        delta_ra_sun = field_ra - sun_ra
-        delta_dec_sun = field_dec - sun_dec
-        delta_ra_moon = field_ra - moon_ra
-        delta_dec_moon = field_dec - moon_dec
-        sun_sep = calcsep(field_ra,field_dec,sun_ra,sun_dec)
-        moon_sep = calcsep(field_ra,field_dec,moon_ra,moon_dec)
-    #   print field,name,sun_sep
+
+    field_info = [match_field(ids,names,dirs,field) for field in scan_fields]
+    field_names = [item[0] for item in field_info]
+    field_ra = numpy.array([item[1] for item in field_info])
+    field_dec = numpy.array([item[2] for item in field_info])
+
+    t = Time(t_mid/86400.0,format='mjd')
+    t_iso = t.iso
+    sun_ra,sun_dec,sun_alt,moon_ra,moon_dec,moon_alt = get_bodies(t,loc)
+    sun_hms,sun_dms = format_coords(sun_ra,sun_dec)
+    moon_hms,moon_dms = format_coords(moon_ra,moon_dec)
+    sun_sep = calcsep(field_ra,field_dec,sun_ra,sun_dec)
+    moon_sep = calcsep(field_ra,field_dec,moon_ra,moon_dec)
+
+    if ngrid > 1:
+        # Worst case separations over a grid of times spanning each scan
+        frac = numpy.linspace(0.0,1.0,ngrid)
+        t_grid = t_start[:,None] + frac[None,:]*(t_end - t_start)[:,None]
+        grid = get_bodies(Time(t_grid.ravel()/86400.0,format='mjd'),loc)
+        ra_grid = numpy.repeat(field_ra,ngrid)
+        dec_grid = numpy.repeat(field_dec,ngrid)
+        min_sun_sep = calcsep(ra_grid,dec_grid,grid[0],grid[1]).reshape(-1,ngrid).min(axis=1)
+        min_moon_sep = calcsep(ra_grid,dec_grid,grid[3],grid[4]).reshape(-1,ngrid).min(axis=1)
+    else:
+        min_sun_sep = sun_sep
+        min_moon_sep = moon_sep
+
+    f = open(csvfile,'w')
+    f.write('t_iso,t_mjd_s,scan,field,name,sun_ra_deg,sun_dec_deg,sun_sep_deg,sun_min_sep_deg,sun_alt_deg,moon_ra_deg,moon_dec_deg,moon_sep_deg,moon_min_sep_deg,moon_alt_deg\n')
+    for i in range(0,len(scans)):
         logging.info('%-28s %-5i %-5i %-12s %-12f %-12f %-16s %-16s %-12f %-12f %-12f %-12f %-16s %-16s %-12f %-12f' %
-            (t.iso,scan,field,name,sun_ra,sun_dec,sun_hms,sun_dms,sun_sep,sun_alt,moon_ra,moon_dec,moon_hms,moon_dms,moon_sep,moon_alt))
+            (t_iso[i],scans[i],scan_fields[i],field_names[i],sun_ra[i],sun_dec[i],sun_hms[i],sun_dms[i],sun_sep[i],sun_alt[i],moon_ra[i],moon_dec[i],moon_hms[i],moon_dms[i],moon_sep[i],moon_alt[i]))
+        f.write(','.join([t_iso[i],str(t_mid[i]),str(scans[i]),str(scan_fields[i]),field_names[i],
+            str(sun_ra[i]),str(sun_dec[i]),str(sun_sep[i]),str(min_sun_sep[i]),str(sun_alt[i]),
+            str(moon_ra[i]),str(moon_dec[i]),str(moon_sep[i]),str(min_moon_sep[i]),str(moon_alt[i])])+'\n')
+    f.close()
 
     logging.info('-'*len(header))
 
 
 if __name__ == "__main__":
 
-    main()
\ No newline at end of file
+    main()
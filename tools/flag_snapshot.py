@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# CASA-independent backups of the FLAG column, e.g.
+#
+#   python3 flag_snapshot.py save --versionname basic my.ms
+#   python3 flag_snapshot.py restore --versionname basic my.ms
+#   python3 flag_snapshot.py diff --versionname basic --compare tricolour1 my.ms
+#   python3 flag_snapshot.py list my.ms
+#
+# Snapshots live in <msname>.flagsnapshots/. FLAG is stored in row chunks
+# as numpy.packbits bitmaps, one zlib-compressed file per chunk. Unless
+# --full is given, each snapshot is stored as the XOR against the previous
+# snapshot, so the files only encode the flags that changed between stages
+# and compress to almost nothing. Restoring a snapshot replays the chain
+# of deltas back to the last full snapshot.
+#
+# Chunks are packed / unpacked by a pool of worker processes, and the parent
+# process alone writes to the MS.
+
+
+import json
+import numpy
+import os
+import shutil
+import sys
+import time
+import zlib
+from multiprocessing import Pool
+from optparse import OptionParser
+from pyrap.tables import table
+
+
+INDEX = 'index.json'
+
+MODES = ['save','restore','diff','list']
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def snapshot_dir(myms):
+    return myms.rstrip('/')+'.flagsnapshots'
+
+
+def read_index(snapdir):
+    if not os.path.isfile(snapdir+'/'+INDEX):
+        return {'versions': []}
+    with open(snapdir+'/'+INDEX) as f:
+        index = json.load(f)
+    return index
+
+
+def write_index(snapdir,index):
+    with open(snapdir+'/'+INDEX,'w') as f:
+        json.dump(index,f,indent=1)
+
+
+def get_version(index,versionname):
+    for version in index['versions']:
+        if version['name'] == versionname:
+            return version
+    return None
+
+
+def chunk_file(snapdir,versionname,ichunk):
+    return snapdir+'/'+versionname+'/'+str(ichunk).zfill(6)+'.z'
+
+
+def get_chunks(nrows,rowchunk):
+    return [(ichunk,start_row,min(rowchunk,nrows-start_row)) for ichunk,start_row in enumerate(range(0,nrows,rowchunk))]
+
+
+def read_packed(snapdir,index,versionname,ichunk):
+
+    """
+    Packed flags for one chunk of a version, applying any deltas
+    """
+
+    version = get_version(index,versionname)
+    f = open(chunk_file(snapdir,versionname,ichunk),'rb')
+    packed = numpy.frombuffer(zlib.decompress(f.read()),dtype=numpy.uint8)
+    f.close()
+    if version['parent'] is not None:
+        packed = packed ^ read_packed(snapdir,index,version['parent'],ichunk)
+    return packed
+
+
+def unpack(packed,nr,cellshape):
+    nbits = nr*int(numpy.prod(cellshape))
+    return numpy.unpackbits(packed,count=nbits).astype(bool).reshape((nr,)+tuple(cellshape))
+
+
+def save_chunk(myms,snapdir,index,versionname,parent,ichunk,start_row,nr):
+    tt = table(myms,ack=False)
+    flag = tt.getcol('FLAG',start_row,nr)
+    tt.done()
+    packed = numpy.packbits(flag.ravel())
+    if parent is not None:
+        packed = packed ^ read_packed(snapdir,index,parent,ichunk)
+    f = open(chunk_file(snapdir,versionname,ichunk),'wb')
+    f.write(zlib.compress(packed.tobytes(),6))
+    f.close()
+    return int(numpy.sum(flag))
+
+
+def restore_chunk(snapdir,index,versionname,cellshape,ichunk,start_row,nr):
+    return start_row,nr,unpack(read_packed(snapdir,index,versionname,ichunk),nr,cellshape)
+
+
+def restore_chunk_star(args):
+    return restore_chunk(*args)
+
+
+def diff_chunk(myms,snapdir,index,versionname,compare,cellshape,ichunk,start_row,nr):
+
+    """
+    Flag counts for a version and a second version (or the MS), and the
+    number of visibilities flagged / unflagged between them
+    """
+
+    flag0 = unpack(read_packed(snapdir,index,versionname,ichunk),nr,cellshape)
+    if compare == '':
+        tt = table(myms,ack=False)
+        flag1 = tt.getcol('FLAG',start_row,nr)
+        tt.done()
+    else:
+        flag1 = unpack(read_packed(snapdir,index,compare,ichunk),nr,cellshape)
+    return numpy.array([numpy.sum(flag0),numpy.sum(flag1),numpy.sum(flag1 & ~flag0),numpy.sum(flag0 & ~flag1)])
+
+
+def dir_size(path):
+    return sum([os.path.getsize(path+'/'+ff) for ff in os.listdir(path)])
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] save|restore|diff|list msname')
+    parser.add_option('--versionname', dest = 'versionname', default = '', help = 'Name of the snapshot to save, restore or diff')
+    parser.add_option('--compare', dest = 'compare', default = '', help = 'Second snapshot for diff (default = current FLAG column)')
+    parser.add_option('--full', dest = 'full', default = False, help = 'Save a full snapshot rather than a delta against the previous one', action = 'store_true')
+    parser.add_option('--overwrite', dest = 'overwrite', default = False, help = 'Replace an existing snapshot of the same name (only if no later snapshot depends on it)', action = 'store_true')
+    parser.add_option('--rowchunk', dest = 'rowchunk', default = 200000, help = 'Number of rows per chunk (default = 200000)')
+    parser.add_option('-j', '--jobs', dest = 'jobs', default = 8, help = 'Number of worker processes (default = 8)')
+    (options,args) = parser.parse_args()
+    versionname = options.versionname
+    compare = options.compare
+    full = options.full
+    overwrite = options.overwrite
+    rowchunk = int(options.rowchunk)
+    jobs = int(options.jobs)
+
+    if len(args) != 2 or args[0] not in MODES:
+        msg('Please specify one of '+', '.join(MODES)+' and a Measurement Set')
+        sys.exit()
+    else:
+        mode = args[0]
+        myms = args[1].rstrip('/')
+
+    snapdir = snapshot_dir(myms)
+    index = read_index(snapdir)
+
+    if mode == 'list':
+        for version in index['versions']:
+            size = dir_size(snapdir+'/'+version['name'])
+            msg('%-24s %-24s %8.2f %% flagged  %10.2f MB  parent = %s' % (version['name'],version['time'],version['flagged'],size/1e6,version['parent']))
+        sys.exit()
+
+    if versionname == '':
+        msg('Please specify a snapshot with --versionname')
+        sys.exit()
+
+    tt = table(myms,ack=False)
+    nrows = tt.nrows()
+    cellshape = list(tt.getcell('FLAG',0).shape)
+    tt.done()
+
+    if mode == 'save':
+
+        existing = get_version(index,versionname)
+        if existing is not None:
+            children = [version['name'] for version in index['versions'] if version['parent'] == versionname]
+            if not overwrite:
+                msg(versionname+' exists, use --overwrite to replace it')
+                sys.exit()
+            if len(children) > 0:
+                msg(versionname+' cannot be replaced, later snapshots depend on it: '+', '.join(children))
+                sys.exit()
+            index['versions'].remove(existing)
+            shutil.rmtree(snapdir+'/'+versionname)
+
+        parent = None
+        if not full and len(index['versions']) > 0:
+            previous = index['versions'][-1]
+            if previous['nrows'] == nrows and previous['cellshape'] == cellshape:
+                parent = previous['name']
+                # Deltas are taken chunk by chunk, so use the chunking of the parent
+                rowchunk = previous['rowchunk']
+
+        os.makedirs(snapdir+'/'+versionname)
+        chunks = get_chunks(nrows,rowchunk)
+        msg('Saving FLAG to '+snapdir+'/'+versionname+(' as delta against '+parent if parent else ' (full)'))
+        pool = Pool(processes=jobs)
+        counts = pool.starmap(save_chunk,[(myms,snapdir,index,versionname,parent)+chunk for chunk in chunks])
+        pool.close()
+        pool.join()
+
+        flagged = 100.0*sum(counts)/(nrows*numpy.prod(cellshape))
+        index['versions'].append({'name': versionname,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'parent': parent,
+            'nrows': nrows,
+            'cellshape': cellshape,
+            'rowchunk': rowchunk,
+            'flagged': round(flagged,4)})
+        write_index(snapdir,index)
+        msg('Saved %s, %.2f %% flagged, %.2f MB' % (versionname,flagged,dir_size(snapdir+'/'+versionname)/1e6))
+
+    else:
+
+        version = get_version(index,versionname)
+        if version is None:
+            msg(versionname+' not found in '+snapdir)
+            sys.exit()
+        if compare != '' and get_version(index,compare) is None:
+            msg(compare+' not found in '+snapdir)
+            sys.exit()
+        if version['nrows'] != nrows or version['cellshape'] != cellshape:
+            msg(versionname+' does not match the shape of the FLAG column in '+myms)
+            sys.exit()
+        chunks = get_chunks(nrows,version['rowchunk'])
+
+        if mode == 'restore':
+            msg('Restoring FLAG from '+snapdir+'/'+versionname)
+            # Start the workers before the MS is opened for writing in this process
+            pool = Pool(processes=jobs)
+            tt = table(myms,readonly=False,ack=False)
+            for start_row,nr,flag in pool.imap(restore_chunk_star,[(snapdir,index,versionname,cellshape)+chunk for chunk in chunks]):
+                tt.putcol('FLAG',flag,start_row,nr)
+                tt.putcol('FLAG_ROW',numpy.all(flag,axis=(1,2)),start_row,nr)
+            pool.close()
+            pool.join()
+            tt.done()
+            msg('Restored '+versionname)
+
+        elif mode == 'diff':
+            pool = Pool(processes=jobs)
+            counts = numpy.sum(pool.starmap(diff_chunk,[(myms,snapdir,index,versionname,compare,cellshape)+chunk for chunk in chunks]),axis=0)
+            pool.close()
+            pool.join()
+            total = nrows*numpy.prod(cellshape)
+            label = compare if compare != '' else 'current'
+            msg('%-24s : %8.4f %% flagged' % (versionname,100.0*counts[0]/total))
+            msg('%-24s : %8.4f %% flagged' % (label,100.0*counts[1]/total))
+            msg('%-24s : %8.4f %%' % ('Newly flagged',100.0*counts[2]/total))
+            msg('%-24s : %8.4f %%' % ('Newly unflagged',100.0*counts[3]/total))
+
+
+if __name__ == '__main__':
+
+    main()
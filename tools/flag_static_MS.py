@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Apply the static flags from 1GC_02_casa_basic_flags.py in a single pass
+# over an MS, e.g.
+#
+#   python3 flag_static_MS.py --badfreqs '*:850~900MHz,*:1658~1800MHz' \
+#       --blfreqs '*:900MHz~915MHz' --uvrange '<600' \
+#       --autocorr --clipzeros --clipmax 100 my.ms
+#
+# Frequency ranges are converted to channel masks once using CHAN_FREQ
+# (a channel is selected if its centre frequency is within the range) and
+# the uv-range cut uses the projected baseline length from UVW. Row chunks
+# are processed by a pool of worker processes, and the parent ORs the new
+# flags into FLAG and FLAG_ROW. The fraction of data newly flagged by each
+# rule, in the order above, is reported at the end.
+
+
+import numpy
+import re
+import sys
+import time
+from multiprocessing import Pool
+from optparse import OptionParser
+from pyrap.tables import table
+
+
+C = 299792458.0
+
+UNITS = {'hz': 1.0, 'khz': 1e3, 'mhz': 1e6, 'ghz': 1e9}
+
+UV_UNITS = {'m': 1.0, 'km': 1e3, 'lambda': 1.0, 'klambda': 1e3}
+
+RULES = ['badfreqs','blfreqs','autocorr','clipzeros','clip']
+
+INPUT = {}
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def split_unit(val,units):
+    match = re.match(r'^\s*([0-9.eE+-]+)\s*([a-zA-Z]*)\s*$',val)
+    if not match:
+        msg('Cannot parse '+val)
+        sys.exit()
+    unit = match.group(2).lower()
+    if unit != '' and unit not in units:
+        msg('Unknown unit in '+val)
+        sys.exit()
+    return float(match.group(1)),unit
+
+
+def parse_freq_ranges(freqs):
+
+    """
+    Turn '*:850~900MHz,0:1419.8MHz~1421.3MHz' into a list of
+    (spw, lo, hi) tuples in Hz, with spw = -1 for all spectral windows
+    """
+
+    ranges = []
+    for item in freqs.split(','):
+        item = item.strip()
+        if item == '':
+            continue
+        if ':' in item:
+            spw,item = item.split(':')
+            spw = -1 if spw.strip() in ['','*'] else int(spw)
+        else:
+            spw = -1
+        parts = item.split('~')
+        if len(parts) != 2:
+            msg('Frequency selection must be a range: '+item)
+            sys.exit()
+        lo,lo_unit = split_unit(parts[0],UNITS)
+        hi,hi_unit = split_unit(parts[1],UNITS)
+        if hi_unit == '':
+            hi_unit = 'hz'
+        if lo_unit == '':
+            lo_unit = hi_unit
+        ranges.append((spw,lo*UNITS[lo_unit],hi*UNITS[hi_unit]))
+    return ranges
+
+
+def parse_uvrange(uvrange):
+
+    """
+    Turn a CASA-style uvrange ('<600', '>150m', '100~600m', '<10klambda')
+    into (lo, hi, in_wavelengths), in metres or wavelengths
+    """
+
+    uvrange = uvrange.strip()
+    if uvrange == '':
+        return None
+    if uvrange.startswith('<'):
+        hi,unit = split_unit(uvrange[1:],UV_UNITS)
+        lo = 0.0
+    elif uvrange.startswith('>'):
+        lo,unit = split_unit(uvrange[1:],UV_UNITS)
+        hi = numpy.inf
+    else:
+        parts = uvrange.split('~')
+        lo,lo_unit = split_unit(parts[0],UV_UNITS)
+        hi,unit = split_unit(parts[1],UV_UNITS)
+        if lo_unit != '':
+            unit = lo_unit
+    if unit == '':
+        unit = 'm'
+    return lo*UV_UNITS[unit],hi*UV_UNITS[unit],'lambda' in unit
+
+
+def get_chan_freqs(myms):
+    spwtab = table(myms+'/SPECTRAL_WINDOW',ack=False)
+    chan_freqs = [spwtab.getcell('CHAN_FREQ',i) for i in range(0,spwtab.nrows())]
+    spwtab.done()
+    ddtab = table(myms+'/DATA_DESCRIPTION',ack=False)
+    spw_ids = ddtab.getcol('SPECTRAL_WINDOW_ID')
+    ddtab.done()
+    return spw_ids,chan_freqs
+
+
+def get_chan_masks(ranges,spw_ids,chan_freqs):
+
+    """
+    Boolean channel mask per DATA_DESC_ID for a list of frequency ranges
+    """
+
+    masks = []
+    for spw in spw_ids:
+        freqs = chan_freqs[spw]
+        mask = numpy.zeros(len(freqs),dtype=bool)
+        for sel_spw,lo,hi in ranges:
+            if sel_spw in [-1,spw]:
+                mask |= (freqs >= lo) & (freqs <= hi)
+        masks.append(mask)
+    return masks
+
+
+def open_input(myms,datacol,rules,uvsel,freqs):
+    INPUT['tt'] = table(myms,ack=False,lockoptions='usernoread')
+    INPUT['datacol'] = datacol
+    INPUT['rules'] = rules
+    INPUT['uvsel'] = uvsel
+    INPUT['freqs'] = freqs
+
+
+def flag_chunk(chunk):
+
+    """
+    Evaluate the static flags for one chunk of rows, runs in a worker process
+    """
+
+    start_row,nr = chunk
+    tt = INPUT['tt']
+    rules = INPUT['rules']
+
+    flag = tt.getcol('FLAG',start_row,nr)
+    ddids = tt.getcol('DATA_DESC_ID',start_row,nr)
+    counts = numpy.zeros(len(RULES),dtype=numpy.int64)
+
+    def apply(ii,mask):
+        new = mask & ~flag
+        counts[ii] = numpy.sum(new)
+        flag[new] = True
+
+    if 'badfreqs' in rules:
+        apply(0,numpy.broadcast_to(rules['badfreqs'][ddids][:,:,None],flag.shape))
+
+    if 'blfreqs' in rules:
+        uvw = tt.getcol('UVW',start_row,nr)
+        uvdist = numpy.sqrt(uvw[:,0]**2 + uvw[:,1]**2)
+        lo,hi,in_lambda = INPUT['uvsel']
+        if in_lambda:
+            uvdist = uvdist[:,None] * INPUT['freqs'][ddids] / C
+        else:
+            uvdist = uvdist[:,None]
+        apply(1,numpy.broadcast_to(((uvdist >= lo) & (uvdist <= hi) & rules['blfreqs'][ddids])[:,:,None],flag.shape))
+
+    if 'autocorr' in rules:
+        autos = tt.getcol('ANTENNA1',start_row,nr) == tt.getcol('ANTENNA2',start_row,nr)
+        apply(2,numpy.broadcast_to(autos[:,None,None],flag.shape))
+
+    if 'clipzeros' in rules or 'clip' in rules:
+        amp = numpy.abs(tt.getcol(INPUT['datacol'],start_row,nr))
+        if 'clipzeros' in rules:
+            apply(3,amp == 0.0)
+        if 'clip' in rules:
+            clipmin,clipmax = rules['clip']
+            with numpy.errstate(invalid='ignore'):
+                apply(4,~numpy.isfinite(amp) | (amp < clipmin) | (amp > clipmax))
+
+    return start_row,nr,flag,counts
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] msname')
+    parser.add_option('--badfreqs', dest = 'badfreqs', default = '', help = 'Comma-separated frequency ranges to flag on all baselines, e.g. *:850~900MHz (as per CAL_1GC_BAD_FREQS)')
+    parser.add_option('--blfreqs', dest = 'blfreqs', default = '', help = 'Comma-separated frequency ranges to flag within --uvrange (as per CAL_1GC_BL_FREQS)')
+    parser.add_option('--uvrange', dest = 'uvrange', default = '<600', help = 'Baseline range for --blfreqs, units m, km, lambda or klambda (default = <600, i.e. metres, as per CAL_1GC_BL_FLAG_UVRANGE)')
+    parser.add_option('--autocorr', dest = 'autocorr', default = False, help = 'Flag auto-correlations', action = 'store_true')
+    parser.add_option('--clipzeros', dest = 'clipzeros', default = False, help = 'Flag visibilities with zero amplitude', action = 'store_true')
+    parser.add_option('--clipmin', dest = 'clipmin', default = 0.0, help = 'Flag visibilities with amplitudes below this value, if --clipmax is set (default = 0)')
+    parser.add_option('--clipmax', dest = 'clipmax', default = '', help = 'Flag visibilities with amplitudes above this value, NaNs and Infs (default = no clipping)')
+    parser.add_option('--datacol', dest = 'datacol', default = 'DATA', help = 'Column to use for clipping (default = DATA)')
+    parser.add_option('--rowchunk', dest = 'rowchunk', default = 100000, help = 'Number of rows per chunk (default = 100000)')
+    parser.add_option('-j', '--jobs', dest = 'jobs', default = 8, help = 'Number of worker processes (default = 8)')
+    (options,args) = parser.parse_args()
+    rowchunk = int(options.rowchunk)
+    jobs = int(options.jobs)
+
+    if len(args) != 1:
+        msg('Please specify a Measurement Set')
+        sys.exit()
+    else:
+        myms = args[0].rstrip('/')
+
+    spw_ids,chan_freqs = get_chan_freqs(myms)
+    nchans = numpy.unique([len(chan_freqs[spw]) for spw in spw_ids])
+    if len(nchans) != 1:
+        msg('Spectral windows with different numbers of channels are not supported')
+        sys.exit()
+    freqs = numpy.array([chan_freqs[spw] for spw in spw_ids])
+
+    rules = {}
+    uvsel = None
+    if options.badfreqs != '':
+        rules['badfreqs'] = numpy.array(get_chan_masks(parse_freq_ranges(options.badfreqs),spw_ids,chan_freqs))
+        msg('Bad frequencies     : '+str(int(rules['badfreqs'].sum()))+' channels')
+    if options.blfreqs != '':
+        uvsel = parse_uvrange(options.uvrange)
+        rules['blfreqs'] = numpy.array(get_chan_masks(parse_freq_ranges(options.blfreqs),spw_ids,chan_freqs))
+        msg('Baseline frequencies: '+str(int(rules['blfreqs'].sum()))+' channels for uvrange '+options.uvrange)
+    if options.autocorr:
+        rules['autocorr'] = True
+    if options.clipzeros:
+        rules['clipzeros'] = True
+    if options.clipmax != '':
+        rules['clip'] = (float(options.clipmin),float(options.clipmax))
+        msg('Clipping            : '+str(rules['clip'])+' on '+options.datacol)
+
+    if len(rules) == 0:
+        msg('No flagging rules specified')
+        sys.exit()
+
+    tt = table(myms,ack=False)
+    nrows = tt.nrows()
+    tt.done()
+    chunks = [(start_row,min(rowchunk,nrows-start_row)) for start_row in range(0,nrows,rowchunk)]
+
+    # Start the workers before the MS is opened for writing in this process
+    pool = Pool(processes=jobs,initializer=open_input,initargs=(myms,options.datacol,rules,uvsel,freqs))
+    tt = table(myms,readonly=False,ack=False,lockoptions='user')
+    tt.lock()
+    total = 0
+    counts = numpy.zeros(len(RULES),dtype=numpy.int64)
+    for start_row,nr,flag,chunk_counts in pool.imap(flag_chunk,chunks):
+        tt.putcol('FLAG',flag,start_row,nr)
+        tt.putcol('FLAG_ROW',tt.getcol('FLAG_ROW',start_row,nr) | numpy.all(flag,axis=(1,2)),start_row,nr)
+        total += flag.size
+        counts += chunk_counts
+        msg('Processed rows      : '+str(start_row)+' to '+str(start_row+nr))
+    pool.close()
+    pool.join()
+    tt.unlock()
+    tt.done()
+
+    for ii,rule in enumerate(RULES):
+        if rule in rules:
+            msg('Newly flagged by %-10s: %.4f %%' % (rule,100.0*counts[ii]/total))
+    msg('Done')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Run the SumThreshold flagger in oxkat/sum_threshold.py over selected
+# fields of an MS, e.g. for the calibrators:
+#
+#   python3 flag_sumthreshold_MS.py --fields 1934-638,J1939-6342 my.ms
+#
+# Each scan of the selected fields is read once and split into per-baseline
+# (time, freq, corr) blocks, which are flagged by a pool of worker processes.
+# The parent writes FLAG back one scan at a time. Only the sum_threshold
+# strategies of the Tricolour config are applied.
+
+
+import numpy
+import os.path as o
+import sys
+import time
+from multiprocessing import Pool
+from optparse import OptionParser
+from pyrap.tables import table
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+
+
+from oxkat import sum_threshold
+
+
+STRATEGIES = []
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def get_field_ids(myms,fields):
+    fldtab = table(myms+'/FIELD',ack=False)
+    names = fldtab.getcol('NAME')
+    fldtab.done()
+    field_ids = []
+    for field in fields.split(','):
+        # Names take precedence over IDs, as field names can be numeric
+        if field in names:
+            field_ids.append(names.index(field))
+        elif field.isdigit() and int(field) < len(names):
+            field_ids.append(int(field))
+        else:
+            msg('Field '+field+' not found in '+myms)
+    return field_ids
+
+
+def get_scan_ranges(myms,field_ids):
+
+    """
+    Contiguous (start_row, nrows) ranges of each scan on the selected fields
+    """
+
+    tt = table(myms,ack=False)
+    scans = tt.getcol('SCAN_NUMBER')
+    fields = tt.getcol('FIELD_ID')
+    tt.done()
+    edges = numpy.flatnonzero((numpy.diff(scans) != 0) | (numpy.diff(fields) != 0)) + 1
+    starts = numpy.concatenate(([0],edges))
+    ends = numpy.concatenate((edges,[len(scans)]))
+    ranges = []
+    for start,end in zip(starts,ends):
+        if fields[start] in field_ids:
+            ranges.append((int(scans[start]),int(fields[start]),int(start),int(end-start)))
+    return ranges
+
+
+def get_blocks(times,ant1,ant2,ddids):
+
+    """
+    Row indices of each (baseline, DATA_DESC_ID) block, in time order
+    """
+
+    keys = numpy.stack((ddids,ant1,ant2),axis=1)
+    uniq,inv = numpy.unique(keys,axis=0,return_inverse=True)
+    inv = inv.ravel()
+    order = numpy.lexsort((times,inv))
+    bounds = numpy.flatnonzero(numpy.diff(inv[order])) + 1
+    return numpy.split(order,bounds)
+
+
+def init_worker(strategies):
+    STRATEGIES[:] = strategies
+
+
+def flag_block(args):
+    vis,flag = args
+    return sum_threshold.flag_block(vis,flag,STRATEGIES)
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] msname')
+    parser.add_option('--fields', dest = 'fields', default = '', help = 'Comma-separated field names or IDs to flag (required)')
+    parser.add_option('--config', dest = 'config', default = 'data/tricolour/target_flagging_1.yaml', help = 'Tricolour config from which to take the sum_threshold strategies (default = data/tricolour/target_flagging_1.yaml)')
+    parser.add_option('--datacol', dest = 'datacol', default = 'DATA', help = 'Column to flag on (default = DATA)')
+    parser.add_option('--noautos', dest = 'noautos', default = False, help = 'Skip auto-correlations', action = 'store_true')
+    parser.add_option('-j', '--jobs', dest = 'jobs', default = 8, help = 'Number of worker processes (default = 8)')
+    (options,args) = parser.parse_args()
+    fields = options.fields
+    config = options.config
+    datacol = options.datacol
+    noautos = options.noautos
+    jobs = int(options.jobs)
+
+    if len(args) != 1:
+        msg('Please specify a Measurement Set')
+        sys.exit()
+    else:
+        myms = args[0].rstrip('/')
+
+    if fields == '':
+        msg('Please specify one or more fields')
+        sys.exit()
+
+    strategies = sum_threshold.read_strategies(config)
+    if len(strategies) == 0:
+        msg('No sum_threshold strategies found in '+config)
+        sys.exit()
+    msg('Strategies          : '+', '.join([name for name,kwargs in strategies]))
+
+    field_ids = get_field_ids(myms,fields)
+    scan_ranges = get_scan_ranges(myms,field_ids)
+    msg('Fields              : '+', '.join([str(xx) for xx in field_ids])+' ('+str(len(scan_ranges))+' scans)')
+
+    # Start the workers before the MS is opened for writing in this process
+    pool = Pool(processes=jobs,initializer=init_worker,initargs=(strategies,))
+    tt = table(myms,readonly=False,ack=False)
+
+    n_before = 0
+    n_after = 0
+    n_total = 0
+    for scan,field,start_row,nr in scan_ranges:
+        times = tt.getcol('TIME',start_row,nr)
+        ant1 = tt.getcol('ANTENNA1',start_row,nr)
+        ant2 = tt.getcol('ANTENNA2',start_row,nr)
+        ddids = tt.getcol('DATA_DESC_ID',start_row,nr)
+        vis = tt.getcol(datacol,start_row,nr)
+        flag = tt.getcol('FLAG',start_row,nr)
+
+        blocks = get_blocks(times,ant1,ant2,ddids)
+        if noautos:
+            blocks = [rows for rows in blocks if ant1[rows[0]] != ant2[rows[0]]]
+        results = pool.map(flag_block,[(vis[rows],flag[rows]) for rows in blocks])
+
+        n_before += numpy.sum(flag)
+        for rows,block_flag in zip(blocks,results):
+            flag[rows] = block_flag
+        n_after += numpy.sum(flag)
+        n_total += flag.size
+        tt.putcol('FLAG',flag,start_row,nr)
+        tt.putcol('FLAG_ROW',numpy.all(flag,axis=(1,2)),start_row,nr)
+        msg('Scan %-5i field %-3i : %6.2f %% flagged' % (scan,field,100.0*numpy.mean(flag)))
+
+    pool.close()
+    pool.join()
+    tt.done()
+
+    if n_total > 0:
+        msg('Flagged fraction    : %.2f %% -> %.2f %%' % (100.0*n_before/n_total,100.0*n_after/n_total))
+    msg('Done')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Render time x frequency flag occupancy waterfalls from an MS, e.g.
+#
+#   python3 flag_waterfall.py --outdir VISPLOTS --fits my.ms
+#
+# FLAG, TIME, ANTENNA1/2 and DATA_DESC_ID are read once, in row chunks, by
+# a pool of worker processes. Each worker accumulates flagged visibility
+# counts on a downsampled (time, channel) grid for each antenna and for all
+# baselines combined, and the per-worker grids are summed at the end. The
+# time axis is the list of unique timeslots, so gaps between scans are not
+# drawn. Spectral windows are placed side by side along the channel axis.
+#
+# Writes <ms>_flags_all.png, <ms>_flags_antennas.png and, with --fits, a
+# <ms>_flags.fits cube of flagged fractions (plane 0 = all baselines, then
+# one plane per antenna).
+
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy
+import os
+import pylab
+import sys
+import time
+from astropy.io import fits
+from multiprocessing import Pool
+from optparse import OptionParser
+from pyrap.tables import table
+
+
+# Seconds between the MJD and Unix epochs
+MJD_UNIX = 3506716800.0
+
+INPUT = {}
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def get_antennas(myms):
+    anttab = table(myms+'/ANTENNA',ack=False)
+    names = anttab.getcol('NAME')
+    anttab.done()
+    return names
+
+
+def get_spw_layout(myms,nchan_out):
+
+    """
+    Channel binning shared by all spectral windows, and the offset of each
+    DATA_DESC_ID along the binned channel axis
+    """
+
+    spwtab = table(myms+'/SPECTRAL_WINDOW',ack=False)
+    chan_freqs = [spwtab.getcell('CHAN_FREQ',i) for i in range(0,spwtab.nrows())]
+    spwtab.done()
+    ddtab = table(myms+'/DATA_DESCRIPTION',ack=False)
+    spw_ids = ddtab.getcol('SPECTRAL_WINDOW_ID')
+    ddtab.done()
+
+    total_chans = sum([len(chan_freqs[spw]) for spw in spw_ids])
+    chanbin = max(1,int(numpy.ceil(total_chans/float(nchan_out))))
+    offsets = []
+    freqs = []
+    offset = 0
+    for spw in spw_ids:
+        nbin = int(numpy.ceil(len(chan_freqs[spw])/float(chanbin)))
+        offsets.append(offset)
+        freqs.append([numpy.mean(chan_freqs[spw][i*chanbin:(i+1)*chanbin]) for i in range(0,nbin)])
+        offset += nbin
+    return chanbin,numpy.array(offsets),numpy.concatenate(freqs)
+
+
+def get_time_bins(myms,ntime_out):
+
+    """
+    Unique timeslots, and the downsampled time bin of each
+    """
+
+    tt = table(myms,ack=False)
+    times = numpy.unique(tt.getcol('TIME'))
+    tt.done()
+    timebin = max(1,int(numpy.ceil(len(times)/float(ntime_out))))
+    return times,numpy.arange(len(times)) // timebin
+
+
+def open_input(myms,nant,ntime,nchan,chanbin,offsets,times,tbins,autos):
+    INPUT['tt'] = table(myms,ack=False,lockoptions='usernoread')
+    INPUT['shape'] = (nant,ntime,nchan)
+    INPUT['chanbin'] = chanbin
+    INPUT['offsets'] = offsets
+    INPUT['times'] = times
+    INPUT['tbins'] = tbins
+    INPUT['autos'] = autos
+
+
+def accumulate(chunks):
+
+    """
+    Flagged and total visibility counts per (antenna, time bin, channel bin)
+    and for all baselines combined, over a list of row chunks
+    """
+
+    tt = INPUT['tt']
+    nant,ntime,nchan = INPUT['shape']
+    chanbin = INPUT['chanbin']
+    ant_flagged = numpy.zeros((nant,ntime,nchan),dtype=numpy.uint32)
+    ant_total = numpy.zeros((nant,ntime,nchan),dtype=numpy.uint32)
+    all_flagged = numpy.zeros((ntime,nchan),dtype=numpy.uint64)
+    all_total = numpy.zeros((ntime,nchan),dtype=numpy.uint64)
+
+    for start_row,nr in chunks:
+        ant1 = tt.getcol('ANTENNA1',start_row,nr)
+        ant2 = tt.getcol('ANTENNA2',start_row,nr)
+        ddids = tt.getcol('DATA_DESC_ID',start_row,nr)
+        tbin = INPUT['tbins'][numpy.searchsorted(INPUT['times'],tt.getcol('TIME',start_row,nr))]
+        flag = tt.getcol('FLAG',start_row,nr)
+
+        if not INPUT['autos']:
+            cross = ant1 != ant2
+            ant1,ant2,ddids,tbin,flag = ant1[cross],ant2[cross],ddids[cross],tbin[cross],flag[cross]
+        if len(ant1) == 0:
+            continue
+
+        nrow,nchan_in,ncorr = flag.shape
+        # Pad to a whole number of channel bins, padding counts as neither flagged nor total
+        pad = (-nchan_in) % chanbin
+        valid = numpy.ones((nchan_in,),dtype=numpy.uint32)
+        if pad > 0:
+            flag = numpy.concatenate((flag,numpy.zeros((nrow,pad,ncorr),dtype=bool)),axis=1)
+            valid = numpy.concatenate((valid,numpy.zeros((pad,),dtype=numpy.uint32)))
+        nbin = flag.shape[1] // chanbin
+        row_flagged = flag.reshape(nrow,nbin,chanbin*ncorr).sum(axis=2,dtype=numpy.uint32)
+        row_total = valid.reshape(nbin,chanbin).sum(axis=1)*ncorr
+
+        # Each cross-correlation counts towards both of its antennas
+        cross = ant1 != ant2
+        ants = numpy.concatenate((ant1,ant2[cross]))
+        ant_rows = numpy.concatenate((numpy.arange(len(ant1)),numpy.flatnonzero(cross)))
+
+        for ddid in numpy.unique(ddids):
+            cols = slice(INPUT['offsets'][ddid],INPUT['offsets'][ddid]+nbin)
+            sel = ddids == ddid
+            numpy.add.at(all_flagged[:,cols],tbin[sel],row_flagged[sel])
+            all_total[:,cols] += numpy.outer(numpy.bincount(tbin[sel],minlength=ntime),row_total).astype(numpy.uint64)
+            sel = ant_rows[ddids[ant_rows] == ddid]
+            sel_ants = ants[ddids[ant_rows] == ddid]
+            numpy.add.at(ant_flagged[:,:,cols],(sel_ants,tbin[sel]),row_flagged[sel])
+            nvis = numpy.bincount(sel_ants*ntime + tbin[sel],minlength=nant*ntime).reshape(nant,ntime)
+            ant_total[:,:,cols] += (nvis[:,:,None]*row_total[None,None,:]).astype(numpy.uint32)
+
+    return ant_flagged,ant_total,all_flagged,all_total
+
+
+def fraction(flagged,total):
+    with numpy.errstate(divide='ignore',invalid='ignore'):
+        return numpy.where(total > 0,flagged/numpy.maximum(total,1).astype(numpy.float64),numpy.nan)
+
+
+def time_labels(times,tbins,nticks):
+    ntime = tbins[-1]+1
+    ticks = numpy.linspace(0,ntime-1,nticks).astype(int)
+    first = numpy.searchsorted(tbins,ticks)
+    labels = [time.strftime('%H:%M',time.gmtime(times[ii]-MJD_UNIX)) for ii in first]
+    return ticks,labels
+
+
+def plot_waterfall(ax,frac,freqs,ticks,labels,title):
+    extent = [freqs[0]/1e6,freqs[-1]/1e6,frac.shape[0]-0.5,-0.5]
+    im = ax.imshow(frac,aspect='auto',interpolation='nearest',extent=extent,vmin=0.0,vmax=1.0,cmap='inferno')
+    ax.set_yticks(ticks)
+    ax.set_yticklabels(labels)
+    ax.set_title(title)
+    return im
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] msname')
+    parser.add_option('--outdir', dest = 'outdir', default = '.', help = 'Output folder (default = current folder)')
+    parser.add_option('--ntime', dest = 'ntime', default = 512, help = 'Maximum number of time bins in the waterfalls (default = 512)')
+    parser.add_option('--nchan', dest = 'nchan', default = 512, help = 'Maximum number of channel bins in the waterfalls (default = 512)')
+    parser.add_option('--autos', dest = 'autos', default = False, help = 'Include auto-correlations', action = 'store_true')
+    parser.add_option('--fits', dest = 'fits', default = False, help = 'Also write the occupancy grids to a FITS cube', action = 'store_true')
+    parser.add_option('--rowchunk', dest = 'rowchunk', default = 100000, help = 'Number of rows per chunk (default = 100000)')
+    parser.add_option('-j', '--jobs', dest = 'jobs', default = 8, help = 'Number of worker processes (default = 8)')
+    (options,args) = parser.parse_args()
+    outdir = options.outdir
+    rowchunk = int(options.rowchunk)
+    jobs = int(options.jobs)
+
+    if len(args) != 1:
+        msg('Please specify a Measurement Set')
+        sys.exit()
+    else:
+        myms = args[0].rstrip('/')
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    prefix = outdir+'/'+os.path.basename(myms)
+
+    names = get_antennas(myms)
+    nant = len(names)
+    chanbin,offsets,freqs = get_spw_layout(myms,int(options.nchan))
+    times,tbins = get_time_bins(myms,int(options.ntime))
+    ntime = tbins[-1]+1
+    nchan = len(freqs)
+    msg('Grid                : '+str(ntime)+' time bins x '+str(nchan)+' channel bins x '+str(nant)+' antennas')
+
+    tt = table(myms,ack=False)
+    nrows = tt.nrows()
+    tt.done()
+    chunks = [(start_row,min(rowchunk,nrows-start_row)) for start_row in range(0,nrows,rowchunk)]
+    # One list of chunks per worker, so that each returns a single set of grids
+    tasks = [chunks[i::jobs] for i in range(0,min(jobs,len(chunks)))]
+
+    pool = Pool(processes=jobs,initializer=open_input,initargs=(myms,nant,ntime,nchan,chanbin,offsets,times,tbins,options.autos))
+    ant_flagged = numpy.zeros((nant,ntime,nchan),dtype=numpy.uint64)
+    ant_total = numpy.zeros((nant,ntime,nchan),dtype=numpy.uint64)
+    all_flagged = numpy.zeros((ntime,nchan),dtype=numpy.uint64)
+    all_total = numpy.zeros((ntime,nchan),dtype=numpy.uint64)
+    for result in pool.imap_unordered(accumulate,tasks):
+        ant_flagged += result[0]
+        ant_total += result[1]
+        all_flagged += result[2]
+        all_total += result[3]
+    pool.close()
+    pool.join()
+
+    all_frac = fraction(all_flagged,all_total)
+    ant_frac = fraction(ant_flagged,ant_total)
+    msg('All baselines       : %.2f %% flagged' % (100.0*all_flagged.sum()/max(1,all_total.sum())))
+    for ant in range(0,nant):
+        if ant_total[ant].sum() > 0:
+            msg('%-20s: %.2f %% flagged' % (names[ant],100.0*ant_flagged[ant].sum()/ant_total[ant].sum()))
+
+    ticks,labels = time_labels(times,tbins,6)
+
+    fig = pylab.figure(figsize=(12,9))
+    ax = fig.add_subplot(111)
+    im = plot_waterfall(ax,all_frac,freqs,ticks,labels,os.path.basename(myms)+' (all baselines)')
+    ax.set_xlabel('Frequency [MHz]')
+    ax.set_ylabel('Time [UTC]')
+    fig.colorbar(im,ax=ax,label='Flagged fraction')
+    fig.savefig(prefix+'_flags_all.png',bbox_inches='tight')
+    pylab.close(fig)
+    msg('Wrote '+prefix+'_flags_all.png')
+
+    ncols = 8
+    nrows_plot = int(numpy.ceil(nant/float(ncols)))
+    fig = pylab.figure(figsize=(3*ncols,2.5*nrows_plot))
+    for ant in range(0,nant):
+        ax = fig.add_subplot(nrows_plot,ncols,ant+1)
+        plot_waterfall(ax,ant_frac[ant],freqs,ticks,labels,names[ant])
+        if ant % ncols != 0:
+            ax.set_yticklabels([])
+    fig.tight_layout()
+    fig.savefig(prefix+'_flags_antennas.png',bbox_inches='tight')
+    pylab.close(fig)
+    msg('Wrote '+prefix+'_flags_antennas.png')
+
+    if options.fits:
+        cube = numpy.concatenate((all_frac[None,:,:],ant_frac),axis=0).astype(numpy.float32)
+        hdu = fits.PrimaryHDU(cube)
+        hdr = hdu.header
+        hdr['CTYPE1'] = 'FREQ'
+        hdr['CRPIX1'] = 1.0
+        hdr['CRVAL1'] = freqs[0]
+        hdr['CDELT1'] = (freqs[-1]-freqs[0])/max(1,nchan-1)
+        hdr['CUNIT1'] = 'Hz'
+        hdr['CTYPE2'] = 'TIMEBIN'
+        hdr['CTYPE3'] = 'ANTENNA'
+        hdr['CRPIX3'] = 1.0
+        hdr['CRVAL3'] = -1.0
+        hdr['CDELT3'] = 1.0
+        hdr['BUNIT'] = 'FLAGFRAC'
+        hdr['COMMENT'] = 'Plane 0 is all baselines, plane n is antenna n-1'
+        hdu.writeto(prefix+'_flags.fits',overwrite=True)
+        msg('Wrote '+prefix+'_flags.fits')
+
+    msg('Done')
+
+
+if __name__ == '__main__':
+
+    main()
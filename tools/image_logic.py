@@ -1,30 +1,9 @@
-import numpy
-import shutil
+import os.path as o
 import sys
-from astropy.io import fits
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 
 
-def getImage(fitsfile):
-	input_hdu = fits.open(fitsfile)[0]
-	if len(input_hdu.data.shape) == 2:
-	        image = numpy.array(input_hdu.data[:,:])
-	elif len(input_hdu.data.shape) == 3:
-	        image = numpy.array(input_hdu.data[0,:,:])
-	else:
-	        image = numpy.array(input_hdu.data[0,0,:,:])
-	return image
-
-
-def flushFits(newimage,fitsfile):
-	f = fits.open(fitsfile,mode='update')
-	input_hdu = f[0]
-	if len(input_hdu.data.shape) == 2:
-	        input_hdu.data[:,:] = newimage
-	elif len(input_hdu.data.shape) == 3:
-	        input_hdu.data[0,:,:] = newimage
-	else:
-	        input_hdu.data[0,0,:,:] = newimage
-	f.flush()
+from oxkat import masks
 
 
 im1 = sys.argv[1]
@@ -32,19 +11,11 @@ operator = sys.argv[2].upper()
 im2 = sys.argv[3]
 out = sys.argv[4]
 
-shutil.copyfile(im1,out)
-
-data1 = getImage(im1)
-data2 = getImage(im2)
+expressions = {'OR': 'im1 | im2', 'AND': 'im1 & im2', 'XOR': 'im1 ^ im2'}
 
-if operator == 'OR':
-	dataout = numpy.logical_or(data1,data2)
-elif operator == 'AND':
-	dataout = numpy.logical_and(data1,data2)
-elif operator == 'XOR':
-	dataout = numpy.logical_xor(data1,data2)
-else:
+if operator not in expressions:
 	print('Operator not recognised, please use OR, AND or XOR')
 	sys.exit()
 
-flushFits(dataout,out)
+packed,ncols,header = masks.evaluate_expression(expressions[operator],{'im1': im1, 'im2': im2})
+masks.write_mask(packed,ncols,header,out)
@@ -1,30 +1,9 @@
-import numpy
-import shutil
+import os.path as o
 import sys
-from astropy.io import fits
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 
 
-def getImage(fitsfile):
-	input_hdu = fits.open(fitsfile)[0]
-	if len(input_hdu.data.shape) == 2:
-	        image = numpy.array(input_hdu.data[:,:])
-	elif len(input_hdu.data.shape) == 3:
-	        image = numpy.array(input_hdu.data[0,:,:])
-	else:
-	        image = numpy.array(input_hdu.data[0,0,:,:])
-	return image
-
-
-def flushFits(newimage,fitsfile):
-	f = fits.open(fitsfile,mode='update')
-	input_hdu = f[0]
-	if len(input_hdu.data.shape) == 2:
-	        input_hdu.data[:,:] = newimage
-	elif len(input_hdu.data.shape) == 3:
-	        input_hdu.data[0,:,:] = newimage
-	else:
-	        input_hdu.data[0,0,:,:] = newimage
-	f.flush()
+from oxkat import fits_io
 
 
 im1 = sys.argv[1]
@@ -32,10 +11,8 @@ operator = sys.argv[2]
 im2 = sys.argv[3]
 out = sys.argv[4]
 
-shutil.copyfile(im1,out)
-
-data1 = getImage(im1)
-data2 = getImage(im2)
+data1 = fits_io.get_image(im1)
+data2 = fits_io.get_image(im2)
 
 if operator == 'plus':
 	dataout = data1+data2
@@ -46,4 +23,4 @@ elif operator == 'times':
 elif operator == 'over':
 	dataout = data1/data2
 
-flushFits(dataout,out)
+fits_io.write_fits(dataout,fits_io.get_header(im1),out)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Build a mask from an expression over FITS images and masks, e.g.
+#
+#   python3 mask_algebra.py \
+#       --expr "dilate((restored > 5*noise) | (model != 0), 4) & ~region('peel.reg')" \
+#       --outfile img.mask.fits \
+#       restored=img-MFS-image.fits noise=img-MFS-image.noise.fits model=img-MFS-model.fits
+#
+# Inputs are given as name=file, where file is a FITS image or a .npz mask
+# written by this script. The output header is that of the first input.
+# Output files ending in .npz are bit-packed masks, anything else is FITS.
+# See oxkat/masks.py for the expression syntax.
+
+
+import os.path as o
+import sys
+import time
+from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+
+
+from oxkat import masks
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] name=file [name=file ...]')
+    parser.add_option('--expr', dest = 'expr', default = '', help = 'Mask expression')
+    parser.add_option('--outfile', dest = 'outfile', default = '', help = 'Output FITS or .npz mask')
+    parser.add_option('--tile', dest = 'tile', default = 1024, help = 'Number of rows to process at once (default = 1024)')
+    (options,args) = parser.parse_args()
+    expr = options.expr
+    outfile = options.outfile
+    tile = int(options.tile)
+
+    if expr == '' or outfile == '':
+        msg('Please specify an expression and an output file')
+        sys.exit()
+
+    infiles = {}
+    for arg in args:
+        if '=' not in arg:
+            msg('Inputs should be given as name=file: '+arg)
+            sys.exit()
+        name,infile = arg.split('=',1)
+        infiles[name.strip()] = infile.strip()
+
+    for name in infiles:
+        msg('Input '+name+' : '+infiles[name])
+    msg('Evaluating '+expr)
+    packed,ncols,header = masks.evaluate_expression(expr,infiles,tile=tile)
+    msg('Masked pixels: '+str(masks.count(packed)))
+    msg('Writing '+outfile)
+    masks.write_mask(packed,ncols,header,outfile,tile=tile)
+    msg('Done')
+
+
+if __name__ == '__main__':
+
+    main()
@@ -5,37 +5,13 @@
 import glob
 import numpy
 import os
-import shutil
+import os.path as o
 import sys
-from astropy.io import fits
 from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 
 
-
-def getImage(fitsfile):
-        input_hdu = fits.open(fitsfile)[0]
-        if len(input_hdu.data.shape) == 2:
-                image = numpy.array(input_hdu.data[:,:])
-        elif len(input_hdu.data.shape) == 3:
-                image = numpy.array(input_hdu.data[0,:,:])
-        elif len(input_hdu.data.shape) == 4:
-                image = numpy.array(input_hdu.data[0,0,:,:])
-        else:
-                image = numpy.array(input_hdu.data[0,0,0,:,:])
-        return image
-
-def flushFits(newimage,fitsfile):
-        f = fits.open(fitsfile,mode='update')
-        input_hdu = f[0]
-        if len(input_hdu.data.shape) == 2:
-                input_hdu.data[:,:] = newimage
-        elif len(input_hdu.data.shape) == 3:
-                input_hdu.data[0,:,:] = newimage
-        elif len(input_hdu.data.shape) == 4:
-                input_hdu.data[0,0,:,:] = newimage
-        else:
-                input_hdu.data[0,0,0,:,:] = newimage
-        f.flush()
+from oxkat import fits_io
 
 
 
@@ -53,7 +29,7 @@ def main():
     threshold = float(options.threshold)
     doweight = options.doweight
 
-    pbimg = getImage(pbfits)
+    pbimg = fits_io.get_image(pbfits)
     mask = pbimg < threshold
     pbimg[mask] = numpy.nan
 
@@ -67,14 +43,13 @@ def main():
             print(pbcorfits,'exists, skipping')
         else:
             print('Correcting',infits)
-            shutil.copy(infits,pbcorfits)
-            inimg = getImage(infits)
+            header = fits_io.get_header(infits)
+            inimg = fits_io.get_image(infits)
             pbcorimg = inimg / pbimg
-            flushFits(pbcorimg,pbcorfits)
+            fits_io.write_fits(pbcorimg,header,pbcorfits)
             if doweight:
                 wtfits = infits.replace('.fits','_wt.fits')
-                shutil.copy(infits,wtfits)
-                flushFits(pbimg**2.0,wtfits)
+                fits_io.write_fits(pbimg**2.0,header,wtfits)
 
 
 if __name__ == "__main__":
@@ -4,18 +4,43 @@
 
 # Requires:
 # https://github.com/ludwigschwardt/katbeam
-# https://pypi.org/project/scikit-ued/
-
-
+#
+# The beam is not evaluated at every pixel. With azimuthal averaging (the
+# default) it is evaluated on a polar grid, averaged over angle to give a
+# radial profile, and interpolated onto the pixel radii. Without it, it is
+# evaluated on a grid decimated by GRID_STEP and bilinearly interpolated.
+# Either way the small grid is cached on disk (--cachedir) keyed by beam
+# model, frequency, image size, pixel size, pbcut and averaging, so that
+# repeated corrections of images with the same geometry reuse it.
+#
+# Cubes are corrected plane by plane, with the beam for each plane evaluated
+# at the frequency of its channel on --freqaxis. Planes are processed in
+# parallel and written straight into memory mapped output cubes, so the
+# full cube is never held in memory.
+
+
+import hashlib
 import numpy as np
 import os
+import os.path as o
 import sys
 import time
-from astropy.io import fits
 from katbeam import JimBeam
+from multiprocessing import Pool
 from optparse import OptionParser
-from shutil import copyfile
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+
+
+from oxkat import fits_io
+from oxkat import radial
+
 
+RADIAL_STEP = 0.5   # Radial sampling of the beam profile in pixels
+NANGLE = 64         # Number of position angles averaged for the profile
+GRID_STEP = 16      # Decimation of the 2D beam grid in pixels
+BAND_ROWS = 256     # Rows per band when expanding the beam to full size
+
+INPUT = {}
 
 
 def msg(txt):
@@ -38,38 +63,162 @@ def check_name(name1,name2):
 
 
 def get_header(fitsfile,freqaxis):
-    inphdu = fits.open(fitsfile)
-    inphdr = inphdu[0].header
+    inphdr = fits_io.get_header(fitsfile)
     nx = inphdr.get('NAXIS1')
     ny = inphdr.get('NAXIS2')
     dx = inphdr.get('CDELT1')
     dy = inphdr.get('CDELT2')
-    freq = inphdr.get('CRVAL'+freqaxis)
-    return nx,ny,dx,dy,freq
+    freqs = get_freqs(inphdr,freqaxis)
+    return nx,ny,dx,dy,freqs
 
 
-def get_image(fitsfile):
-    input_hdu = fits.open(fitsfile)[0]
-    if len(input_hdu.data.shape) == 2:
-            image = np.array(input_hdu.data[:,:])
-    elif len(input_hdu.data.shape) == 3:
-            image = np.array(input_hdu.data[0,:,:])
-    else:
-            image = np.array(input_hdu.data[0,0,:,:])
-    return image
+def get_freqs(header,freqaxis):
 
+    """
+    Frequency in Hz of each channel on freqaxis (one entry if the axis is
+    degenerate or missing)
+    """
+
+    nchan = header.get('NAXIS'+freqaxis,1)
+    crval = header.get('CRVAL'+freqaxis)
+    if crval is None:
+        return [None]
+    cdelt = header.get('CDELT'+freqaxis,0.0)
+    crpix = header.get('CRPIX'+freqaxis,1.0)
+    return crval+(np.arange(nchan)+1.0-crpix)*cdelt
+
+
+def get_cache_file(cachedir,key):
+    return cachedir+'/beam_'+hashlib.md5(repr(key).encode()).hexdigest()[:16]+'.npz'
+
+
+def radial_profile(beam,freq,nx,ny,dx,dy,pbcut):
+
+    """
+    Radii in pixels and azimuthally averaged beam, with values below
+    pbcut excluded from the average (NaN if there are none left)
+    """
+
+    rmax = np.hypot(nx,ny)/2.0+2.0
+    radii = np.arange(0.0,rmax+RADIAL_STEP,RADIAL_STEP)
+    theta = (np.arange(NANGLE)+0.5)*2.0*np.pi/NANGLE
+    xx = radii[:,None]*np.cos(theta)[None,:]*dx
+    yy = radii[:,None]*np.sin(theta)[None,:]*dy
+    beam_vals = beam.I(xx,yy,freq)
+    beam_vals[beam_vals < pbcut] = np.nan
+    valid = np.isfinite(beam_vals)
+    total = np.where(valid,beam_vals,0.0).sum(axis=1)
+    count = valid.sum(axis=1)
+    profile = np.where(count > 0,total/np.maximum(count,1),np.nan)
+    return radii,profile
+
+
+def beam_grid(beam,freq,nx,ny,dx,dy):
+
+    """
+    Pixel coordinates and beam on a grid decimated by GRID_STEP
+    """
+
+    xpix = np.unique(np.append(np.arange(0,nx,GRID_STEP),nx-1))
+    ypix = np.unique(np.append(np.arange(0,ny,GRID_STEP),ny-1))
+    xx,yy = np.meshgrid((xpix-nx//2)*dx,(ypix-ny//2)*dy)
+    return xpix,ypix,beam.I(xx,yy,freq)
 
-def flush_fits(newimage,fitsfile):
-    f = fits.open(fitsfile,mode='update')
-    input_hdu = f[0]
-    if len(input_hdu.data.shape) == 2:
-            input_hdu.data[:,:] = newimage
-    elif len(input_hdu.data.shape) == 3:
-            input_hdu.data[0,:,:] = newimage
-    else:
-            input_hdu.data[0,0,:,:] = newimage
-    f.flush()
 
+def get_beam(beam_model,freq,nx,ny,dx,dy,pbcut,azavg,cachedir):
+
+    """
+    Radial profile or decimated beam grid, from the cache if available
+    """
+
+    key = (beam_model,round(freq,6),nx,ny,dx,dy,pbcut,azavg,RADIAL_STEP,NANGLE,GRID_STEP)
+    cache_file = get_cache_file(cachedir,key) if cachedir != '' else ''
+    if cache_file != '' and o.isfile(cache_file):
+        try:
+            cached = np.load(cache_file)
+            if str(cached['key']) == repr(key):
+                msg('Reading beam from cache')
+                msg(' <--- '+cache_file)
+                return cached['xpix'],cached['ypix'],cached['vals']
+        except Exception:
+            msg('Could not read '+cache_file+', evaluating beam')
+    msg('Evaluating beam at '+str(round(freq,4))+' MHz')
+    beam = JimBeam(beam_model)
+    if azavg:
+        xpix,vals = radial_profile(beam,freq,nx,ny,dx,dy,pbcut)
+        ypix = np.zeros(0)
+    else:
+        xpix,ypix,vals = beam_grid(beam,freq,nx,ny,dx,dy)
+    if cache_file != '':
+        os.makedirs(cachedir,exist_ok=True)
+        msg('Caching beam')
+        msg(' ---> '+cache_file)
+        # Write under a temporary name and rename, as other jobs may be
+        # reading or writing the same cache file
+        tmp_file = cache_file+'.'+str(os.getpid())+'.tmp.npz'
+        np.savez(tmp_file,key=repr(key),xpix=xpix,ypix=ypix,vals=vals)
+        os.replace(tmp_file,cache_file)
+    return xpix,ypix,vals
+
+
+def make_beam_image(xpix,ypix,vals,nx,ny,pbcut,azavg):
+
+    """
+    Expand a radial profile or decimated grid to a float32 beam image,
+    NaN below pbcut, working in bands of rows to limit memory use
+    """
+
+    beam_image = np.empty((ny,nx),dtype=np.float32)
+    if azavg:
+        radial.profile_image(xpix,vals,(ny,nx),interpolate=True,out=beam_image,tile=BAND_ROWS)
+    else:
+        # Interpolate along x for each grid row, then between rows
+        rows = np.array([np.interp(np.arange(nx),xpix,row) for row in vals],dtype=np.float32)
+        yidx = np.clip(np.searchsorted(ypix,np.arange(ny),side='right')-1,0,len(ypix)-2)
+        yweight = ((np.arange(ny)-ypix[yidx])/(ypix[yidx+1]-ypix[yidx])).astype(np.float32)
+    for i0 in range(0,ny,BAND_ROWS):
+        i1 = min(i0+BAND_ROWS,ny)
+        if azavg:
+            band = beam_image[i0:i1]
+        else:
+            ww = yweight[i0:i1,None]
+            band = rows[yidx[i0:i1]]*(1.0-ww)+rows[yidx[i0:i1]+1]*ww
+        band[band < pbcut] = np.nan
+        beam_image[i0:i1] = band
+    return beam_image
+
+
+def get_plane_freq(plane):
+    freq_dim = INPUT['freq_dim']
+    if freq_dim < 0 or freq_dim >= len(plane):
+        return INPUT['freqs'][0]
+    return INPUT['freqs'][plane[freq_dim]]
+
+
+def correct_plane(plane):
+
+    """
+    Write the primary beam corrected, beam and weight images for one plane
+    of the input into the output cubes
+    """
+
+    freq = get_plane_freq(plane)
+    xpix,ypix,vals = INPUT['beams'][freq]
+    beam_image = make_beam_image(xpix,ypix,vals,INPUT['nx'],INPUT['ny'],INPUT['pbcut'],INPUT['azavg'])
+    if INPUT['pbcor_fits'] != '':
+        input_data = fits_io.get_data(INPUT['input_fits'])
+        pbcor_data = fits_io.map_fits(INPUT['pbcor_fits'])
+        pbcor_data[plane] = input_data[plane] / beam_image
+        pbcor_data.flush()
+    if INPUT['pb_fits'] != '':
+        pb_data = fits_io.map_fits(INPUT['pb_fits'])
+        pb_data[plane] = beam_image
+        pb_data.flush()
+    if INPUT['wt_fits'] != '':
+        wt_data = fits_io.map_fits(INPUT['wt_fits'])
+        wt_data[plane] = beam_image**2.0
+        wt_data.flush()
+    return plane,freq
 
 
 def main():
@@ -90,6 +239,8 @@ def main():
     parser.add_option('--pbcorname', dest = 'pbcor_fits', help = 'Filename for primary beam corrected image (default = based on input image)', default = '')
     parser.add_option('--pbname', dest = 'pb_fits', help = 'Filename for primary beam image (default = based on input image)', default = '')
     parser.add_option('--wtname', dest = 'wt_fits', help = 'Filename for weight image (default = based on input image)', default = '')
+    parser.add_option('--cachedir', dest = 'cachedir', help = 'Folder for cached beams (default = .beam_cache in the input image folder, set to none to disable)', default = '')
+    parser.add_option('-j', '--jobs', dest = 'jobs', help = 'Number of planes to process in parallel for cubes (default = 4)', default = 4)
     parser.add_option('--overwrite', '-f', dest = 'overwrite', help = 'Overwrite any existing output files (default = do not overwrite)', action = 'store_true', default = False)
     (options,args) = parser.parse_args()
 
@@ -110,18 +261,21 @@ def main():
     freq = options.freq
     freqaxis = options.freqaxis
 
+    # Parallel planes
+    jobs = int(options.jobs)
+
     # Primary beam cut level
     pbcut = float(options.pbcut)
 
     # Azimuthal averaging
     azavg = options.azavg
-    if azavg:
-        try:
-            from skued import azimuthal_average as aa
-        except:
-            msg('scikit-ued not found, azimuthal averaging is not available.')
-            msg('Try: pip install scikit-ued')
-            azavg = False
+
+    # Beam cache
+    cachedir = options.cachedir
+    if cachedir == '':
+        cachedir = o.join(o.dirname(o.abspath(input_fits)),'.beam_cache')
+    elif cachedir.lower() == 'none':
+        cachedir = ''
 
     # Output files
     savepbcor = options.savepbcor
@@ -175,68 +329,58 @@ def main():
         band = 'S-band' 
     msg('Band is '+band)
     msg('Beam model is '+beam_model)
-    beam = JimBeam(beam_model)
 
     # Get header info
     msg('Reading FITS image')
     msg(' <--- '+input_fits)
-    nx,ny,dx,dy,fitsfreq = get_header(input_fits,freqaxis)
+    nx,ny,dx,dy,freqs = get_header(input_fits,freqaxis)
+    input_header = fits_io.get_header(input_fits)
     if nx != ny or abs(dx) != abs(dy):
         msg('Can only handle square images / pixels')
         sys.exit()
-    extent = nx*dx # degrees
 
-    if freq == '':
-        freq = fitsfreq/1e6
-    else:
-        freq = float(freq)
+    if freq != '':
+        freqs = [float(freq)*1e6]*len(freqs)
+    elif freqs[0] is None:
+        msg('No frequency on axis '+freqaxis+', please use --freq')
+        sys.exit()
 
-    msg('Evaluating beam at '+str(round(freq,4))+' MHz')
-    interval = np.linspace(-extent/2.0,extent/2.0,nx)
-    xx,yy = np.meshgrid(interval,interval)
-    beam_image = beam.I(xx,yy,freq)
+    naxis = input_header['NAXIS']
+    planes = list(np.ndindex(*[input_header['NAXIS'+str(axis)] for axis in range(naxis,2,-1)]))
+    msg('Image has '+str(len(planes))+' plane(s), '+str(len(freqs))+' channel(s) on axis '+freqaxis)
 
+    # Beam profile or grid per channel, evaluated once here to share the cache
+    freqs = [ff/1e6 for ff in freqs]
+    beams = {}
+    for ff in freqs:
+        if ff not in beams:
+            beams[ff] = get_beam(beam_model,ff,nx,ny,dx,dy,pbcut,azavg,cachedir)
+    if azavg:
+        msg('Using azimuthally averaged beam pattern')
     msg('Masking beam beyond the '+str(pbcut)+' level')
-    mask = beam_image < pbcut
-    beam_image[mask] = np.nan
 
-    if azavg:
-        msg('Azimuthally averaging the beam pattern')
-        ny, nx = beam_image.shape
-        x0, y0 = nx // 2, ny // 2
-        radius, average = aa(beam_image, center=(x0, y0)) 
-        yy, xx = np.ogrid[:ny, :nx]
-        r = np.hypot(yy - y0, xx - x0)          
-        idx = np.clip(r.astype(np.int32), 0, len(average) - 1)
-        beam_image[...] = average[idx]      
-
-        # x0 = int(nx/2)
-        # y0 = int(ny/2)
-        # radius,average = aa(beam_image,center=(x0,y0))
-        # # This can probably be sped up...
-        # for y in range(0,ny):
-        #     for x in range(0,nx):
-        #         val = (((float(y)-y0)**2.0)+((float(x)-x0)**2.0))**0.5
-        #         beam_image[y][x] = average[int(val)]
-
-    if savepbcor:
-        msg('Correcting image')
-        input_image = get_image(input_fits)
-        pbcor_image = input_image / beam_image
-        msg('Writing primary beam corrected image')
-        msg(' ---> '+pbcor_fits)
-        copyfile(input_fits,pbcor_fits)
-        flush_fits(pbcor_image,pbcor_fits)
-    if savepb:
-        msg('Writing primary beam image')
-        msg(' ---> '+pb_fits)
-        copyfile(input_fits,pb_fits)
-        flush_fits(beam_image,pb_fits)
-    if savewt:
-        msg('Writing weight (pb^2) image')
-        msg(' ---> '+wt_fits)
-        copyfile(input_fits,wt_fits)
-        flush_fits(beam_image**2.0,wt_fits)
+    # Output cubes, filled plane by plane
+    outputs = [(savepbcor,pbcor_fits,'primary beam corrected image'),
+        (savepb,pb_fits,'primary beam image'),
+        (savewt,wt_fits,'weight (pb^2) image')]
+    for save,out_fits,label in outputs:
+        if save:
+            msg('Writing '+label)
+            msg(' ---> '+out_fits)
+            fits_io.create_fits(input_header,out_fits,cube=True).flush()
+
+    INPUT.update({'input_fits': input_fits,
+        'pbcor_fits': pbcor_fits if savepbcor else '',
+        'pb_fits': pb_fits if savepb else '',
+        'wt_fits': wt_fits if savewt else '',
+        'nx': nx, 'ny': ny, 'pbcut': pbcut, 'azavg': azavg,
+        'freqs': freqs, 'freq_dim': naxis-int(freqaxis), 'beams': beams})
+
+    pool = Pool(processes=max(1,min(jobs,len(planes))))
+    for plane,ff in pool.imap(correct_plane,planes):
+        msg('Corrected plane '+str(plane)+' at '+str(round(ff,4))+' MHz')
+    pool.close()
+    pool.join()
 
     msg('Done')
 
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Quick-look visibility plots for several fields, reading the data column
+# once per field, e.g.
+#
+#   python3 plot_vis_density.py --fields 1934-638,3 --outdir VISPLOTS my.ms
+#
+# For each field the rows are read in chunks by a pool of worker processes.
+# Every plot in PLOTS is accumulated as a 2D density histogram per
+# correlation, along with the summed colour of the points in each pixel for
+# each colouring in COLOURS (as per datashader's categorical aggregation).
+# Flagged points are excluded. The per-worker grids are summed and the PNGs
+# rendered in parallel, one per field, plot and colouring, with a panel per
+# correlation. Pixel brightness is the log of the number of points and the
+# hue is the mean colour of the points that fell in it.
+#
+# Axis limits for real, imag and amp are taken from a sample of rows at the
+# start of each field, so extreme outliers fall outside the plots.
+
+
+import matplotlib
+matplotlib.use('Agg')
+import numpy
+import os
+import pylab
+import sys
+import time
+from multiprocessing import Pool
+from optparse import OptionParser
+from pyrap.tables import table
+
+
+C = 299792458.0
+
+CORR_NAMES = {5: 'RR', 6: 'RL', 7: 'LR', 8: 'LL', 9: 'XX', 10: 'XY', 11: 'YX', 12: 'YY'}
+
+PLOTS = [('real','imag'),
+    ('FREQ','amp'),
+    ('FREQ','phase'),
+    ('UV','amp'),
+    ('UV','phase')]
+
+COLOURS = ['ANTENNA1','SCAN_NUMBER']
+
+LABELS = {'real': 'Real', 'imag': 'Imaginary', 'amp': 'Amplitude', 'phase': 'Phase [deg]',
+    'FREQ': 'Frequency [MHz]', 'UV': 'uv-distance [k$\\lambda$]'}
+
+INPUT = {}
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def get_field_ids(myms,fields):
+    fldtab = table(myms+'/FIELD',ack=False)
+    names = fldtab.getcol('NAME')
+    fldtab.done()
+    field_ids = []
+    for field in fields.split(','):
+        # Names take precedence over IDs, as field names can be numeric
+        if field in names:
+            field_ids.append((names.index(field),field))
+        elif field.isdigit() and int(field) < len(names):
+            field_ids.append((int(field),names[int(field)]))
+        else:
+            msg('Field '+field+' not found in '+myms)
+    return field_ids
+
+
+def get_corr_ids(myms,corrs):
+    poltab = table(myms+'/POLARIZATION',ack=False)
+    corr_types = poltab.getcell('CORR_TYPE',0)
+    poltab.done()
+    names = [CORR_NAMES.get(int(ct),str(ct)) for ct in corr_types]
+    return [(names.index(corr),corr) for corr in corrs.split(',') if corr in names]
+
+
+def get_freqs(myms):
+    spwtab = table(myms+'/SPECTRAL_WINDOW',ack=False)
+    chan_freqs = numpy.array([spwtab.getcell('CHAN_FREQ',i) for i in range(0,spwtab.nrows())])
+    spwtab.done()
+    ddtab = table(myms+'/DATA_DESCRIPTION',ack=False)
+    spw_ids = ddtab.getcol('SPECTRAL_WINDOW_ID')
+    ddtab.done()
+    return chan_freqs[spw_ids]
+
+
+def get_max_baseline(myms):
+    anttab = table(myms+'/ANTENNA',ack=False)
+    pos = anttab.getcol('POSITION')
+    anttab.done()
+    return numpy.max(numpy.sqrt(numpy.sum((pos[:,None,:]-pos[None,:,:])**2,axis=2)))
+
+
+def get_field_chunks(field_col,field_id,rowchunk):
+
+    """
+    (start_row, nrows) chunks covering the contiguous row ranges of a field
+    """
+
+    sel = numpy.concatenate(([False],field_col == field_id,[False]))
+    edges = numpy.flatnonzero(numpy.diff(sel.astype(numpy.int8)))
+    chunks = []
+    for start,end in zip(edges[0::2],edges[1::2]):
+        for start_row in range(start,end,rowchunk):
+            chunks.append((int(start_row),int(min(rowchunk,end-start_row))))
+    return chunks
+
+
+def get_axis(name,vis,uvdist,freqs):
+    if name == 'real':
+        return vis.real
+    elif name == 'imag':
+        return vis.imag
+    elif name == 'amp':
+        return numpy.abs(vis)
+    elif name == 'phase':
+        return numpy.angle(vis,deg=True)
+    elif name == 'FREQ':
+        return numpy.broadcast_to(freqs/1e6,vis.shape)
+    elif name == 'UV':
+        return uvdist[:,None]*freqs/C/1e3
+
+
+def get_limits(tt,datacol,chunks,nsample,freqs,max_bl):
+
+    """
+    Axis limits for a field, using up to nsample rows from its first chunks
+    """
+
+    samples = []
+    nread = 0
+    for start_row,nr in chunks:
+        nr = min(nr,nsample-nread)
+        vis = tt.getcol(datacol,start_row,nr)
+        flag = tt.getcol('FLAG',start_row,nr)
+        samples.append(vis[~flag])
+        nread += nr
+        if nread >= nsample:
+            break
+    vals = numpy.concatenate(samples)
+    vals = vals[numpy.isfinite(vals)]
+    if len(vals) == 0:
+        amax = 1.0
+    else:
+        amax = 1.2*numpy.percentile(numpy.abs(vals),99.9)
+    fmin = freqs.min()/1e6
+    fmax = freqs.max()/1e6
+    return {'real': (-amax,amax),
+        'imag': (-amax,amax),
+        'amp': (0.0,amax),
+        'phase': (-180.0,180.0),
+        'FREQ': (fmin,fmax),
+        'UV': (0.0,max_bl*freqs.max()/C/1e3)}
+
+
+def pixel_index(vals,lims,npix):
+    lo,hi = lims
+    if hi <= lo:
+        hi = lo + 1.0
+    with numpy.errstate(invalid='ignore'):
+        idx = numpy.floor((vals-lo)/(hi-lo)*npix)
+        # Values at the upper limit go in the last pixel
+        idx[(idx >= npix) & (vals <= hi)] = npix-1
+    return idx
+
+
+def open_input(myms,datacol,corr_ids,freqs,npix,palettes):
+    INPUT['tt'] = table(myms,ack=False,lockoptions='usernoread')
+    INPUT['datacol'] = datacol
+    INPUT['corr_ids'] = corr_ids
+    INPUT['freqs'] = freqs
+    INPUT['npix'] = npix
+    INPUT['palettes'] = palettes
+
+
+def accumulate(task):
+
+    """
+    Point counts per pixel for each plot and correlation, and the summed
+    RGB of the points per pixel for each colouring, over a list of chunks
+    """
+
+    limits,scans,chunks = task
+    tt = INPUT['tt']
+    npix = INPUT['npix']
+    corr_ids = INPUT['corr_ids']
+    ncorr = len(corr_ids)
+    counts = numpy.zeros((len(PLOTS),ncorr,npix*npix),dtype=numpy.float64)
+    rgb = numpy.zeros((len(PLOTS),len(COLOURS),ncorr,3,npix*npix),dtype=numpy.float32)
+
+    for start_row,nr in chunks:
+        vis = tt.getcol(INPUT['datacol'],start_row,nr)
+        flag = tt.getcol('FLAG',start_row,nr)
+        uvw = tt.getcol('UVW',start_row,nr)
+        ddids = tt.getcol('DATA_DESC_ID',start_row,nr)
+        cats = {'ANTENNA1': tt.getcol('ANTENNA1',start_row,nr),
+            'SCAN_NUMBER': numpy.searchsorted(scans,tt.getcol('SCAN_NUMBER',start_row,nr))}
+        freqs = INPUT['freqs'][ddids]
+        uvdist = numpy.sqrt(uvw[:,0]**2 + uvw[:,1]**2)
+
+        for cc,(corr,corr_name) in enumerate(corr_ids):
+            cvis = vis[:,:,corr]
+            good = ~flag[:,:,corr] & numpy.isfinite(cvis)
+            pix = {}
+            for name in set([xx for plot in PLOTS for xx in plot]):
+                pix[name] = pixel_index(get_axis(name,cvis,uvdist,freqs),limits[name],npix)
+            for pp,(xaxis,yaxis) in enumerate(PLOTS):
+                ix = pix[xaxis]
+                iy = pix[yaxis]
+                inside = good & (ix >= 0) & (ix < npix) & (iy >= 0) & (iy < npix)
+                idx = (iy[inside]*npix + ix[inside]).astype(numpy.int64)
+                counts[pp,cc] += numpy.bincount(idx,minlength=npix*npix)
+                for kk,colour in enumerate(COLOURS):
+                    point_cols = INPUT['palettes'][colour][numpy.broadcast_to(cats[colour][:,None],inside.shape)[inside]]
+                    for ch in range(0,3):
+                        rgb[pp,kk,cc,ch] += numpy.bincount(idx,weights=point_cols[:,ch],minlength=npix*npix)
+
+    return counts,rgb
+
+
+def get_palette(ncat):
+    cmap = matplotlib.colormaps['gist_rainbow']
+    return numpy.array([cmap(xx)[0:3] for xx in numpy.linspace(0.0,1.0,max(ncat,1))])
+
+
+def render(args):
+
+    """
+    Write one PNG, with a panel per correlation
+    """
+
+    pngname,title,xaxis,yaxis,limits,corr_names,counts,rgb,npix = args
+    ncorr = len(corr_names)
+    fig = pylab.figure(figsize=(7*ncorr,6))
+    fig.patch.set_facecolor('white')
+    for cc in range(0,ncorr):
+        count = counts[cc].reshape(npix,npix)
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            colour = numpy.where(count[:,:,None] > 0,numpy.moveaxis(rgb[cc].reshape(3,npix,npix),0,-1)/count[:,:,None],0.0)
+        norm = numpy.log1p(count)/max(numpy.log1p(count.max()),1e-9)
+        img = numpy.dstack((colour,numpy.where(count > 0,0.15+0.85*norm,0.0)))
+        ax = fig.add_subplot(1,ncorr,cc+1)
+        ax.set_facecolor('black')
+        ax.imshow(img,origin='lower',aspect='auto',interpolation='nearest',
+            extent=[limits[xaxis][0],limits[xaxis][1],limits[yaxis][0],limits[yaxis][1]])
+        ax.set_xlabel(LABELS[xaxis])
+        ax.set_ylabel(LABELS[yaxis])
+        ax.set_title(title+' '+corr_names[cc])
+    fig.tight_layout()
+    fig.savefig(pngname,bbox_inches='tight')
+    pylab.close(fig)
+    return pngname
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] msname')
+    parser.add_option('--fields', dest = 'fields', default = '', help = 'Comma-separated field names or IDs to plot (required)')
+    parser.add_option('--datacol', dest = 'datacol', default = 'CORRECTED_DATA', help = 'Column to plot (default = CORRECTED_DATA)')
+    parser.add_option('--corrs', dest = 'corrs', default = 'XX,YY', help = 'Comma-separated correlations to plot (default = XX,YY)')
+    parser.add_option('--outdir', dest = 'outdir', default = '.', help = 'Output folder (default = current folder)')
+    parser.add_option('--npix', dest = 'npix', default = 512, help = 'Number of pixels per plot axis (default = 512)')
+    parser.add_option('--nsample', dest = 'nsample', default = 20000, help = 'Number of rows per field used to set the amplitude limits (default = 20000)')
+    parser.add_option('--rowchunk', dest = 'rowchunk', default = 20000, help = 'Number of rows per chunk (default = 20000)')
+    parser.add_option('-j', '--jobs', dest = 'jobs', default = 8, help = 'Number of worker processes (default = 8)')
+    (options,args) = parser.parse_args()
+    datacol = options.datacol
+    outdir = options.outdir
+    npix = int(options.npix)
+    rowchunk = int(options.rowchunk)
+    jobs = int(options.jobs)
+
+    if len(args) != 1:
+        msg('Please specify a Measurement Set')
+        sys.exit()
+    else:
+        myms = args[0].rstrip('/')
+
+    if options.fields == '':
+        msg('Please specify one or more fields')
+        sys.exit()
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    prefix = outdir+'/'+os.path.basename(myms)
+
+    field_ids = get_field_ids(myms,options.fields)
+    corr_ids = get_corr_ids(myms,options.corrs)
+    corr_names = [corr_name for corr,corr_name in corr_ids]
+    freqs = get_freqs(myms)
+    max_bl = get_max_baseline(myms)
+
+    tt = table(myms,ack=False)
+    field_col = tt.getcol('FIELD_ID')
+    scan_col = tt.getcol('SCAN_NUMBER')
+    nant = int(max(tt.getcol('ANTENNA1').max(),tt.getcol('ANTENNA2').max()))+1
+    tt.done()
+    palettes = {'ANTENNA1': get_palette(nant),
+        'SCAN_NUMBER': get_palette(len(numpy.unique(scan_col)))}
+
+    # Start the workers before the MS is opened again in this process
+    pool = Pool(processes=jobs,initializer=open_input,initargs=(myms,datacol,corr_ids,freqs,npix,palettes))
+    tt = table(myms,ack=False)
+    renders = []
+
+    for field_id,field_name in field_ids:
+        chunks = get_field_chunks(field_col,field_id,rowchunk)
+        if len(chunks) == 0:
+            msg('No rows for field '+field_name)
+            continue
+        limits = get_limits(tt,datacol,chunks,int(options.nsample),freqs,max_bl)
+        # Scans are coloured by their position in the MS-wide list
+        scans = numpy.unique(scan_col)
+        msg('Field %-20s: %i rows in %i chunks' % (field_name,sum([nr for start_row,nr in chunks]),len(chunks)))
+
+        tasks = [(limits,scans,chunks[i::jobs]) for i in range(0,min(jobs,len(chunks)))]
+        counts = 0.0
+        rgb = 0.0
+        for result in pool.imap_unordered(accumulate,tasks):
+            counts = counts + result[0]
+            rgb = rgb + result[1]
+
+        for pp,(xaxis,yaxis) in enumerate(PLOTS):
+            for kk,colour in enumerate(COLOURS):
+                pngname = prefix+'-'+field_name+'-'+datacol+'-'+yaxis+'-'+xaxis+'-'+colour+'.png'
+                title = field_name+' '+datacol+' ('+colour+')'
+                renders.append((pngname,title,xaxis,yaxis,limits,corr_names,counts[pp],rgb[pp,kk],npix))
+
+    tt.done()
+
+    for pngname in pool.imap_unordered(render,renders):
+        msg('Wrote '+pngname)
+    pool.close()
+    pool.join()
+    msg('Done')
+
+
+if __name__ == '__main__':
+
+    main()
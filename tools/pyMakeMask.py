@@ -1,57 +1,122 @@
 import numpy
+import os
+import os.path as o
 import scipy.ndimage
 import scipy.special
-import shutil
 import sys
-from astropy.io import fits
+from concurrent.futures import ThreadPoolExecutor
 from optparse import OptionParser
-from scipy.ndimage.morphology import binary_dilation
-from scipy.ndimage.measurements import label
-from scipy.ndimage import sum as ndi_sum
-
-
-def get_image(fitsfile):
-    print('Reading '+fitsfile)
-    input_hdu = fits.open(fitsfile)[0]
-    if len(input_hdu.data.shape) == 2:
-            image = numpy.array(input_hdu.data[:,:])
-    elif len(input_hdu.data.shape) == 3:
-            image = numpy.array(input_hdu.data[0,:,:])
-    else:
-            image = numpy.array(input_hdu.data[0,0,:,:])
-    return image
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 
 
-def flush_fits(newimage,fitsfile):
-    print('Writing '+fitsfile)
-    f = fits.open(fitsfile,mode='update')
-    input_hdu = f[0]
-    if len(input_hdu.data.shape) == 2:
-            input_hdu.data[:,:] = newimage
-    elif len(input_hdu.data.shape) == 3:
-            input_hdu.data[0,:,:] = newimage
-    else:
-            input_hdu.data[0,0,:,:] = newimage
-    f.flush()
+from oxkat import fits_io
+from oxkat import islands
+from oxkat import masks
 
 
-def make_noise_map(restored_image,boxsize):
-    # Cyril's magic minimum filter
-    # Plundered from the depths of https://github.com/cyriltasse/DDFacet/blob/master/SkyModel/MakeMask.py
-    print('Generating noise map')
-    box = (boxsize,boxsize)
+def get_ratio(boxsize):
+    # Expected minimum of boxsize**2 Gaussian samples in units of sigma
     n = boxsize**2.0
     x = numpy.linspace(-10,10,1000)
     f = 0.5 * (1.0 + scipy.special.erf(x / numpy.sqrt(2.0)))
     F = 1.0 - (1.0 - f)**n
     ratio = numpy.abs(numpy.interp(0.5, F, x))
-    noise = -scipy.ndimage.filters.minimum_filter(restored_image, box) / ratio
+    return ratio
+
+
+def get_bands(nrows,step,nband=256):
+    # Row bands of about nband rows, each a multiple of step rows
+    size = step*max(nband//step,1)
+    return [(i,min(i+size,nrows)) for i in range(0,nrows,size)]
+
+
+def reduce_axis(array,blocksize,axis):
+    # fmin over consecutive blocks of blocksize along axis, the last block may be short
+    array = numpy.moveaxis(array,axis,0)
+    nfull = (array.shape[0]//blocksize)*blocksize
+    minima = numpy.fmin.reduce(array[:nfull].reshape((-1,blocksize)+array.shape[1:]),axis=1)
+    if nfull < array.shape[0]:
+        minima = numpy.concatenate((minima,numpy.fmin.reduce(array[nfull:],axis=0)[None]))
+    return numpy.moveaxis(minima,0,axis)
+
+
+def block_minima(restored_image,blocksize,jobs):
+    # Minimum over each blocksize x blocksize block, NaNs ignored
+    def band_minima(band):
+        minima = reduce_axis(restored_image[band[0]:band[1]],blocksize,0)
+        return reduce_axis(minima,blocksize,1)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        minima = numpy.vstack(list(pool.map(band_minima,get_bands(restored_image.shape[0],blocksize))))
+    minima = minima.astype(numpy.float32)
+    minima[numpy.isnan(minima)] = numpy.inf
+    return minima
+
+
+def get_weights(npix,blocksize):
+    # Lower neighbour and weight for linear interpolation from block centres
+    centres = (numpy.arange(0,npix,blocksize)+numpy.minimum(numpy.arange(blocksize,npix+blocksize,blocksize),npix)-1)/2.0
+    pix = numpy.clip(numpy.arange(npix),centres[0],centres[-1])
+    idx = numpy.clip(numpy.searchsorted(centres,pix,side='right')-1,0,max(len(centres)-2,0))
+    idx1 = numpy.minimum(idx+1,len(centres)-1)
+    span = numpy.where(idx1 > idx,centres[idx1]-centres[idx],1.0)
+    weight = ((pix-centres[idx])/span).astype(numpy.float32)
+    return idx,idx1,weight
+
+
+def upsample(grid,blocksize,shape,jobs):
+    # Bilinear interpolation of a block grid back to the full image
+    ny,nx = shape
+    xidx,xidx1,xweight = get_weights(nx,blocksize)
+    yidx,yidx1,yweight = get_weights(ny,blocksize)
+    rows = grid[:,xidx]*(1.0-xweight)+grid[:,xidx1]*xweight
+    image = numpy.empty(shape,dtype=numpy.float32)
+    def band_upsample(band):
+        i0,i1 = band
+        lower = rows[yidx[i0:i1]]
+        image[i0:i1] = lower+yweight[i0:i1,None]*(rows[yidx1[i0:i1]]-lower)
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        list(pool.map(band_upsample,get_bands(ny,blocksize)))
+    return image
+
+
+def get_minima(input_fits,restored_image,blocksize,jobs,cache):
+    # Block minima, reused from input_fits.noise.npz if it matches the image
+    cache_file = input_fits.replace('.fits','.noise.npz')
+    mtime = o.getmtime(input_fits)
+    if cache and o.isfile(cache_file):
+        cached = numpy.load(cache_file)
+        if int(cached['blocksize']) == blocksize and float(cached['mtime']) == mtime and tuple(cached['shape']) == restored_image.shape:
+            print('Reading block minima from '+cache_file)
+            return cached['minima']
+    print('Computing block minima, block size: '+str(blocksize)+' pixels')
+    minima = block_minima(restored_image,blocksize,jobs)
+    if cache:
+        print('Writing '+cache_file)
+        with open(cache_file,'wb') as f:
+            numpy.savez(f,minima=minima,blocksize=blocksize,mtime=mtime,shape=restored_image.shape)
+    return minima
+
+
+def make_noise_map(restored_image,boxsize,minima=None,blocksize=1,jobs=1):
+    # Cyril's magic minimum filter
+    # Plundered from the depths of https://github.com/cyriltasse/DDFacet/blob/master/SkyModel/MakeMask.py
+    # If block minima are provided the box minimum is computed on the block
+    # grid and interpolated back, which is ~blocksize**2 times less work
+    print('Generating noise map')
+    ratio = get_ratio(boxsize)
+    if minima is None:
+        noise = -scipy.ndimage.minimum_filter(restored_image, (boxsize,boxsize)) / ratio
+    else:
+        nblocks = max(int(round(boxsize/float(blocksize))),1)
+        noise = -scipy.ndimage.minimum_filter(minima, (nblocks,nblocks)) / ratio
     negative_mask = noise < 0.0
     noise[negative_mask] = 1.0e-10
     median_noise = numpy.median(noise)
     median_mask = noise < median_noise
     noise[median_mask] = median_noise
     print('Median noise value is '+str(median_noise))
+    if minima is not None:
+        noise = upsample(noise,blocksize,restored_image.shape,jobs)
     return noise
 
 
@@ -63,6 +128,9 @@ def main():
     parser.add_option('--smallbox', dest = 'smallbox', help = 'Box size to switch to for fields with small islands (default = 50), set to zero to just use boxsize', default = 50)
     parser.add_option('--islandsize', dest = 'islandsize', help = 'Island size in pixels below which smallbox is used (default = 30000)', default = 30000)
     parser.add_option('--dilate', dest = 'dilate', help = 'Number of iterations of binary dilation (default = 3, set to 0 to disable)', default = 3)
+    parser.add_option('--blocksize', dest = 'blocksize', help = 'Compute the noise map on a grid decimated by this factor and interpolate it back (default = 10, set to 1 for the full resolution filter)', default = 10)
+    parser.add_option('--nocache', dest = 'nocache', help = 'Do not read or write the block minima cache (restored_image.replace(".fits",".noise.npz"))', action = 'store_true', default = False)
+    parser.add_option('-j', '--jobs', dest = 'jobs', help = 'Number of threads (default = all available)', default = os.cpu_count())
     parser.add_option('--savenoise', dest = 'savenoise', help = 'Enable to export noise image as FITS file (default = do not save noise image', action = 'store_true', default = False)
     parser.add_option('--outfile', dest = 'outfile', help = 'Suffix for mask image (default = restored_image.replace(".fits",".mask.fits"))', default = '')
     (options,args) = parser.parse_args()
@@ -71,6 +139,9 @@ def main():
     smallbox = int(options.smallbox)
     islandsize = int(options.islandsize)
     dilate = int(options.dilate)
+    blocksize = int(options.blocksize)
+    cache = not options.nocache
+    jobs = int(options.jobs)
     savenoise = options.savenoise
     outfile = options.outfile
 
@@ -80,38 +151,39 @@ def main():
     else:
         input_fits = args[0].rstrip('/')
 
-    input_image = get_image(input_fits)
+    print('Reading '+input_fits)
+    input_header = fits_io.get_header(input_fits)
+    input_image = fits_io.get_image(input_fits)
 
     print('Computing mask with box size: '+str(boxsize)+' pixels')
     print('Threshold: '+str(threshold))
-    noise_image = make_noise_map(input_image,boxsize)
+    if blocksize > 1:
+        minima = get_minima(input_fits,input_image,blocksize,jobs,cache)
+    else:
+        minima = None
+    noise_image = make_noise_map(input_image,boxsize,minima,blocksize,jobs)
     mask_image = input_image > threshold * noise_image
 
     if smallbox != 0:
         print('Counting islands...')
-        sizes = []
-        mask_image = mask_image.byteswap().newbyteorder()
-        labeled_mask_image, n_islands = label(mask_image)
-        print('Found '+str(n_islands))
-        print('Sizing them up...')
-        indices = numpy.arange(0,n_islands)
-        sizes = ndi_sum(mask_image, labeled_mask_image, indices)
+        sizes,bboxes = islands.island_stats(mask_image,jobs=jobs)
+        print('Found '+str(len(sizes)))
         sizes = numpy.sort(sizes)[::-1]
         print('Island size threshold: '+str(islandsize))
         print('Top five island sizes:')
         print(sizes[0:5])
-        if sizes[0] < islandsize:
+        if len(sizes) == 0 or sizes[0] < islandsize:
             print('Largest island has fewer than '+str(islandsize)+' pixels')
             print('Recomputing mask with box size: '+str(smallbox)+' pixels')
-            noise_image = make_noise_map(input_image,smallbox)
+            noise_image = make_noise_map(input_image,smallbox,minima,blocksize,jobs)
             mask_image = input_image > threshold * noise_image
         else:
             print('Sticking with box size: '+str(boxsize)+' pixels')
 
     if savenoise:
         noise_fits = input_fits.replace('.fits', '.noise.fits')
-        shutil.copyfile(input_fits, noise_fits)
-        flush_fits(noise_image, noise_fits)
+        print('Writing '+noise_fits)
+        fits_io.write_fits(noise_image, input_header, noise_fits)
 
     mask_image[:,-1]=0
     mask_image[:,0]=0
@@ -120,16 +192,15 @@ def main():
 
     if dilate != 0:
         print('Dilating mask, '+str(dilate)+' iteration(s)')
-        dilated = binary_dilation(input = mask_image, iterations = dilate)
+        dilated = masks.dilate_strips(mask_image,dilate,jobs=jobs)
         mask_image = dilated
 
     if outfile == '':
         mask_fits = input_fits.replace('.fits', '.mask.fits')
     else:
         mask_fits = outfile
-    shutil.copyfile(input_fits, mask_fits)
-
-    flush_fits(mask_image,mask_fits)
+    print('Writing '+mask_fits)
+    fits_io.write_fits(mask_image, input_header, mask_fits)
 
     print('Done')
 
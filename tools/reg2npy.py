@@ -1,37 +1,24 @@
 #!/usr/bin/env python
 # ian.heywood@physics.ox.ac.uk
 
-# Convert a DS9 (circles only) region file to a ClusterCat.npy file
+# Convert a DS9 region file (region centres) to a ClusterCat.npy file
 # for use with killMS. This is a pure Python script to avoid having
 # to invoke MakeModel.py for this simple purpose.
 
 
 import numpy
+import os.path as o
 import sys
 from optparse import OptionParser
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+
+
+from oxkat import regions
 
 
 def deg2rad(xx):
     return xx*numpy.pi/180.0
 
-def hms2deg(ra,delimiter=':'):
-    hms = numpy.fromstring(ra,dtype='float',sep=delimiter)
-    radeg = 15.0*((hms[0])+(hms[1]/60.0)+(hms[2]/3600.0))
-    return radeg
-
-def dms2deg(dec,delimiter=':'):
-    if dec[0] == '+':
-        sign = 1.0
-        dec = dec.lstrip('+')
-    elif dec[0] == '-':
-        sign = -1.0
-        dec = dec.lstrip('-')
-    else:
-        sign = 1.0
-    dms = numpy.fromstring(dec,dtype='float',sep=delimiter)
-    dec = sign * ((dms[0])+(dms[1]/60.0)+(dms[2]/3600.0))
-    return dec
-
 
 def main():
 
@@ -55,22 +42,10 @@ def main():
 
     print('Reading '+regfile)
 
-    centres = []
-    f = open(regfile,'r')
-    line = f.readline()
-    while line:
-        if line[0:6] == 'circle':
-            coords = line.split('(')[-1].split(')')[0]
-            x,y,rad = coords.split(',')
-            if ':' in line:
-                ra = hms2deg(x)
-                dec = dms2deg(y)
-            else:
-                ra = float(x)
-                dec = float(y)
-            centres.append((ra,dec))
-        line = f.readline()
-    f.close()
+    regs = regions.read_region(regfile)
+    centres = regions.get_centres(regs)
+    if len(centres) < len(regs):
+        print('Skipping '+str(len(regs)-len(centres))+' exclusion(s) or region(s) not in sky coordinates')
 
 
     ClusterCat=numpy.zeros((len(centres),),dtype=[('Name','|S200'),('ra',float),('dec',float),('SumI',float),("Cluster",int)])
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Shift the phase centre of a Measurement Set, as per chgcentre or CASA's
+# fixvis, e.g.
+#
+#   python3 rephase_MS.py my.ms 04h08m20.3782s -65d45m09.080s
+#
+# UVWs are rotated to the new phase centre and each visibility is multiplied
+# by exp(2 pi i (w_new - w_old) freq / c). The rows to be rephased are read
+# in chunks by a pool of worker processes that compute the rotated UVWs and
+# phased visibilities, and the parent process writes them back in order.
+# Visibilities are phased in place in single precision, chunks are sized
+# from the number of channels, and at most one chunk per worker is held
+# waiting to be written, to bound memory use.
+# PHASE_DIR in the FIELD table is updated at the end.
+
+
+import numpy
+import re
+import sys
+import time
+from multiprocessing import Pool
+from optparse import OptionParser
+from pyrap.tables import table
+
+
+C = 299792458.0
+
+CHUNK_BYTES = 256*1024*1024 # Default size of each column per chunk
+
+INPUT = {}
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def parse_ra(ra):
+
+    """
+    RA in radians from e.g. 04h08m20.3782s, 04:08:20.3782 or decimal degrees
+    """
+
+    parts = [float(xx) for xx in re.split('[hms:]',ra.strip()) if xx != '']
+    if len(parts) == 1 and 'h' not in ra and ':' not in ra:
+        return numpy.radians(parts[0])
+    while len(parts) < 3:
+        parts.append(0.0)
+    return numpy.radians(15.0*(parts[0] + parts[1]/60.0 + parts[2]/3600.0))
+
+
+def parse_dec(dec):
+
+    """
+    Dec in radians from e.g. -65d45m09.080s, -65:45:09.080 or decimal degrees
+    """
+
+    dec = dec.strip()
+    sign = -1.0 if dec.startswith('-') else 1.0
+    parts = [float(xx) for xx in re.split('[dms:]',dec.lstrip('+-')) if xx != '']
+    if len(parts) == 1 and 'd' not in dec and ':' not in dec:
+        return numpy.radians(sign*parts[0])
+    while len(parts) < 3:
+        parts.append(0.0)
+    return numpy.radians(sign*(parts[0] + parts[1]/60.0 + parts[2]/3600.0))
+
+
+def uvw_matrix(ra,dec):
+
+    """
+    Rows are the u, v and w unit vectors for a phase centre at (ra,dec),
+    in the equatorial frame of the baseline vectors
+    """
+
+    return numpy.array([
+        [-numpy.sin(ra),numpy.cos(ra),0.0],
+        [-numpy.sin(dec)*numpy.cos(ra),-numpy.sin(dec)*numpy.sin(ra),numpy.cos(dec)],
+        [numpy.cos(dec)*numpy.cos(ra),numpy.cos(dec)*numpy.sin(ra),numpy.sin(dec)]])
+
+
+def get_rotations(myms,ra,dec):
+
+    """
+    Per-field matrices that map old UVWs to new ones
+    """
+
+    fldtab = table(myms+'/FIELD',ack=False)
+    phase_dirs = fldtab.getcol('PHASE_DIR')
+    fldtab.done()
+    new = uvw_matrix(ra,dec)
+    rotations = []
+    for phase_dir in phase_dirs:
+        old = uvw_matrix(phase_dir[0,0],phase_dir[0,1])
+        rotations.append(numpy.dot(new,old.T))
+    return numpy.array(rotations)
+
+
+def get_chan_freqs(myms):
+    spwtab = table(myms+'/SPECTRAL_WINDOW',ack=False)
+    chan_freqs = [spwtab.getcell('CHAN_FREQ',i) for i in range(0,spwtab.nrows())]
+    spwtab.done()
+    ddtab = table(myms+'/DATA_DESCRIPTION',ack=False)
+    spw_ids = ddtab.getcol('SPECTRAL_WINDOW_ID')
+    ddtab.done()
+    return [chan_freqs[spw] for spw in spw_ids]
+
+
+def get_chunks(selected,rowchunk):
+
+    """
+    (start_row, nrows) tuples covering contiguous runs of selected rows
+    """
+
+    edges = numpy.flatnonzero(numpy.diff(selected.astype(numpy.int8)) != 0) + 1
+    starts = numpy.concatenate(([0],edges))
+    ends = numpy.concatenate((edges,[len(selected)]))
+    chunks = []
+    for start,end in zip(starts,ends):
+        if selected[start]:
+            for start_row in range(start,end,rowchunk):
+                chunks.append((int(start_row),int(min(rowchunk,end-start_row))))
+    return chunks
+
+
+def open_input(myms,cols,rotations,chan_freqs):
+    INPUT['tt'] = table(myms,ack=False,lockoptions='usernoread')
+    INPUT['cols'] = cols
+    INPUT['rotations'] = rotations
+    INPUT['chan_freqs'] = chan_freqs
+
+
+def rephase_chunk(chunk):
+
+    """
+    Rotate UVWs and rephase visibilities for one chunk of rows, runs in
+    a worker process
+    """
+
+    start_row,nr = chunk
+    tt = INPUT['tt']
+    fields = tt.getcol('FIELD_ID',start_row,nr)
+    ddids = tt.getcol('DATA_DESC_ID',start_row,nr)
+    uvw = tt.getcol('UVW',start_row,nr)
+
+    new_uvw = numpy.einsum('rij,rj->ri',INPUT['rotations'][fields],uvw)
+    dw = (new_uvw[:,2] - uvw[:,2]) / C
+
+    out = {'UVW': new_uvw}
+    phasors = []
+    for ddid in numpy.unique(ddids):
+        rows = numpy.flatnonzero(ddids == ddid)
+        if rows[-1]-rows[0]+1 == len(rows):
+            rows = slice(rows[0],rows[-1]+1)
+        phase = numpy.remainder(2.0*numpy.pi*dw[rows,None]*INPUT['chan_freqs'][ddid][None,:],2.0*numpy.pi)
+        phasors.append((rows,numpy.exp(1j*phase.astype(numpy.float32))[:,:,None]))
+        del phase
+    for col in INPUT['cols']:
+        vis = tt.getcol(col,start_row,nr)
+        for rows,phasor in phasors:
+            if isinstance(rows,slice):
+                vis[rows] *= phasor
+            else:
+                block = vis[rows]
+                block *= phasor
+                vis[rows] = block
+        out[col] = vis
+
+    return start_row,nr,out
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] msname ra dec')
+    parser.add_option('--field', dest = 'field', default = '', help = 'Comma-separated FIELD_ID(s) to rephase (default = all)')
+    parser.add_option('--cols', dest = 'cols', default = 'DATA,CORRECTED_DATA,MODEL_DATA', help = 'Comma-separated visibility columns to rephase, if present (default = DATA,CORRECTED_DATA,MODEL_DATA)')
+    parser.add_option('--rowchunk', dest = 'rowchunk', default = 0, help = 'Number of rows per chunk (default = about '+str(CHUNK_BYTES//(1024*1024))+' MB per column)')
+    parser.add_option('-j', '--jobs', dest = 'jobs', default = 4, help = 'Number of worker processes (default = 4)')
+    # Options must precede the MS name so that a negative Dec is not read as an option
+    parser.disable_interspersed_args()
+    (options,args) = parser.parse_args()
+    field = options.field
+    cols = options.cols.split(',')
+    rowchunk = int(options.rowchunk)
+    jobs = int(options.jobs)
+
+    if len(args) != 3:
+        msg('Please specify a Measurement Set and the new RA and Dec')
+        sys.exit()
+    else:
+        myms = args[0].rstrip('/')
+        ra = parse_ra(args[1])
+        dec = parse_dec(args[2])
+
+    msg('Rephasing '+myms+' to RA '+str(round(numpy.degrees(ra),6))+' Dec '+str(round(numpy.degrees(dec),6))+' [deg]')
+
+    tt = table(myms,ack=False)
+    cols = [col for col in cols if col in tt.colnames()]
+    fields = tt.getcol('FIELD_ID')
+    if rowchunk <= 0:
+        nchan,ncorr = tt.getcell('FLAG',0).shape
+        rowchunk = max(1000,int(CHUNK_BYTES/(nchan*ncorr*8)))
+    tt.done()
+    msg('Columns             : '+', '.join(cols))
+
+    if field == '':
+        field_ids = numpy.unique(fields)
+    else:
+        field_ids = numpy.array([int(xx) for xx in field.split(',')])
+    msg('Fields              : '+', '.join([str(xx) for xx in field_ids]))
+
+    chunks = get_chunks(numpy.isin(fields,field_ids),rowchunk)
+    msg('Rows                : '+str(sum([nr for start_row,nr in chunks]))+' in '+str(len(chunks))+' chunks')
+
+    rotations = get_rotations(myms,ra,dec)
+    chan_freqs = get_chan_freqs(myms)
+
+    # Start the workers before the MS is opened for writing in this process
+    pool = Pool(processes=jobs,initializer=open_input,initargs=(myms,cols,rotations,chan_freqs))
+    tt = table(myms,readonly=False,ack=False,lockoptions='user')
+    tt.lock()
+    # Batches of one chunk per worker, so finished chunks do not pile up
+    for i in range(0,len(chunks),jobs):
+        for start_row,nr,out in pool.imap(rephase_chunk,chunks[i:i+jobs]):
+            for col in out:
+                tt.putcol(col,out[col],start_row,nr)
+            msg('Wrote rows          : '+str(start_row)+' to '+str(start_row+nr))
+    pool.close()
+    pool.join()
+    tt.unlock()
+    tt.done()
+
+    fldtab = table(myms+'/FIELD',readonly=False,ack=False)
+    for field_id in field_ids:
+        phase_dir = fldtab.getcell('PHASE_DIR',int(field_id))
+        phase_dir[0,:] = [ra,dec]
+        fldtab.putcell('PHASE_DIR',int(field_id),phase_dir)
+    fldtab.done()
+
+    msg('Updated PHASE_DIR for field(s) '+', '.join([str(xx) for xx in field_ids]))
+    msg('Done')
+
+
+if __name__ == '__main__':
+
+    main()
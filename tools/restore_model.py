@@ -6,43 +6,19 @@ import glob
 import logging
 import numpy
 import os
+import os.path as o
 import random 
 import scipy.signal
-import shutil
 import string
 import sys
 
-from astropy.io import fits
 from astropy.convolution import convolve,Gaussian2DKernel
 from itertools import repeat
 from multiprocessing import Pool
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
 
 
-def get_image(fitsfile):
-        input_hdu = fits.open(fitsfile)[0]
-        if len(input_hdu.data.shape) == 2:
-                image = numpy.array(input_hdu.data[:,:])
-        elif len(input_hdu.data.shape) == 3:
-                image = numpy.array(input_hdu.data[0,:,:])
-        elif len(input_hdu.data.shape) == 4:
-                image = numpy.array(input_hdu.data[0,0,:,:])
-        else:
-                image = numpy.array(input_hdu.data[0,0,0,:,:])
-        return image
-
-
-def flush_fits(newimage,fitsfile):
-        f = fits.open(fitsfile,mode='update')
-        input_hdu = f[0]
-        if len(input_hdu.data.shape) == 2:
-                input_hdu.data[:,:] = newimage
-        elif len(input_hdu.data.shape) == 3:
-                input_hdu.data[0,:,:] = newimage_
-        elif len(input_hdu.data.shape) == 4:
-                input_hdu.data[0,0,:,:] = newimage
-        else:
-                input_hdu.data[0,0,0,:,:] = newimage
-        f.flush()
+from oxkat import fits_io
 
 
 def deg2rad(xx):
@@ -50,8 +26,7 @@ def deg2rad(xx):
 
 
 def get_header(fitsfile):
-    input_hdu = fits.open(fitsfile)[0]
-    hdr = input_hdu.header
+    hdr = fits_io.get_header(fitsfile)
     bmaj = hdr.get('BMAJ')
     bmin = hdr.get('BMIN')
     bpa = hdr.get('BPA')
@@ -59,14 +34,13 @@ def get_header(fitsfile):
     return bmaj,bmin,bpa,pixscale
 
 
-def beam_header(fitsfile,bmaj,bmin,bpa):
-        outhdu = fits.open(fitsfile,mode='update')
-        outhdr = outhdu[0].header
+def beam_header(hdr,bmaj,bmin,bpa):
+        outhdr = hdr.copy()
         outhdr.set('BMAJ',bmaj,after='BUNIT')
         outhdr.set('BMIN',bmin,after='BMAJ')
         outhdr.set('BPA',bpa,after='BMIN')
-        outhdr.remove('HISTORY')
-        outhdu.flush()  
+        outhdr.remove('HISTORY',ignore_missing=True,remove_all=True)
+        return outhdr
 
 
 def convolve_fits(residual_fits,model_image,proc_id):
@@ -76,7 +50,6 @@ def convolve_fits(residual_fits,model_image,proc_id):
         # Set up FITS files
         psf_fits = residual_fits.replace('image','psf')
         restored_fits = residual_fits.replace('image','image-restored')
-        shutil.copyfile(residual_fits,restored_fits)
 
 
         # Get the fitted beam
@@ -101,12 +74,12 @@ def convolve_fits(residual_fits,model_image,proc_id):
         model_conv_image = scipy.signal.fftconvolve(model_image, restoring_beam_image, mode='same')
 
         # Open residual image and add convolved model
-        residual_image = get_image(residual_fits)
+        residual_image = fits_io.get_image(residual_fits)
         restored_image = residual_image + model_conv_image
 
-        # Flush restored FITS file and fix the header
-        flush_fits(restored_image,restored_fits)
-        beam_header(restored_fits,bmaj,bmin,bpa)
+        # Write restored FITS file with the fitted beam in the header
+        restored_header = beam_header(fits_io.get_header(residual_fits),bmaj,bmin,bpa)
+        fits_io.write_fits(restored_image,restored_header,restored_fits)
 
 
 if __name__ == '__main__':
@@ -126,14 +99,14 @@ if __name__ == '__main__':
         ids = numpy.arange(0,len(fits_list))
 
         # Get the image size from first image in list and create matched model image
-        img0 = get_image(fits_list[0])
+        img0 = fits_io.get_image(fits_list[0])
         nx,ny = numpy.shape(img0)
         if nx != ny:
                 print('Only square images are supported at present')
                 sys.exit()
         tmpmodel_fits = 'temp_model_'+''.join(random.choices(string.ascii_uppercase + string.digits, k=16))+'.fits'
         os.system('fitstool.py -z '+str(nx)+' -o '+tmpmodel_fits+' '+model_fits)
-        model_image = get_image(tmpmodel_fits)
+        model_image = fits_io.get_image(tmpmodel_fits)
 
         for i in range(0,len(fits_list)):
                 convolve_fits(fits_list[i],model_image,ids[i])
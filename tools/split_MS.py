@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# ian.heywood@physics.ox.ac.uk
+#
+# Split a Measurement Set by field or by scan, running the splits in
+# parallel. Row numbers for each output are derived from a single read
+# of FIELD_ID / SCAN_NUMBER, and each output is a deep copy of the
+# selected rows with the FIELD subtable re-indexed so that the output
+# field IDs start from zero (as per CASA's split / mstransform).
+#
+# Output names follow the oxkat conventions:
+#    by field : <ms>_<fieldname>.ms
+#    by scan  : <ms>_scan<scan>.ms
+#
+# With --keepcols MODEL_DATA --wtspec the outputs match those of
+# mstransform with datacolumn='corrected', realmodelcol=True and
+# usewtspectrum=True.
+
+
+import numpy
+import os
+import sys
+import time
+from multiprocessing import Pool
+from optparse import OptionParser
+from pyrap.tables import table, taql, makearrcoldesc, maketabdesc
+
+
+DATA_COLS = ['DATA','CORRECTED_DATA','MODEL_DATA']
+
+CHUNK_BYTES = 256*1024*1024 # Size of WEIGHT_SPECTRUM written at once
+
+
+def msg(txt):
+    stamp = time.strftime(' %Y-%m-%d %H:%M:%S | ')
+    print(stamp+txt)
+
+
+def get_field_names(myms):
+    fldtab = table(myms+'/FIELD',ack=False)
+    names = fldtab.getcol('NAME')
+    fldtab.done()
+    return names
+
+
+def get_row_ranges(keys):
+
+    """
+    Map each unique value of keys to a list of contiguous (start,end) row ranges,
+    to avoid passing full row lists to the worker processes
+    """
+
+    edges = numpy.flatnonzero(numpy.diff(keys) != 0) + 1
+    starts = numpy.concatenate(([0],edges))
+    ends = numpy.concatenate((edges,[len(keys)]))
+    ranges = {}
+    for start,end in zip(starts,ends):
+        key = int(keys[start])
+        if key not in ranges:
+            ranges[key] = []
+        ranges[key].append((int(start),int(end)))
+    return ranges
+
+
+def reindex_fields(opms):
+
+    """
+    Remove FIELD rows that are not in the output and renumber FIELD_ID
+    """
+
+    tt = table(opms,readonly=False,ack=False)
+    field_col = tt.getcol('FIELD_ID')
+    field_ids = numpy.unique(field_col)
+
+    fldtab = table(opms+'/FIELD',readonly=False,ack=False)
+    mapping = numpy.zeros(fldtab.nrows(),dtype=numpy.int32)
+    mapping[field_ids] = numpy.arange(len(field_ids))
+    remove = [i for i in range(0,fldtab.nrows()) if i not in field_ids]
+    if len(remove) > 0:
+        fldtab.removerows(remove)
+    fldtab.done()
+
+    tt.putcol('FIELD_ID',mapping[field_col])
+    tt.done()
+
+
+def add_weight_spectrum(opms):
+
+    """
+    Add a WEIGHT_SPECTRUM column filled from WEIGHT if there is not one
+    """
+
+    tt = table(opms,readonly=False,ack=False)
+    if 'WEIGHT_SPECTRUM' in tt.colnames() and tt.iscelldefined('WEIGHT_SPECTRUM',0):
+        tt.done()
+        return
+    nchan,ncorr = tt.getcell('FLAG',0).shape
+    if 'WEIGHT_SPECTRUM' not in tt.colnames():
+        desc = makearrcoldesc('WEIGHT_SPECTRUM',0.0,valuetype='float',shape=[nchan,ncorr],comment='Weight for each data point')
+        dminfo = {'TYPE': 'TiledColumnStMan', 'NAME': 'TiledWEIGHT_SPECTRUM',
+            'SPEC': {'DEFAULTTILESHAPE': numpy.array([ncorr,nchan,max(1,int(4*1024*1024/(nchan*ncorr*4)))],dtype=numpy.int32)}}
+        tt.addcols(maketabdesc(desc),dminfo=dminfo)
+    rowchunk = max(1,int(CHUNK_BYTES/(nchan*ncorr*4)))
+    for start_row in range(0,tt.nrows(),rowchunk):
+        nr = min(rowchunk,tt.nrows()-start_row)
+        weight = tt.getcol('WEIGHT',start_row,nr).astype(numpy.float32)
+        tt.putcol('WEIGHT_SPECTRUM',numpy.repeat(weight[:,None,:],nchan,axis=1),start_row,nr)
+    tt.done()
+
+
+def split_rows(myms,opms,row_ranges,datacol,keepcols,wtspec):
+
+    """
+    Deep copy the rows covered by row_ranges into opms, with datacol
+    written as DATA. Runs in a worker process.
+    """
+
+    t0 = time.time()
+    if os.path.exists(opms):
+        msg(opms+' exists, skipping')
+        return opms
+
+    rownrs = numpy.concatenate([numpy.arange(start,end) for start,end in row_ranges])
+    tt = table(myms,ack=False)
+    sel = tt.selectrows(rownrs)
+
+    cols = [col for col in tt.colnames() if col not in DATA_COLS]
+    cols.append(datacol+' AS DATA' if datacol != 'DATA' else 'DATA')
+    for col in keepcols:
+        if col in DATA_COLS and col != datacol and col != 'DATA' and col in tt.colnames():
+            cols.append(col)
+
+    msg('Writing '+opms+' ('+str(len(rownrs))+' rows, '+datacol+' -> DATA)')
+    subset = taql('SELECT '+','.join(cols)+' FROM $sel')
+    subset.copy(opms,deep=True)
+    subset.done()
+    sel.done()
+    tt.done()
+
+    reindex_fields(opms)
+    if wtspec:
+        add_weight_spectrum(opms)
+    msg('Finished '+opms+' in '+str(round(time.time()-t0,1))+' s')
+    return opms
+
+
+def main():
+
+    parser = OptionParser(usage = '%prog [options] msname')
+    parser.add_option('--by', dest = 'by', default = 'field', help = 'Split by field or scan (default = field)')
+    parser.add_option('--fields', dest = 'fields', default = '', help = 'Comma-separated field names or IDs to split out (default = all)')
+    parser.add_option('--scans', dest = 'scans', default = '', help = 'Comma-separated scan numbers to split out (default = all)')
+    parser.add_option('--datacol', dest = 'datacol', default = 'DATA', help = 'Column to write to the DATA column of the outputs (default = DATA)')
+    parser.add_option('--keepcols', dest = 'keepcols', default = '', help = 'Comma-separated list of additional data columns to retain (default = none)')
+    parser.add_option('--wtspec', dest = 'wtspec', default = False, help = 'Add WEIGHT_SPECTRUM to the outputs from WEIGHT if the input does not have it', action = 'store_true')
+    parser.add_option('-j', '--jobs', dest = 'jobs', default = 4, help = 'Number of splits to run in parallel, limit this to avoid saturating the file system (default = 4)')
+    (options,args) = parser.parse_args()
+    by = options.by.lower()
+    fields = options.fields
+    scans = options.scans
+    datacol = options.datacol
+    keepcols = [col for col in options.keepcols.split(',') if col != '']
+    wtspec = options.wtspec
+    jobs = int(options.jobs)
+
+    if len(args) != 1:
+        msg('Please specify a Measurement Set')
+        sys.exit()
+    else:
+        myms = args[0].rstrip('/')
+
+    if by not in ['field','scan']:
+        msg('Please split by field or scan')
+        sys.exit()
+
+    tt = table(myms,ack=False)
+    if datacol not in tt.colnames():
+        msg(datacol+' not present in '+myms)
+        tt.done()
+        sys.exit()
+    if by == 'field':
+        keys = tt.getcol('FIELD_ID')
+    else:
+        keys = tt.getcol('SCAN_NUMBER')
+    tt.done()
+
+    ranges = get_row_ranges(keys)
+    field_names = get_field_names(myms)
+
+    if by == 'field':
+        if fields == '':
+            selected = sorted(ranges.keys())
+        else:
+            selected = []
+            for field in fields.split(','):
+                # Names take precedence over IDs, as field names can be numeric
+                if field in field_names:
+                    selected.append(field_names.index(field))
+                elif field.isdigit() and int(field) < len(field_names):
+                    selected.append(int(field))
+                else:
+                    msg('Field '+field+' not found in '+myms)
+        opnames = [myms.replace('.ms','_'+field_names[ii].replace(' ','_')+'.ms') for ii in selected]
+    else:
+        if scans == '':
+            selected = sorted(ranges.keys())
+        else:
+            selected = [int(scan) for scan in scans.split(',')]
+        opnames = [myms.replace('.ms','_scan'+str(ii)+'.ms') for ii in selected]
+
+    tasks = []
+    for ii,opms in zip(selected,opnames):
+        if ii not in ranges:
+            msg('No rows for '+by+' '+str(ii)+', skipping')
+        else:
+            tasks.append((myms,opms,ranges[ii],datacol,keepcols,wtspec))
+
+    msg('Splitting '+str(len(tasks))+' '+by+'(s) from '+myms+' using '+str(jobs)+' process(es)')
+
+    pool = Pool(processes=jobs)
+    pool.starmap(split_rows,tasks)
+    pool.close()
+    pool.join()
+
+    msg('Done')
+
+
+if __name__ == '__main__':
+
+    main()
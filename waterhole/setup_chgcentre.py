@@ -1,6 +1,12 @@
 import glob
 import os
+import os.path as o
 import sys
+sys.path.append(o.abspath(o.join(o.dirname(sys.modules[__name__].__file__), "..")))
+
+
+from oxkat import generate_jobs as gen
+from oxkat import config as cfg
 
 
 def write_slurm(opfile,jobname,logfile,syscall):
@@ -25,7 +31,8 @@ def write_slurm(opfile,jobname,logfile,syscall):
 def main():
 
 
-    CHGCENTRE_CONTAINER = '/idia/software/containers/STIMELA_IMAGES/stimela_chgcentre_1.2.0.sif'
+    INFRASTRUCTURE, CONTAINER_PATH = gen.set_infrastructure(('','idia'))
+    ASTROPY_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.ASTROPY_PATTERN,True)
 
     runfile = 'submit_chgcentre_jobs.sh'
 
@@ -48,8 +55,8 @@ def main():
 
                 myms = myms[0]
                 code = 'chgcen'+scan
-                syscall = 'singularity exec '+CHGCENTRE_CONTAINER+' '
-                syscall += 'chgcentre '+myms+' '+ra+' '+dec
+                syscall = 'singularity exec '+ASTROPY_CONTAINER+' '
+                syscall += 'python3 '+cfg.TOOLS+'/rephase_MS.py --jobs 8 '+myms+' '+ra+' '+dec
 
                 slurm_file = 'SCRIPTS/slurm_'+code+'.sh'
                 log_file = 'LOGS/slurm_'+code+'.log'
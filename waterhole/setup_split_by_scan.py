@@ -35,24 +35,13 @@ def main():
         myms = sys.argv[1]
 
     INFRASTRUCTURE, CONTAINER_PATH = gen.set_infrastructure(('','idia'))
-    CASA_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.CASA_PATTERN,True)
+    ASTROPY_CONTAINER = gen.get_container(CONTAINER_PATH,cfg.ASTROPY_PATTERN,True)
 
-    casa_file = 'casa_split_by_scan.py'
     slurm_file = 'slurm_split_by_scan.sh'
     log_file = slurm_file.replace('.sh','.log')
 
-    f = open(casa_file,'w')
-    f.writelines(['tb.open("'+myms+'")\n',
-        'scans = sorted(set(tb.getcol("SCAN_NUMBER")))\n',
-        'tb.done\n',
-        'for scan in scans:\n',
-        '    scan = str(scan)\n',
-        '    opms = "'+myms+'".replace(".ms","_scan"+scan+".ms")\n',
-        '    split(vis="'+myms+'",outputvis=opms,scan=scan,datacolumn="all")\n'])
-    f.close()
-
-
-    syscall = 'singularity exec '+CASA_CONTAINER+' casa -c '+casa_file+' --nologger --log2term --nogui'
+    syscall = 'singularity exec '+ASTROPY_CONTAINER+' '
+    syscall += 'python3 '+cfg.TOOLS+'/split_MS.py --by scan --keepcols CORRECTED_DATA,MODEL_DATA --jobs 8 '+myms
 
     write_slurm(opfile=slurm_file,jobname='split',logfile=log_file,syscall=syscall )
 